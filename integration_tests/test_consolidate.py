@@ -10,9 +10,12 @@ import renderapi
 from test_data import (render_params, 
                        cons_ex_tilespec_json, 
                        cons_ex_transform_json)
-from rendermodules.module.render_module import RenderModuleException
+from rendermodules.module.render_module import (
+    RenderModuleException, StackTransitionModule)
+from rendermodules.module.schemas import StackTransitionParameters
 from rendermodules.stack.consolidate_transforms import ConsolidateTransforms, process_z, consolidate_transforms
 from rendermodules.stack import redirect_mipmaps, remap_zs
+from rendermodules.utilities import resolvedtiles_cache
 
 EPSILON = .001
 render_params['project'] = "consolidate_test"
@@ -142,8 +145,9 @@ def test_redirect_mipMapLevels(render, test_stack, tmpdir):
                 for ts in modified_tspecs])
 
 
-@pytest.mark.parametrize("remap_sectionId", [True, False])
-def test_remap_zs(render, test_stack, remap_sectionId):
+@pytest.mark.parametrize("remap_sectionId,use_cache",
+                         [(True, False), (False, False), (True, True)])
+def test_remap_zs(render, test_stack, remap_sectionId, use_cache, tmpdir):
     output_stack = "remap_zs_test"
     out_fn = "remapzsout.json"
     zValues = renderapi.stack.get_z_values_for_stack(test_stack, render=render)
@@ -156,6 +160,8 @@ def test_remap_zs(render, test_stack, remap_sectionId):
         "remap_sectionId": remap_sectionId,
         "render": render.DEFAULT_KWARGS
     })
+    if use_cache:
+        input_d["resolved_tiles_cache_dir"] = str(tmpdir)
 
     in_tspecs = renderapi.tilespec.get_tile_specs_from_stack(
         test_stack, render=render)
@@ -166,6 +172,12 @@ def test_remap_zs(render, test_stack, remap_sectionId):
     out_tspecs = renderapi.tilespec.get_tile_specs_from_stack(
         output_stack, render=render)
 
+    if use_cache:
+        for z in zValues:
+            assert os.path.isfile(
+                resolvedtiles_cache.resolvedtiles_cache_path(
+                    str(tmpdir), mod.render, test_stack, z))
+
     assert new_zValues == renderapi.stack.get_z_values_for_stack(
         output_stack, render=render)
 
@@ -183,3 +195,31 @@ def test_remap_zs(render, test_stack, remap_sectionId):
     else:
         assert ({ts.layout.sectionId for ts in in_tspecs} ==
                 {ts.layout.sectionId for ts in out_tspecs})
+
+
+def test_output_tilespecs_to_stack_chunked(render, test_stack):
+    output_stack = "chunked_output_test"
+    zValues = renderapi.stack.get_z_values_for_stack(test_stack, render=render)
+    input_d = {
+        "input_stack": test_stack,
+        "output_stack": output_stack,
+        "zValues": zValues,
+        "overwrite_zlayer": True,
+        "close_stack": True,
+        "pool_size": 2,
+        "render": render.DEFAULT_KWARGS
+    }
+    mod = StackTransitionModule(
+        input_data=input_d, schema_type=StackTransitionParameters, args=[])
+    for z in zValues:
+        resolvedtiles = mod.get_resolved_tiles_from_z(z)
+        # tilespecs consumed lazily from a generator
+        mod.output_tilespecs_to_stack(
+            (ts for ts in resolvedtiles.tilespecs),
+            sharedTransforms=resolvedtiles.transforms,
+            import_chunk_size=2, zValues=[z])
+    for z in zValues:
+        assert mod.validate_tilespecs(test_stack, output_stack, z)
+    assert (renderapi.stack.get_full_stack_metadata(
+        output_stack, render=render)['state'] == 'COMPLETE')
+    renderapi.stack.delete_stack(output_stack, render=render)
@@ -16,6 +16,8 @@ from test_data import (render_params,
                        MIPMAP_TRANSFORMS_JSON, scratch_dir)
 import os
 import copy
+import numpy
+import pathlib2 as pathlib
 
 
 
@@ -50,6 +52,48 @@ def test_generate_EM_metadata(render):
     assert len(expected_tileIds.symmetric_difference(delivered_tileIds)) == 0
 
 
+def test_image_coords_from_stage_array():
+    with open(METADATA_FILE, 'r') as f:
+        md = json.load(f)
+    img_meta = [img['img_meta'] for img in md[1]['data']]
+    expected = numpy.array([
+        generate_EM_tilespecs_from_metafile.image_coords_from_stage(
+            m['stage_pos'], m['pixel_size_x_move'], m['pixel_size_y_move'],
+            numpy.radians(m['angle'])) for m in img_meta])
+    coords = generate_EM_tilespecs_from_metafile.image_coords_from_stage_array(
+        [m['stage_pos'] for m in img_meta],
+        numpy.array([[m['pixel_size_x_move'], m['pixel_size_y_move']]
+                     for m in img_meta]),
+        numpy.radians([m['angle'] for m in img_meta]))
+    assert numpy.array_equal(coords, expected)
+
+
+def test_generate_EM_metadata_batch(render):
+    with open(METADATA_FILE, 'r') as f:
+        md = json.load(f)
+    ex = copy.deepcopy(generate_EM_tilespecs_from_metafile.example_input)
+    ex['render'] = render.make_kwargs()
+    ex.pop('z_index')
+    ex['stack'] = 'TEST_IMPORT_FROMMD_BATCH'
+    ex['metafile_uris'] = [
+        pathlib.Path(METADATA_FILE).resolve().as_uri()] * 2
+    ex['zValues'] = [1, 2]
+    ex['pool_size'] = 2
+    with tempfile.NamedTemporaryFile(suffix='.json') as probablyemptyfn:
+        outfile = probablyemptyfn.name
+    mod = generate_EM_tilespecs_from_metafile.GenerateEMTileSpecsModule(
+        input_data=ex, args=['--output_json', outfile])
+    mod.run()
+
+    expected_tileIds = {mod.tileId_from_basename(img['img_path'], z)
+                        for img in md[1]['data'] for z in ex['zValues']}
+    delivered_tileIds = set(renderapi.stack.get_stack_tileIds(
+        ex['stack'], render=render))
+
+    renderapi.stack.delete_stack(ex['stack'], render=render)
+    assert len(expected_tileIds.symmetric_difference(delivered_tileIds)) == 0
+
+
 def validate_mipmap_generated(in_ts, out_ts, levels, imgformat='tif',
                               targetmode=None, **kwargs):
     # make sure that the corresponding tiles' l0s match
@@ -160,6 +160,19 @@ def test_points_in_mask():
     assert np.all(np.isclose(w0, 0.0))
 
 
+def test_points_in_mask_multiple_regions():
+    mask = np.zeros((100, 100)).astype('uint8')
+    mask[10:30, 10:30] = 255
+    mask[60:90, 50:80] = 255
+
+    pts = np.array([
+        [20, 20], [65, 75], [50, 50], [5, 95], [-10, 20], [20, 150]],
+        dtype='float').transpose()
+    w = points_in_mask(mask, pts.tolist())
+    assert len(w) == pts.shape[1]
+    assert np.all(np.isclose(w, [1.0, 1.0, 0.0, 0.0, 0.0, 0.0]))
+
+
 def test_masks(render, downsampled_stack, downsampled_collection):
     # check that the starting point has no masks and nothing filtered
     assert len(zs_have_masks(render, downsampled_stack)) == 0
@@ -116,6 +116,39 @@ def test_create_montage_tile_pairs_no_z(render, raw_stack, tmpdir):
     assert(len(npairs) == 4)
 
 
+def test_create_montage_tile_pairs_python(
+        render, raw_stack, test_create_montage_tile_pairs, tmpdir):
+    params = {
+        "render": render_params,
+        "zNeighborDistance": 0,
+        "xyNeighborFactor": 0.9,
+        "excludeCornerNeighbors": "true",
+        "excludeSameLayerNeighbors": "false",
+        "excludeCompletelyObscuredTiles": "true",
+        "output_dir": str(tmpdir),
+        "stack": raw_stack,
+        "use_python_client": True,
+        "pool_size": 2,
+        "output_json": str(tmpdir.join("out.json"))
+    }
+
+    mod = TilePairClientModule(input_data=params, args=[])
+    mod.run()
+
+    with open(params['output_json'], 'r') as fp:
+        out_d = json.load(fp)
+    with open(out_d['tile_pair_file'], 'r') as f:
+        js = json.load(f)
+    with open(test_create_montage_tile_pairs, 'r') as f:
+        java_js = json.load(f)
+
+    # same pairs as the java client
+    def pair_ids(pairs):
+        return {frozenset([p['p']['id'], p['q']['id']]) for p in pairs}
+    assert (pair_ids(js['neighborPairs']) ==
+            pair_ids(java_js['neighborPairs']))
+
+
 @pytest.fixture(scope='module')
 def test_point_match_generation(render, test_create_montage_tile_pairs,tmpdir_factory):
     output_directory = str(tmpdir_factory.mktemp('output_json'))
@@ -128,6 +161,25 @@ def test_point_match_generation(render, test_create_montage_tile_pairs,tmpdir_fa
     assert (output_d['pairCount']>0)
     yield pointmatch_example['collection']
 
+def test_point_match_generation_local_commands(test_create_montage_tile_pairs, tmpdir):
+    params = dict(pointmatch_example, **{
+        'executor': 'local',
+        'local_pool_size': 3,
+        'pairJson': test_create_montage_tile_pairs,
+        'output_json': str(tmpdir.join('output.json'))})
+    mod = PointMatchClientModuleSpark(input_data=params, args=[])
+    cmds = mod.get_local_commands(**mod.args)
+
+    with open(test_create_montage_tile_pairs, 'r') as f:
+        npairs = len(json.load(f)['neighborPairs'])
+    assert len(cmds) == min(3, npairs)
+    assert all(PointMatchClientModuleSpark.local_className in cmd
+               for cmd in cmds)
+    # every pair is matched in exactly one partition
+    assert sum(len([c for c in cmd if 'render-parameters' in c])
+               for cmd in cmds) == 2 * npairs
+
+
 class MockSubprocessException(Exception):
     pass
 
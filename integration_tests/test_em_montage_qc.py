@@ -163,6 +163,21 @@ def test_detect_montage_defects(render,
     ex['out_html_dir'] = None
     mod = DetectMontageDefectsModule(input_data=ex, args=[])
     mod.run()
+
+    # compact plots write one html for all sections
+    ex['out_html_dir'] = output_directory
+    ex['compact_plots'] = True
+    ex['max_match_lines'] = 10
+    mod = DetectMontageDefectsModule(input_data=ex, args=[])
+    mod.run()
+
+    with open(ex['output_json'], 'r') as f:
+        data = json.load(f)
+
+    assert(len(data['output_html']) == 1)
+    assert(os.path.isfile(data['output_html'][0]))
+    section_dir = os.path.splitext(data['output_html'][0])[0] + '_sections'
+    assert(len(os.listdir(section_dir)) == 2)
     
    
 
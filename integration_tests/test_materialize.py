@@ -46,7 +46,9 @@ format_ext_mapping = {
     'TIF': 'tif',
     'JPEG': 'jpg'}
 
-def test_materialize_boxes(render, input_materializeboxes_stack, tmpdir):
+@pytest.mark.parametrize("executor", ["spark", "local", "python"])
+def test_materialize_boxes(render, input_materializeboxes_stack, tmpdir,
+                           executor):
     # TODO model this after pm test w/ spark
 
     zs_totest = renderapi.stack.get_z_values_for_stack(
@@ -60,7 +62,9 @@ def test_materialize_boxes(render, input_materializeboxes_stack, tmpdir):
             'host': render_params['host'],
             'port': render_params['port']},
         'zValues': zs_totest,
-        'rootDirectory': str(tmpdir)})
+        'rootDirectory': str(tmpdir),
+        'executor': executor,
+        'local_pool_size': 2})
 
     _ = input_params.pop('baseDataUrl', None)
     _ = input_params.pop('owner', None)
@@ -129,3 +133,29 @@ def test_materialize_boxes(render, input_materializeboxes_stack, tmpdir):
                 assert max(rows) == expected_rowmax
                 assert min(cols) == expected_colmin
                 assert max(cols) == expected_colmax
+
+
+def test_materialize_boxes_local_commands(tmpdir):
+    input_params = dict(copy.copy(materialize_sections.example_input), **{
+        'zValues': [1015, 1017],
+        'rootDirectory': str(tmpdir),
+        'executor': 'local',
+        'local_pool_size': 3,
+        'cleanUpPriorRun': True})
+    _ = input_params.pop('sparkhome', None)
+    _ = input_params.pop('masterUrl', None)
+    mod = materialize_sections.MaterializeSectionsModule(
+        input_data=input_params, args=[])
+    cmds = mod.get_local_commands(**mod.args)
+
+    assert len(cmds) == 3
+    for g, cmd in enumerate(cmds, 1):
+        assert (materialize_sections.MaterializeSectionsModule.local_className
+                in cmd)
+        # z values are the BoxClient's main parameter
+        assert cmd[-2:] == ['1015', '1017']
+        assert '--z' not in cmd
+        assert '--cleanUpPriorRun' not in cmd
+        assert '--maxImageCacheGb' not in cmd
+        assert cmd[cmd.index('--renderGroup') + 1] == str(g)
+        assert cmd[cmd.index('--numberOfRenderGroups') + 1] == '3'
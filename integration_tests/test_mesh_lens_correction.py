@@ -260,10 +260,12 @@ def test_make_mask(tmpdir_factory, output_directory):
                 basename=None)
 
 
+@pytest.mark.parametrize("in_memory_pipeline", [False, True])
 def test_mesh_lens_correction(
         render, tmpdir_factory, raw_lens_stack_2,
-        raw_lens_matches_2, output_directory):
+        raw_lens_matches_2, output_directory, in_memory_pipeline):
     example_for_input = copy.deepcopy(example)
+    example_for_input['in_memory_pipeline'] = in_memory_pipeline
     example_for_input['render'] = render_params
     example_for_input['metafile'] = os.path.join(TEST_DATA_ROOT,
                                                  "em_modules_test_data",
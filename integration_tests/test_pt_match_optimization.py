@@ -5,6 +5,7 @@ import renderapi
 import tempfile
 import json
 import numpy as np
+from unittest import mock
 
 from test_data import render_params, example_env, render_json_template, TEST_DATA_ROOT
 from rendermodules.module.render_module import RenderModuleException
@@ -81,9 +82,12 @@ def tilepair_file(render, stack_from_json):
     
     yield tile_pair_file
 
-def test_pt_match_opts_module(render, pt_match_input_stack, tilepair_file, tmpdir_factory):
+@pytest.mark.parametrize("use_opencv_sweep", [False, True])
+def test_pt_match_opts_module(render, pt_match_input_stack, tilepair_file, tmpdir_factory, use_opencv_sweep):
     output_dir = str(tmpdir_factory.mktemp('point_match_opts'))
 
+    pt_match_opts_example['use_opencv_sweep'] = use_opencv_sweep
+
     pt_match_opts_example['render'] = render_params
     pt_match_opts_example['stack'] = pt_match_input_stack
     pt_match_opts_example['outputDirectory'] = output_dir
@@ -99,3 +103,51 @@ def test_pt_match_opts_module(render, pt_match_input_stack, tilepair_file, tmpdi
 
     assert(os.path.exists(js['output_html']) and os.path.isfile(js['output_html']))
 
+
+def synthetic_tilespec(tileId, x, y, angle=0):
+    c, s = np.cos(angle), np.sin(angle)
+    return renderapi.tilespec.TileSpec(
+        tileId=tileId, z=1, width=100, height=100,
+        tforms=[renderapi.transform.AffineModel(
+            M00=c, M01=-s, M10=s, M11=c, B0=x, B1=y)])
+
+
+def test_filter_tile_pairs():
+    tspecs = {ts.tileId: ts for ts in [
+        synthetic_tilespec('a', 0, 0),
+        # bounding box disjoint from a
+        synthetic_tilespec('b', 500, 0),
+        # overlaps a, fetched by tileId as its group is not a section
+        synthetic_tilespec('c', 50, 50),
+        # diamond whose bounding box overlaps a's corner but not a
+        synthetic_tilespec('d', 160, 90, angle=np.pi / 4),
+        # not part of any pair
+        synthetic_tilespec('e', 0, 0)]}
+
+    def tile(tileId, groupId='1.0'):
+        return {'groupId': groupId, 'id': tileId}
+
+    neighborPairs = [{'p': tile('a'), 'q': tile('b')},
+                     {'p': tile('a'), 'q': tile('c', 'c')},
+                     {'p': tile('d'), 'q': tile('a')}]
+
+    with mock.patch('renderapi.stack.get_stack_sectionData',
+                    return_value=[{'sectionId': '1.0', 'z': 1.0}]), \
+            mock.patch('renderapi.tilespec.get_tile_specs_from_z',
+                       return_value=[tspecs[t] for t in 'abde']) as get_z, \
+            mock.patch('renderapi.tilespec.get_tile_spec',
+                       side_effect=lambda stack, tileId, render=None:
+                       tspecs[tileId]) as get_tile:
+        render = mock.Mock()
+        tileIds_by_group = {'1.0': {'a', 'b', 'd'}, 'c': {'c'}}
+        assert get_tilespecs_for_tileIds(
+            'stack', tileIds_by_group, render, pool_size=2) == {
+                t: tspecs[t] for t in 'abcd'}
+        # sections are fetched once and remaining tiles one by one
+        get_z.assert_called_once_with('stack', 1.0, render=render)
+        get_tile.assert_called_once_with('stack', 'c', render=render)
+
+        d = Polygon(tspecs['d'].bbox_transformed(ndiv_inner=1))
+        assert d.bounds[0] < 100 and d.bounds[1] < 100
+        assert filter_tile_pairs(
+            'stack', neighborPairs, render, pool_size=2) == [neighborPairs[1]]
@@ -1,5 +1,6 @@
 from rendermodules.module.render_module import RenderModule, RenderModuleException
 from rendermodules.module.schemas import RenderParameters
+from rendermodules.utilities import render_session
 import argschema
 from test_data import render_params
 import pytest
@@ -16,3 +17,23 @@ class NotARenderSchema(argschema.ArgSchema):
 def test_render_modules_fail():
     with pytest.raises(RenderModuleException):
         mod = RenderModule(input_data = {}, schema_type=NotARenderSchema, args=[])
+
+
+def test_render_modules_pooled_session():
+    d = {'render': render_params}
+    mod1 = RenderModule(input_data=d, args=[])
+    mod2 = RenderModule(input_data=d, args=[])
+    # modules in one process share a keep-alive session
+    assert mod1.render.session is mod2.render.session
+    assert mod1.render.session is render_session.get_session()
+
+
+def test_render_session_retry_returns_last_response():
+    session = render_session.make_session(max_retries=2)
+    retry = session.get_adapter('http://localhost').max_retries
+    # persistent 5xx reach renderapi's RenderError handling
+    assert retry.total == 2
+    assert not retry.raise_on_status
+    # deterministic render-ws errors fail fast
+    assert 500 not in retry.status_forcelist
+    assert {502, 503, 504} <= set(retry.status_forcelist)
@@ -6,9 +6,11 @@ import random
 import json
 import glob
 import copy
+import itertools
 import re
 import marshmallow as mm
 import six
+from unittest import mock
 from six.moves import urllib
 from test_data import (
         ROUGH_MONTAGE_TILESPECS_JSON,
@@ -27,15 +29,20 @@ from test_data import (
         rough_solver_example as solver_input,
         pool_size)
 from rendermodules.module.render_module import RenderModuleException
-from rendermodules.materialize.render_downsample_sections import RenderSectionAtScale, create_tilespecs_without_mipmaps
+from rendermodules.materialize.render_downsample_sections import (
+    RenderSectionAtScale, create_tilespecs_without_mipmaps,
+    render_tile_patch)
 from rendermodules.dataimport.make_montage_scapes_stack import MakeMontageScapeSectionStack, create_montage_scape_tile_specs
 from rendermodules.solver.solve import Solve_stack
 from rendermodules.rough_align.apply_rough_alignment_to_montages import (ApplyRoughAlignmentTransform,
                                                                          #example as ex1,
-                                                                         apply_rough_alignment)
+                                                                         apply_rough_alignment,
+                                                                         filter_highres_with_mask_raster)
 from rendermodules.solver.solve import Solve_stack
 import shutil
 import numpy as np
+import cv2
+import pathlib2 as pathlib
 
 
 
@@ -557,6 +564,36 @@ def modular_test_for_masks(render, ex):
                      for ts in out_resolvedtiles.tilespecs])
 
 
+def test_filter_highres_with_mask_raster():
+    # 10x10 grid of 100x100 highres tiles, lowres mask at scale 0.1
+    tspecs = []
+    for i in range(10):
+        for j in range(10):
+            tspecs.append(renderapi.tilespec.TileSpec(
+                tileId="%d_%d" % (i, j), z=1, width=100, height=100,
+                tforms=[renderapi.transform.AffineModel(
+                    B0=100 * i, B1=100 * j)]))
+    resolved = renderapi.resolvedtiles.ResolvedTiles(tspecs, [])
+    lowres = renderapi.tilespec.TileSpec(
+        tileId="lowres", z=1, width=100, height=100,
+        tforms=[renderapi.transform.AffineModel(M00=10.0, M11=10.0)])
+
+    maskim = np.zeros((100, 100)).astype('uint8') + 255
+    new = filter_highres_with_mask_raster(resolved, lowres, maskim)
+    assert len(new) == len(tspecs)
+
+    # mask out a block in the middle of tile (4, 5)
+    maskim[53:57, 43:47] = 0
+    new = filter_highres_with_mask_raster(resolved, lowres, maskim)
+    assert len(new) == len(tspecs) - 1
+    assert "4_5" not in [t.tileId for t in new]
+
+    # masked region outside of all tiles keeps everything
+    lowres.tforms.append(renderapi.transform.AffineModel(B0=5000.0))
+    new = filter_highres_with_mask_raster(resolved, lowres, maskim)
+    assert len(new) == len(tspecs)
+
+
 def test_apply_rough_alignment_with_masks(render, montage_stack, test_do_rough_alignment_python, tmpdir_factory, prealigned_stack=None, output_stack=None):
     ex = copy.deepcopy(ex1)
     ex = dict(ex, **{
@@ -596,13 +633,15 @@ def test_apply_rough_alignment_with_masks(render, montage_stack, test_do_rough_a
     renderapi.stack.delete_stack(ex['lowres_stack'], render=render)
 
     # set mask and filter the highres output
-    for apply_scale in [True, False]:
+    for apply_scale, method in itertools.product(
+            [True, False], ['polygon', 'raster']):
         renderapi.stack.clone_stack(orig_lowres, ex['lowres_stack'], render=render)
         ex['mask_input_dir'] = ROUGH_MASK_DIR
         ex['filter_montage_output_with_masks'] = True
         ex['update_lowres_with_masks'] = False
         ex['output_stack'] = "mask_montage_output_stack_with_mask"
         ex['apply_scale'] = apply_scale
+        ex['mask_filter_method'] = method
         modular_test_for_masks(render, ex)
         ntiles = len(renderapi.tilespec.get_tile_specs_from_stack(
             ex['output_stack'], render=render))
@@ -611,6 +650,7 @@ def test_apply_rough_alignment_with_masks(render, montage_stack, test_do_rough_a
         renderapi.stack.delete_stack(ex['output_stack'], render=render)
 
     # modify the input stack
+    ex['mask_filter_method'] = 'polygon'
     renderapi.stack.clone_stack(orig_lowres, ex['lowres_stack'], render=render)
     ex['mask_input_dir'] = ROUGH_MASK_DIR
     ex['filter_montage_output_with_masks'] = True
@@ -806,8 +846,59 @@ def make_montage_stack_without_downsamples(render, montage_stack, tmpdir_factory
                                     pool_size=pool_size)
 
 
+def test_render_tile_patch(tmpdir):
+    img = np.zeros((200, 100), dtype='uint8')
+    img[:, 50:] = 200
+    imgfn = str(tmpdir.join('tile.png'))
+    cv2.imwrite(imgfn, img)
+    ts = renderapi.tilespec.TileSpec(
+        tileId='tile', z=1, width=100, height=200,
+        minint=0, maxint=255,
+        imageUrl=pathlib.Path(imgfn).as_uri(),
+        tforms=[renderapi.transform.AffineModel(B0=1000., B1=2000.)])
+
+    x0, y0, patch, alpha = render_tile_patch(
+        ts, 0.5, (900., 1900.), (200, 200))
+    assert (x0, y0) == (50, 50)
+    assert patch.shape == alpha.shape == (100, 50)
+    assert np.all(alpha)
+    assert np.all(patch[:, :24] == 0)
+    assert np.all(patch[:, 26:] == 200)
+
+    # outside of the canvas
+    assert render_tile_patch(ts, 0.5, (0., 0.), (200, 200)) is None
+
+
+def test_render_downsample_python(render, montage_stack, tmpdir_factory):
+    image_directory = str(tmpdir_factory.mktemp('rough_python'))
+    ex = {
+        "render": render_params,
+        "input_stack": montage_stack,
+        "image_directory": image_directory,
+        "imgformat": "png",
+        "scale": 0.1,
+        "minZ": 1020,
+        "maxZ": 1022,
+        "use_python_renderer": True,
+        "pool_size": pool_size
+    }
+    ex['output_json'] = os.path.join(image_directory, 'output.json')
+
+    mod = RenderSectionAtScale(input_data=ex, args=[])
+    # default filtering is not implemented by the python renderer
+    with pytest.warns(UserWarning, match='doFilter'):
+        mod.run()
+
+    out_dir = os.path.join(image_directory, render_params['project'], montage_stack, 'sections_at_0.1/001/0')
+    files = glob.glob(os.path.join(out_dir, '*.png'))
+    assert(len(files) == len(range(ex['minZ'], ex['maxZ']+1)))
+    for fil in files:
+        assert cv2.imread(fil, 0).max() > 0
+
+
+@pytest.mark.parametrize("use_python_renderer", [False, True])
 def test_make_montage_stack_module_without_downsamples(
-        render, montage_stack, tmpdir_factory):
+        render, montage_stack, tmpdir_factory, use_python_renderer):
     # testing for make montage scape stack without having downsamples generated
     tmp_dir = str(tmpdir_factory.mktemp('downsample'))
     output_stack = '{}_Downsample'.format(montage_stack)
@@ -819,7 +910,8 @@ def test_make_montage_stack_module_without_downsamples(
         "imgformat": "png",
         "scale": 0.1,
         "zstart": 1020,
-        "zend": 1020
+        "zend": 1020,
+        "use_python_renderer": use_python_renderer
     }
 
     outjson = 'test_montage_scape_output.json'
@@ -836,6 +928,90 @@ def test_make_montage_stack_module_without_downsamples(
     assert os.path.basename(tsfn) == '1020.0.png'
 
 
+def test_make_montage_stack_module_missing_chunks(
+        render, montage_stack, tmpdir_factory):
+    # missing downsamples are rendered in chunks before tilespec creation
+    tmp_dir = str(tmpdir_factory.mktemp('downsample_chunks'))
+    output_stack = '{}_DownsampleChunks'.format(montage_stack)
+    params = {
+        "render": render_params,
+        "montage_stack": montage_stack,
+        "output_stack": output_stack,
+        "image_directory": tmp_dir,
+        "imgformat": "png",
+        "scale": 0.1,
+        "zstart": 1020,
+        "zend": 1022,
+        "missing_chunk_size": 2,
+        "lightweight_tilespecs": True
+    }
+
+    outjson = 'test_montage_scape_output.json'
+    mod = MakeMontageScapeSectionStack(
+        input_data=params, args=['--output_json', outjson])
+    mod.run()
+
+    tspecs = render.run(
+        renderapi.tilespec.get_tile_specs_from_stack, output_stack)
+    assert len(tspecs) == 3
+    for ts in tspecs:
+        tsfn = urllib.parse.unquote(urllib.parse.urlparse(
+            ts.ip[0].imageUrl).path)
+        assert os.path.isfile(tsfn)
+        assert os.path.basename(tsfn) == '{}.0.png'.format(int(ts.z))
+    renderapi.stack.delete_stack(output_stack, render=render)
+
+
+def test_make_montage_stack_module_all_scapes_exist(
+        render, montage_stack, tmpdir_factory):
+    # no client calls are needed when every downsample already exists
+    tmp_dir = str(tmpdir_factory.mktemp('downsample_existing'))
+    output_stack = '{}_DownsampleExisting'.format(montage_stack)
+    params = {
+        "render": render_params,
+        "montage_stack": montage_stack,
+        "output_stack": output_stack,
+        "image_directory": tmp_dir,
+        "imgformat": "png",
+        "scale": 0.1,
+        "zstart": 1020,
+        "zend": 1022,
+        "overwrite_zlayer": True
+    }
+
+    outjson = 'test_montage_scape_output.json'
+    with pytest.raises(mm.ValidationError):
+        MakeMontageScapeSectionStack(
+            input_data=dict(params, missing_chunk_size=0),
+            args=['--output_json', outjson])
+
+    mod = MakeMontageScapeSectionStack(
+        input_data=params, args=['--output_json', outjson])
+    mod.run()
+
+    # the second run finds every scape and must not render any
+    with mock.patch.object(
+            RenderSectionAtScale, 'downsample_specific_mipmapLevel',
+            side_effect=AssertionError("temp stack rendered")) as ds, \
+            mock.patch('renderapi.client.renderSectionClient',
+                       side_effect=AssertionError(
+                           "renderSectionClient called")) as rsc:
+        mod = MakeMontageScapeSectionStack(
+            input_data=params, args=['--output_json', outjson])
+        mod.run()
+    assert not ds.called
+    assert not rsc.called
+
+    tspecs = render.run(
+        renderapi.tilespec.get_tile_specs_from_stack, output_stack)
+    assert len(tspecs) == 3
+    for ts in tspecs:
+        tsfn = urllib.parse.unquote(urllib.parse.urlparse(
+            ts.ip[0].imageUrl).path)
+        assert os.path.isfile(tsfn)
+    renderapi.stack.delete_stack(output_stack, render=render)
+
+
 def test_make_montage_scape_stack_fail(render, montage_stack, downsample_sections_dir):
     output_stack = '{}_DS'.format(montage_stack)
     params = {
@@ -15,7 +15,12 @@ from test_data import (MONTAGE_SCAPES_TSPECS,
 
 from rendermodules.module.render_module import RenderModuleException
 from rendermodules.dataimport.make_montage_scapes_stack import MakeMontageScapeSectionStack, create_montage_scape_tile_specs
-from rendermodules.em_montage_qc.rough_align_qc import RoughAlignmentQC
+from rendermodules.em_montage_qc.rough_align_qc import (
+    RoughAlignmentQC, rasterize_tiles, compute_iou, compute_ious,
+    compute_distortion)
+from shapely.geometry import Polygon
+from shapely.ops import cascaded_union
+import numpy as np
 from rendermodules.solver.solve import Solve_stack
 
 
@@ -58,9 +63,56 @@ def outstack(render):
     yield output_stack
     render.run(renderapi.stack.delete_stack, output_stack)
 
-def test_rough_align_qc(render, downsample_stack, outstack, tmpdir_factory):
+def test_raster_footprint_matches_polygons():
+    def row_of_tiles(dx):
+        # neighboring tiles overlap by 10 pixels
+        tspecs = [renderapi.tilespec.TileSpec(
+            tileId=str(i), z=1, width=100, height=100,
+            tforms=[renderapi.transform.AffineModel(B0=90 * i + dx)])
+            for i in range(3)]
+        return renderapi.resolvedtiles.ResolvedTiles(tspecs, [])
+
+    bounds = {'minX': 0, 'minY': 0, 'maxX': 400, 'maxY': 100}
+    rts1 = row_of_tiles(0)
+    rts2 = row_of_tiles(30)
+    fp1 = rasterize_tiles(rts1, bounds, 1.0)
+    fp2 = rasterize_tiles(rts2, bounds, 1.0)
+    poly1 = cascaded_union([Polygon(t.bbox_transformed()) for t in rts1.tilespecs])
+    poly2 = cascaded_union([Polygon(t.bbox_transformed()) for t in rts2.tilespecs])
+
+    assert np.isclose(np.count_nonzero(fp1), poly1.area, rtol=0.02)
+    assert np.isclose(compute_iou(fp1, fp2), compute_iou(poly1, poly2), atol=0.01)
+    assert np.isclose(compute_distortion(fp1, fp2, 1)[2],
+                      compute_distortion(poly1, poly2, 1)[2], atol=0.01)
+
+
+@pytest.mark.parametrize("pool_size", [1, 2])
+@pytest.mark.parametrize("band_width", [1, 3])
+def test_compute_ious_band(band_width, pool_size):
+    zvalues = [10, 11, 12, 14, 15]
+    fps = {}
+    for z in zvalues:
+        fps[z] = np.zeros((20, 20), dtype=bool)
+        fps[z][:, :z] = True
+
+    ious = compute_ious(fps, zvalues, band_width=band_width,
+                        pool_size=pool_size)
+    assert ious.shape == (6, 2 * band_width + 1)
+    for i, z in enumerate(range(10, 16)):
+        for dz in range(-band_width, band_width + 1):
+            if dz != 0 and z in fps and (z + dz) in fps:
+                expected = min(z, z + dz) / float(max(z, z + dz))
+            else:
+                expected = 0
+            assert np.isclose(ious[i, dz + band_width], expected)
+
+
+@pytest.mark.parametrize("footprint_method", ["polygon", "raster"])
+def test_rough_align_qc(render, downsample_stack, outstack, tmpdir_factory,
+                        footprint_method):
     outdir = str(tmpdir_factory.mktemp("rough_qc"))
     ex = {}
+    ex['footprint_method'] = footprint_method
     ex['render'] = render_params
     ex['input_downsampled_stack'] = downsample_stack
     ex['output_downsampled_stack'] = outstack
@@ -2,7 +2,9 @@ import json
 import logging
 import os
 import pytest
+from unittest import mock
 import numpy as np
+from operator import itemgetter
 import renderapi
 
 from test_data import (render_params,
@@ -12,7 +14,9 @@ from test_data import (render_params,
                        swap_pt_matches2)
 from rendermodules.module.render_module import RenderModuleException
 from rendermodules.stack import swap_zs
-from rendermodules.pointmatch.swap_point_match_collections import SwapPointMatchesModule
+from rendermodules.pointmatch import swap_point_match_collections
+from rendermodules.pointmatch.swap_point_match_collections import (
+    SwapPointMatchesModule, swap_progress_file)
 
 @pytest.fixture(scope='module')
 def render():
@@ -74,13 +78,14 @@ def pt_matches2(render):
     render.run(renderapi.pointmatch.delete_collection, match_collection2)
 
 
-def test_swap_z_module(render, source_stack, target_stack, source_tspecs, target_tspecs):
+def test_swap_z_module(render, source_stack, target_stack, source_tspecs, target_tspecs, tmpdir):
     ex = {
         "render": render_params,
         "source_stack": [source_stack],
         "target_stack": [target_stack],
         "zValues": [[1015]],
-        "delete_source_stack": "False"
+        "delete_source_stack": "False",
+        "journal_directory": str(tmpdir)
     }
 
     mod = swap_zs.SwapZsModule(input_data=ex, args=['--output_json', 'output.json'])
@@ -103,6 +108,11 @@ def test_swap_z_module(render, source_stack, target_stack, source_tspecs, target
 
     assert(ts.tileId in target_tileids for ts in tspecs1)
     assert(ts.tileId in source_tileids for ts in tspecs2)
+    assert set(tspecs1) == set(target_tileids)
+    assert set(tspecs2) == set(source_tileids)
+
+    # journals are removed once a swap completes
+    assert not os.listdir(str(tmpdir))
 
     ex['source_stack'] = [source_stack, target_stack]
     ex['target_stack'] = [target_stack]
@@ -124,13 +134,101 @@ def test_swap_z_module(render, source_stack, target_stack, source_tspecs, target
     assert(ts.tileId in source_tileids for ts in tspecs1)
     assert(ts.tileId in target_tileids for ts in tspecs2)
 
-def test_swap_pt_matches_module(render, pt_matches1, pt_matches2):
+
+@pytest.fixture
+def section_db():
+    def section(stack, n):
+        return renderapi.resolvedtiles.ResolvedTiles([
+            renderapi.tilespec.TileSpec(
+                tileId="{}_{}".format(stack, i), z=1, width=10, height=10,
+                tforms=[renderapi.transform.AffineModel()])
+            for i in range(n)], [])
+
+    db = {"source": section("source", 3), "target": section("target", 2)}
+
+    def get_resolved_tiles_from_z(stack, z, render=None):
+        return renderapi.resolvedtiles.ResolvedTiles(
+            list(db[stack].tilespecs), list(db[stack].transforms))
+
+    def delete_section(stack, z, render=None):
+        db[stack] = renderapi.resolvedtiles.ResolvedTiles([], [])
+
+    def import_tilespecs(stack, tilespecs, sharedTransforms=None,
+                         render=None):
+        db[stack] = renderapi.resolvedtiles.ResolvedTiles(
+            list(db[stack].tilespecs) + list(tilespecs),
+            sharedTransforms or [])
+
+    with mock.patch('renderapi.resolvedtiles.get_resolved_tiles_from_z',
+                    get_resolved_tiles_from_z), \
+            mock.patch('renderapi.stack.delete_section', delete_section), \
+            mock.patch('renderapi.client.import_tilespecs',
+                       import_tilespecs):
+        yield db
+
+
+def section_tileIds(db, stack):
+    return sorted(ts.tileId for ts in db[stack].tilespecs)
+
+
+def test_swap_section_bulk_rollback(section_db, tmpdir):
+    original = {stack: section_tileIds(section_db, stack)
+                for stack in section_db}
+    journal_file = swap_zs.swap_journal_path(
+        str(tmpdir), "source", "target", 1)
+    restore_section = swap_zs.restore_section
+    calls = []
+
+    def failing_restore_section(render, stack, z, rts):
+        calls.append(stack)
+        if len(calls) == 2:
+            # the source section is already swapped and the journal
+            # still holds both originals
+            assert section_tileIds(section_db, "source") == \
+                original["target"]
+            assert os.path.isfile(journal_file)
+            raise renderapi.errors.RenderError("import failed")
+        restore_section(render, stack, z, rts)
+
+    with mock.patch.object(swap_zs, 'restore_section',
+                           failing_restore_section):
+        assert not swap_zs.swap_section_bulk(
+            mock.Mock(), "source", "target", 1,
+            journal_directory=str(tmpdir))
+
+    assert calls == ["source", "target", "source", "target"]
+    assert {stack: section_tileIds(section_db, stack)
+            for stack in section_db} == original
+    assert not os.path.isfile(journal_file)
+
+
+def test_rollback_swap(section_db, tmpdir):
+    original = {stack: section_tileIds(section_db, stack)
+                for stack in section_db}
+    journal_file = swap_zs.swap_journal_path(
+        str(tmpdir), "source", "target", 1)
+    swap_zs.write_swap_journal(
+        journal_file, "source", "target", 1,
+        section_db["source"], section_db["target"])
+
+    # an interrupted swap left the source section half swapped
+    swap_zs.restore_section(None, "source", 1, section_db["target"])
+    swap_zs.rollback_swap(None, journal_file)
+
+    assert {stack: section_tileIds(section_db, stack)
+            for stack in section_db} == original
+    assert not os.path.isfile(journal_file)
+
+def test_swap_pt_matches_module(render, pt_matches1, pt_matches2, tmpdir):
     example = {
         "render": render_params,
         "match_owner": render.DEFAULT_OWNER,
         "source_collection": pt_matches1,
         "target_collection": pt_matches2,
-        "zValues": [1015]
+        "zValues": [1015],
+        "batch_size": 2,
+        "use_temp_collections": False,
+        "progress_directory": str(tmpdir)
     }
 
     sgroupIds = renderapi.pointmatch.get_match_groupIds(pt_matches1, 
@@ -174,4 +272,87 @@ def test_swap_pt_matches_module(render, pt_matches1, pt_matches2):
     assert([spId in new_target_pIds for spId in source_pIds])
     assert([tpId in new_source_pIds for tpId in target_pIds])
 
-    
\ No newline at end of file
+    # progress is only kept to resume an interrupted swap
+    assert not os.path.isfile(swap_progress_file(
+        str(tmpdir), pt_matches1, pt_matches2, '1015.0'))
+
+    
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_iter_json_array(chunk_size):
+    matches = [{"pGroupId": "1.0", "pId": str(i), "qGroupId": "2.0",
+                "qId": str(i), "matches": {"p": [[1.5, 2], [3, 4]],
+                                           "q": [[1, 2], [3, 4]],
+                                           "w": [1, 1]}}
+               for i in range(20)]
+    text = json.dumps(matches, indent=1)
+
+    def chunks(t):
+        return [t[i:i + chunk_size] for i in range(0, len(t), chunk_size)]
+
+    assert list(swap_point_match_collections.iter_json_array(
+        chunks(text))) == matches
+    assert list(swap_point_match_collections.iter_json_array(
+        chunks('[ ]'))) == []
+    with pytest.raises(ValueError):
+        list(swap_point_match_collections.iter_json_array(
+            chunks(text[:-10])))
+
+
+def test_swap_pt_matches_resume(tmpdir):
+    def match(p, q, pId):
+        return {"pGroupId": p, "qGroupId": q, "pId": pId, "qId": pId}
+
+    source = [match("1.0", "1.0", "a"), match("1.0", "2.0", "b"),
+              match("2.0", "3.0", "c"), match("4.0", "5.0", "x")]
+    target = [match("1.0", "3.0", "d"), match("2.0", "2.0", "e")]
+    db = {"source": list(source), "target": list(target)}
+    fail = {"target": 1}
+
+    def touches(m, groupid):
+        return groupid in (m['pGroupId'], m['qGroupId'])
+
+    def iter_group_matches(render, collection, groupid, owner, session):
+        for m in [m for m in db[collection] if touches(m, groupid)]:
+            yield m
+
+    def delete_group_matches(render, collection, groupid, owner, session):
+        db[collection] = [m for m in db[collection]
+                          if not touches(m, groupid)]
+
+    def import_matches(collection, matches, **kwargs):
+        if fail.get(collection):
+            fail[collection] -= 1
+            raise renderapi.errors.RenderError("import failed")
+        for m in matches:
+            if m not in db[collection]:
+                db[collection].append(m)
+
+    render = mock.Mock(DEFAULT_OWNER="owner")
+    swap_kwargs = dict(batch_size=1, use_temp_collections=False,
+                       progress_directory=str(tmpdir))
+    with mock.patch.object(swap_point_match_collections,
+                           'iter_group_matches', iter_group_matches), \
+            mock.patch.object(swap_point_match_collections,
+                              'delete_group_matches', delete_group_matches), \
+            mock.patch.object(swap_point_match_collections, 'get_session'), \
+            mock.patch('renderapi.pointmatch.import_matches', import_matches):
+        swapped = swap_point_match_collections.swap_pt_matches(
+            render, "source", "target", [1, 2], **swap_kwargs)
+        # group 1 failed after its matches were deleted
+        assert swapped == [False, True]
+        assert os.path.isfile(swap_progress_file(
+            str(tmpdir), "source", "target", "1.0"))
+
+        # rerunning resumes from the staged originals
+        swapped = swap_point_match_collections.swap_pt_matches(
+            render, "source", "target", [1], **swap_kwargs)
+        assert swapped == [True]
+
+    key = itemgetter('pId')
+    assert sorted(db["source"], key=key) == sorted(
+        target + [source[-1]], key=key)
+    assert sorted(db["target"], key=key) == sorted(source[:-1], key=key)
+    # progress and staged files are removed when the swap completes
+    assert os.listdir(str(tmpdir)) == []
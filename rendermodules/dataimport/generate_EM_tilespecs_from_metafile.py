@@ -3,6 +3,7 @@
 create tilespecs from TEMCA metadata file
 """
 
+from functools import partial
 import json
 import os
 import numpy
@@ -34,100 +35,193 @@ example_input = {
 }
 
 
+def image_coords_from_stage(stage_coords, resX, resY, rotation):
+    cr = numpy.cos(rotation)
+    sr = numpy.sin(rotation)
+    x = stage_coords[0] / resX
+    y = stage_coords[1] / resY
+    return (int(x * cr + y * sr),
+            int(-x * sr + y * cr))
+
+
+def image_coords_from_stage_array(stage_coords, res, rotation):
+    """vectorized image_coords_from_stage
+
+    Parameters
+    ----------
+    stage_coords : numpy.ndarray
+        Nx2 array of stage x, y positions
+    res : numpy.ndarray
+        Nx2 array of x, y stage move per pixel
+    rotation : numpy.ndarray
+        length N array of rotations in radians
+
+    Returns
+    -------
+    numpy.ndarray
+        Nx2 integer array of image coordinates, truncated toward zero
+    """
+    cr = numpy.cos(rotation)
+    sr = numpy.sin(rotation)
+    xy = numpy.asarray(stage_coords, dtype=float) / res
+    x = xy[:, 0]
+    y = xy[:, 1]
+    return numpy.trunc(numpy.stack(
+        [x * cr + y * sr, -x * sr + y * cr], axis=1)).astype(int)
+
+
+def tileId_from_basename(fname, z):
+    return '{bname}.{z}'.format(
+        bname=os.path.splitext(os.path.basename(fname))[0],
+        z=str(float(z)))
+
+
+def sectionId_from_z(z):
+    return str(float(z))
+
+
+def ts_from_imgdata(imgdata, imgprefix, x, y,
+                    minint=0, maxint=255, maskUrl=None,
+                    width=3840, height=3840, z=None, sectionId=None,
+                    scopeId=None, cameraId=None, pixelsize=None):
+    tileId = tileId_from_basename(imgdata['img_path'], z)
+    sectionId = (sectionId_from_z(z) if sectionId is None
+                 else sectionId)
+    raw_tforms = [renderapi.transform.AffineModel(B0=x, B1=y)]
+
+    imageUrl = uri_utils.uri_join(imgprefix, imgdata['img_path'])
+
+    # imageUrl = pathlib.Path(
+    #     os.path.abspath(os.path.join(
+    #         imgdir, imgdata['img_path']))).as_uri()
+    # if maskUrl is not None:
+    #         maskUrl = pathlib.Path(maskUrl).as_uri()
+
+    ip = renderapi.image_pyramid.ImagePyramid()
+    ip[0] = renderapi.image_pyramid.MipMap(imageUrl=imageUrl,
+                                           maskUrl=maskUrl)
+    return renderapi.tilespec.TileSpec(
+        tileId=tileId, z=z,
+        width=width, height=height,
+        minint=minint, maxint=maxint,
+        tforms=raw_tforms,
+        imagePyramid=ip,
+        sectionId=sectionId, scopeId=scopeId, cameraId=cameraId,
+        imageCol=imgdata['img_meta']['raster_pos'][0],
+        imageRow=imgdata['img_meta']['raster_pos'][1],
+        stageX=imgdata['img_meta']['stage_pos'][0],
+        stageY=imgdata['img_meta']['stage_pos'][1],
+        rotation=imgdata['img_meta']['angle'], pixelsize=pixelsize)
+
+
+def tilespecs_from_metafile(metafile_z, image_prefix=None, sectionId=None,
+                            minint=0, maxint=255, maskUrl=None):
+    """build tilespecs for all images in a TEMCA metadata file
+
+    Parameters
+    ----------
+    metafile_z : tuple
+        (metafile_uri, z) pair of the metadata file and the z
+        value to assign to its tiles
+    image_prefix : str or None
+        prefix of image uris.  Defaults to the prefix of metafile_uri
+    sectionId : str or None
+        sectionId of the tiles.  Defaults to the float representation of z
+    minint : int
+        intensity value to interpret as black
+    maxint : int
+        intensity value to interpret as white
+    maskUrl : str or None
+        uri of mask to apply to all tiles
+
+    Returns
+    -------
+    list of renderapi.tilespec.TileSpec
+        tilespecs for the section
+    """
+    metafile_uri, z = metafile_z
+    meta = json.loads(uri_utils.uri_readbytes(metafile_uri))
+    roidata = meta[0]['metadata']
+    imgdata = meta[1]['data']
+
+    if not imgdata:
+        raise RenderModuleException(
+            "No relevant image metadata found for metadata at {}".format(
+                metafile_uri))
+
+    # offsets for all tiles in one pass over Nx2 stage positions
+    img_meta = [img['img_meta'] for img in imgdata]
+    img_coords = image_coords_from_stage_array(
+        [m['stage_pos'] for m in img_meta],
+        numpy.array([[m['pixel_size_x_move'], m['pixel_size_y_move']]
+                     for m in img_meta], dtype=float),
+        numpy.radians([m['angle'] for m in img_meta]))
+    xs, ys = (img_coords - img_coords.min(axis=0)).T.tolist()
+
+    # assume isotropic pixels
+    pixelsize = roidata['calibration']['highmag']['x_nm_per_pix']
+
+    imgdir = (uri_utils.uri_prefix(metafile_uri) if image_prefix is None
+              else image_prefix)
+
+    return [
+            ts_from_imgdata(
+                img, imgdir, x, y,
+                minint=minint,
+                maxint=maxint,
+                width=roidata['camera_info']['width'],
+                height=roidata['camera_info']['height'],
+                z=z, sectionId=sectionId,
+                scopeId=roidata['temca_id'],
+                cameraId=roidata['camera_info']['camera_id'],
+                pixelsize=pixelsize,
+                maskUrl=maskUrl) for img, x, y in zip(imgdata, xs, ys)]
+
+
 class GenerateEMTileSpecsModule(StackOutputModule):
     default_schema = GenerateEMTileSpecsParameters
     default_output_schema = GenerateEMTileSpecsOutput
 
-    @staticmethod
-    def image_coords_from_stage(stage_coords, resX, resY, rotation):
-        cr = numpy.cos(rotation)
-        sr = numpy.sin(rotation)
-        x = stage_coords[0] / resX
-        y = stage_coords[1] / resY
-        return (int(x * cr + y * sr),
-                int(-x * sr + y * cr))
-
-    def tileId_from_basename(self, fname):
-        return '{bname}.{z}'.format(
-            bname=os.path.splitext(os.path.basename(fname))[0],
-            z=str(float(self.zValues[0])))
-
-    @staticmethod
-    def sectionId_from_z(z):
-        return str(float(z))
-
-    def ts_from_imgdata(self, imgdata, imgprefix, x, y,
-                        minint=0, maxint=255, maskUrl=None,
-                        width=3840, height=3840, z=None, sectionId=None,
-                        scopeId=None, cameraId=None, pixelsize=None):
-        tileId = self.tileId_from_basename(imgdata['img_path'])
-        sectionId = (self.sectionId_from_z(z) if sectionId is None
-                     else sectionId)
-        raw_tforms = [renderapi.transform.AffineModel(B0=x, B1=y)]
-
-        imageUrl = uri_utils.uri_join(imgprefix, imgdata['img_path'])
-
-        # imageUrl = pathlib.Path(
-        #     os.path.abspath(os.path.join(
-        #         imgdir, imgdata['img_path']))).as_uri()
-        # if maskUrl is not None:
-        #         maskUrl = pathlib.Path(maskUrl).as_uri()
-
-        ip = renderapi.image_pyramid.ImagePyramid()
-        ip[0] = renderapi.image_pyramid.MipMap(imageUrl=imageUrl,
-                                               maskUrl=maskUrl)
-        return renderapi.tilespec.TileSpec(
-            tileId=tileId, z=z,
-            width=width, height=height,
-            minint=minint, maxint=maxint,
-            tforms=raw_tforms,
-            imagePyramid=ip,
-            sectionId=sectionId, scopeId=scopeId, cameraId=cameraId,
-            imageCol=imgdata['img_meta']['raster_pos'][0],
-            imageRow=imgdata['img_meta']['raster_pos'][1],
-            stageX=imgdata['img_meta']['stage_pos'][0],
-            stageY=imgdata['img_meta']['stage_pos'][1],
-            rotation=imgdata['img_meta']['angle'], pixelsize=pixelsize)
+    image_coords_from_stage = staticmethod(image_coords_from_stage)
+    sectionId_from_z = staticmethod(sectionId_from_z)
+
+    def tileId_from_basename(self, fname, z=None):
+        return tileId_from_basename(
+            fname, self.zValues[0] if z is None else z)
+
+    def ts_from_imgdata(self, imgdata, imgprefix, x, y, z=None, **kwargs):
+        return ts_from_imgdata(
+            imgdata, imgprefix, x, y,
+            z=(self.zValues[0] if z is None else z), **kwargs)
 
     def run(self):
         # with open(self.args['metafile'], 'r') as f:
         #     meta = json.load(f)
-        meta = json.loads(uri_utils.uri_readbytes(self.args['metafile_uri']))
-        roidata = meta[0]['metadata']
-        imgdata = meta[1]['data']
-        img_coords = {img['img_path']: self.image_coords_from_stage(
-            img['img_meta']['stage_pos'],
-            img['img_meta']['pixel_size_x_move'],
-            img['img_meta']['pixel_size_y_move'],
-            numpy.radians(img['img_meta']['angle'])) for img in imgdata}
-
-        if not imgdata:
+        metafile_uris = self.args['metafile_uris']
+        zValues = list(self.zValues)
+        if len(metafile_uris) != len(zValues):
             raise RenderModuleException(
-                "No relevant image metadata found for metadata at {}".format(
-                    self.args['metafile_uri']))
-
-        minX, minY = numpy.min(numpy.array(list(img_coords.values())), axis=0)
-        # assume isotropic pixels
-        pixelsize = roidata['calibration']['highmag']['x_nm_per_pix']
-
-        imgdir = self.args.get(
-            'image_prefix',
-            uri_utils.uri_prefix(self.args['metafile_uri']))
-
-        tspecs = [
-                self.ts_from_imgdata(
-                    img, imgdir,
-                    img_coords[img['img_path']][0] - minX,
-                    img_coords[img['img_path']][1] - minY,
-                    minint=self.args['minimum_intensity'],
-                    maxint=self.args['maximum_intensity'],
-                    width=roidata['camera_info']['width'],
-                    height=roidata['camera_info']['height'],
-                    z=self.zValues[0], sectionId=self.args.get('sectionId'),
-                    scopeId=roidata['temca_id'],
-                    cameraId=roidata['camera_info']['camera_id'],
-                    pixelsize=pixelsize,
-                    maskUrl=self.args['maskUrl_uri']) for img in imgdata]
+                "{} metafiles specified for {} z values".format(
+                    len(metafile_uris), len(zValues)))
+
+        mypartial = partial(
+            tilespecs_from_metafile,
+            image_prefix=self.args.get('image_prefix'),
+            # a custom sectionId only makes sense for a single section
+            sectionId=(self.args.get('sectionId')
+                       if len(zValues) == 1 else None),
+            minint=self.args['minimum_intensity'],
+            maxint=self.args['maximum_intensity'],
+            maskUrl=self.args['maskUrl_uri'])
+
+        metafile_zs = list(zip(metafile_uris, zValues))
+        if len(metafile_zs) == 1:
+            tspecs = mypartial(metafile_zs[0])
+        else:
+            # parse sections concurrently, then import all at once
+            with renderapi.client.WithPool(self.args['pool_size']) as pool:
+                tspecs = [ts for section_tspecs in pool.map(
+                    mypartial, metafile_zs) for ts in section_tspecs]
 
         self.output_tilespecs_to_stack(tspecs)
 
@@ -9,7 +9,7 @@ import pathlib2 as pathlib
 import renderapi
 from rendermodules.utilities.pillow_utils import Image
 from rendermodules.materialize.render_downsample_sections import (
-    RenderSectionAtScale)
+    RenderSectionAtScale, section_image_path)
 from rendermodules.dataimport.schemas import (
     MakeMontageScapeSectionStackParameters, MakeMontageScapeSectionStackOutput)
 from ..module.render_module import StackOutputModule, RenderModuleException
@@ -57,26 +57,57 @@ example = {
 }
 '''
 
+def get_template_tilespec(render, stack, z, lightweight=False):
+    """get a single tilespec from a section to template a montage scape
+
+    Parameters
+    ----------
+    render : renderapi.render.RenderClient
+        render connect object
+    stack : str
+        stack containing the section
+    z : float
+        z value of the section
+    lightweight : bool
+        fetch only the section's tile bounds and the raw tilespec of
+        its first tile rather than every tilespec in the section
+
+    Returns
+    -------
+    renderapi.tilespec.TileSpec
+        tilespec of the first tile in the section
+    """
+    if lightweight:
+        tilebounds = render.run(
+            renderapi.stack.get_tilebounds_for_z, stack, z)
+        return render.run(
+            renderapi.tilespec.get_tile_spec_raw, stack,
+            tilebounds[0]['tileId'])
+    return render.run(
+        renderapi.tilespec.get_tile_specs_from_z, stack, z)[0]
+
+
 def create_montage_scape_tile_specs(render, input_stack, image_directory,
                                     scale, project, tagstr, imgformat,
                                     Z, apply_scale=False, uuid_prefix=True,
                                     uuid_prefix_length=10,
+                                    rendered_stacks=None,
+                                    lightweight_tilespecs=False,
                                     **kwargs):
     z = Z[0]
     newz = Z[1]
 
     # create the full path to the images
     # directory structure as per Render's RenderSectionClient output
-    [q,r] = divmod(z,1000)
-    s = int(r/100)
+    filename = section_image_path(
+        image_directory, project, input_stack, scale, z, imgformat)
 
-    filename = os.path.join(image_directory,
-                            project,
-                            input_stack,
-                            'sections_at_%s' % str(scale),
-                            '%03d' % q,
-                            '%d' % s,
-                            '%s.0.%s' % (str(z), imgformat))
+    # montage scapes already rendered from another (temp) stack
+    if (not os.path.isfile(filename) and rendered_stacks is not None and
+            z in rendered_stacks):
+        filename = section_image_path(
+            image_directory, project, rendered_stacks[z], scale, z,
+            imgformat)
 
     # get stack bounds to set the image width and height
     #stackbounds = render.run(
@@ -91,13 +122,8 @@ def create_montage_scape_tile_specs(render, input_stack, image_directory,
         tempstack = RenderSectionAtScale.downsample_specific_mipmapLevel(
             [z], input_stack, image_directory=image_directory,
             scale=scale, render=render, imgformat=imgformat, **kwargs)
-        filename = os.path.join(image_directory,
-                                project,
-                                tempstack,
-                                'sections_at_%s' % str(scale),
-                                '%03d' % q,
-                                '%d' % s,
-                                '%s.0.%s' % (str(z), imgformat))
+        filename = section_image_path(
+            image_directory, project, tempstack, scale, z, imgformat)
         # render.run(renderapi.client.renderSectionClient,
         #            input_stack,
         #            image_directory,
@@ -115,20 +141,17 @@ def create_montage_scape_tile_specs(render, input_stack, image_directory,
     # stackbounds = render.run(renderapi.stack.get_stack_bounds,
     #                          input_stack)
 
-    # generate tilespec for this z
-    tilespecs = render.run(renderapi.tilespec.get_tile_specs_from_z,
-                           input_stack,
-                           z)
-
     # generate tilespec for downsampled montage
     # tileId is the first tileId from source z
-    t = tilespecs[0]
+    t = get_template_tilespec(
+        render, input_stack, z, lightweight=lightweight_tilespecs)
 
     if uuid_prefix:
         t.tileId = "ds{uid}_{tId}".format(
             uid=uuid.uuid4().hex[:uuid_prefix_length],
             tId=t.tileId)
 
+    # Image.open only parses the header, no pixel data is decoded
     with Image.open(filename) as im:
         t.width, t.height = im.size
     t.ip[0] = renderapi.image_pyramid.MipMap(
@@ -266,6 +289,38 @@ class MakeMontageScapeSectionStack(StackOutputModule):
 
         render_materialize = renderapi.connect(
             **self.render.make_kwargs(memGB=self.args['memGB_materialize']))
+
+        # render all missing montage scapes up front, in as few
+        # client calls (and temp stacks) as possible
+        missing_zs = [
+            oldz for oldz, newz in Z if not os.path.isfile(
+                section_image_path(
+                    self.args['image_directory'],
+                    self.args['render']['project'],
+                    self.args['montage_stack'],
+                    self.args['scale'], oldz, self.args['imgformat']))]
+        rendered_stacks = {}
+        chunk_size = (self.args['missing_chunk_size'] or
+                      max(len(missing_zs), 1))
+        for i in range(0, len(missing_zs), chunk_size):
+            chunk_zs = missing_zs[i:i + chunk_size]
+            self.logger.info(
+                "creating montage scapes for {} missing sections".format(
+                    len(chunk_zs)))
+            rendered_stack = (
+                RenderSectionAtScale.downsample_specific_mipmapLevel(
+                    chunk_zs, self.args['montage_stack'],
+                    image_directory=self.args['image_directory'],
+                    scale=self.args['scale'],
+                    render=render_materialize,
+                    imgformat=self.args['imgformat'],
+                    level=self.args['level'],
+                    pool_size=self.args['pool_size_materialize'],
+                    doFilter=self.args['doFilter'],
+                    fillWithNoise=self.args['fillWithNoise'],
+                    use_python_renderer=self.args['use_python_renderer']))
+            rendered_stacks.update({z: rendered_stack for z in chunk_zs})
+
         # process for each z
         mypartial = partial(
             create_montage_scape_tile_specs,
@@ -283,6 +338,9 @@ class MakeMontageScapeSectionStack(StackOutputModule):
             fillWithNoise=self.args['fillWithNoise'],
             uuid_prefix=self.args["uuid_prefix"],
             uuid_prefix_length=self.args["uuid_length"],
+            use_python_renderer=self.args['use_python_renderer'],
+            rendered_stacks=rendered_stacks,
+            lightweight_tilespecs=self.args['lightweight_tilespecs'],
             do_mp=False)
 
         with renderapi.client.WithPool(
@@ -1,6 +1,8 @@
+import glob
 import warnings
 
 import marshmallow as mm
+import pathlib2 as pathlib
 from argschema.fields import InputDir, InputFile, Str, Int, Boolean, Float, List
 from ..module.schemas import (StackTransitionParameters, InputStackParameters,
                               OutputStackParameters)
@@ -108,8 +110,16 @@ class GenerateEMTileSpecsParameters(OutputStackParameters):
         required=False,
         description="metadata file containing TEMCA acquisition data")
     metafile_uri = Str(
-        required=True, description=(
+        required=False, description=(
             "uri of metadata containing TEMCA acquisition data"))
+    metafile_uris = List(
+        Str, required=False, cli_as_single_argument=True, description=(
+            "uris of metadata for multiple sections, ingested in a single "
+            "import and paired in order with zValues"))
+    metafile_glob = Str(
+        required=False, description=(
+            "glob pattern of local metadata files to ingest, sorted and "
+            "paired in order with zValues"))
     # FIXME maskUrl and image_directory are not required -- posix_to_uri should support this
     maskUrl = InputFile(
         required=False,
@@ -159,6 +169,21 @@ class GenerateEMTileSpecsParameters(OutputStackParameters):
         rendermodules.utilities.schema_utils.posix_to_uri(
             data, "image_directory", "image_prefix")
 
+    @post_load
+    def collect_metafile_uris(self, data):
+        metafile_uris = list(data.get('metafile_uris', []))
+        if data.get('metafile_uri') is not None:
+            metafile_uris.insert(0, data['metafile_uri'])
+        if data.get('metafile_glob') is not None:
+            metafile_uris += [
+                pathlib.Path(fn).resolve().as_uri()
+                for fn in sorted(glob.glob(data['metafile_glob']))]
+        if not metafile_uris:
+            raise ValidationError(
+                "one of metafile, metafile_uri, metafile_uris "
+                "or metafile_glob must be specified")
+        data['metafile_uris'] = metafile_uris
+
 
 class GenerateEMTileSpecsOutput(DefaultSchema):
     stack = Str(required=True,
@@ -212,6 +237,19 @@ class MakeMontageScapeSectionStackParameters(OutputStackParameters):
         "Java heap size in GB for materialization"))
     pool_size_materialize = Int(required=False, default=1, description=(
         "number of processes to generate missing downsamples"))
+    use_python_renderer = Boolean(required=False, default=False, description=(
+        "generate missing downsamples in python with cv2.warpAffine "
+        "rather than with a temp stack and renderSectionClient. "
+        "doFilter, fillWithNoise, filterListName and level are not "
+        "applied (a warning is raised if set)"))
+    missing_chunk_size = Int(
+        required=False, default=None, allow_none=True,
+        validate=mm.validate.Range(min=1), description=(
+        "maximum number of missing downsamples generated per client call "
+        "(and temp stack). Default renders all missing sections in one call"))
+    lightweight_tilespecs = Boolean(required=False, default=False, description=(
+        "template montage scape tilespecs from the tile bounds and a single "
+        "raw tilespec rather than fetching all tilespecs in each section"))
     filterListName = Str(required=False, description=(
         "Apply specified filter list to all renderings"))
     uuid_prefix = Boolean(
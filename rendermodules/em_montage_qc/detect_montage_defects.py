@@ -5,12 +5,12 @@ import networkx as nx
 import numpy as np
 import renderapi
 import time
-import requests
+from rendermodules.utilities.render_session import get_session
 from six import viewkeys
 from rendermodules.residuals import compute_residuals as cr
 from rendermodules.em_montage_qc.schemas import DetectMontageDefectsParameters, DetectMontageDefectsParametersOutput
 from ..module.render_module import RenderModule, RenderModuleException
-from rendermodules.em_montage_qc.plots import plot_section_maps
+from rendermodules.em_montage_qc.plots import plot_section_maps, plot_compact_section_maps
 
 example = {
     "render":{
@@ -67,7 +67,7 @@ def detect_seams(render, stack, match_collection, match_owner, z, residual_thres
 
 def detect_disconnected_tiles(render, prestitched_stack, poststitched_stack,
                               z, pre_tilespecs=None, post_tilespecs=None):
-    session = requests.session()
+    session = get_session()
     # get the tilespecs for both prestitched_stack and poststitched_stack
 
     if pre_tilespecs is None:
@@ -89,13 +89,12 @@ def detect_disconnected_tiles(render, prestitched_stack, poststitched_stack,
     post_tileIds = []
     post_tileIds = [ts.tileId for ts in post_tilespecs]
     missing_tileIds = list(set(pre_tileIds) - set(post_tileIds))
-    session.close()
     return missing_tileIds
 
 
 def detect_stitching_gaps(render, prestitched_stack, poststitched_stack,
                           z, pre_tilespecs=None, tilespecs=None):
-    session = requests.session()
+    session = get_session()
     # setup an rtree to find overlapping tiles
     pre_ridx = rindex.Index()
     # setup a graph to store overlapping tiles
@@ -148,12 +147,11 @@ def detect_stitching_gaps(render, prestitched_stack, poststitched_stack,
         if G1.degree(n) > G2.degree(n):
             tileId = list(pre_tileIds.keys())[list(pre_tileIds.values()).index(n)]
             gap_tiles.append(tileId)
-    session.close()
     return gap_tiles
 
 
 def get_pre_post_tspecs(render, prestitched_stack, poststitched_stack, z):
-    session = requests.session()
+    session = get_session()
     pre_tilespecs = render.run(
                         renderapi.tilespec.get_tile_specs_from_z,
                         prestitched_stack,
@@ -164,7 +162,6 @@ def get_pre_post_tspecs(render, prestitched_stack, poststitched_stack, z):
                         poststitched_stack,
                         z,
                         session=session)
-    session.close()
     return pre_tilespecs, post_tilespecs
 
 
@@ -263,7 +260,19 @@ class DetectMontageDefectsModule(RenderModule):
         centroids = [seam_centroids[i] for i in seams_indices]
 
         self.args['output_html'] = []
-        if self.args['plot_sections']:
+        if self.args['plot_sections'] and self.args['compact_plots']:
+            self.args['output_html'] = plot_compact_section_maps(self.render,
+                                                                 self.args['poststitched_stack'],
+                                                                 post_tspecs,
+                                                                 matches,
+                                                                 disconnected_tiles,
+                                                                 gap_tiles,
+                                                                 seam_centroids,
+                                                                 stats,
+                                                                 zvalues,
+                                                                 out_html_dir=self.args['out_html_dir'],
+                                                                 max_match_lines=self.args['max_match_lines'])
+        elif self.args['plot_sections']:
             self.args['output_html'] = plot_section_maps(self.render, 
                                                          self.args['poststitched_stack'], 
                                                          post_tspecs, 
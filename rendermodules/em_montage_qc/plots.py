@@ -3,6 +3,7 @@ import tempfile
 import renderapi
 import requests
 import os
+import json
 import datetime
 from functools import partial
 
@@ -16,7 +17,7 @@ from bokeh.models import (HoverTool, ColumnDataSource,
                           CustomJS, CategoricalColorMapper,
                           LinearColorMapper, 
                           TapTool, OpenURL, Div, ColorBar,
-                          Slider, WidgetBox)
+                          Slider, WidgetBox, Select)
 
 try:
     # Python 2
@@ -248,3 +249,162 @@ def plot_section_maps(render, stack, post_tspecs, matches, disconnected_tiles, g
         html_files = pool.map(mypartial, args)
 
     return html_files
+
+
+def compact_section_data(tspecs, matches, dis_tiles, gap_tiles, seam_centroids, stats, z, max_match_lines=2000):
+    # columnar per-tile and per-match arrays of one section
+    tile_residual_mean = cr.compute_mean_tile_residuals(stats['tile_residuals'])
+
+    tile_ids = np.array([ts.tileId for ts in tspecs])
+    bounds = np.array([[ts.minX, ts.minY, ts.maxX, ts.maxY]
+                       for ts in tspecs], dtype=float).reshape(-1, 4)
+    # a high value for residual for tiles without residuals
+    residual = [round(float(tile_residual_mean.get(t, 50)), 2) for t in tile_ids]
+
+    gap_tiles = set(gap_tiles)
+    dis_tiles = set(dis_tiles)
+    label = ["Gap tiles" if t in gap_tiles else
+             "Disconnected tiles" if t in dis_tiles else
+             "Stitched tiles" for t in tile_ids]
+
+    # one line between tile centers per tile pair, evenly decimated
+    centers = 0.5 * (bounds[:, :2] + bounds[:, 2:])
+    index = {t: i for i, t in enumerate(tile_ids)}
+    pairs = [(index[m['qId']], index[m['pId']], len(m['matches']['q'][0]))
+             for m in matches if m['qId'] in index and m['pId'] in index]
+    if max_match_lines > 0 and len(pairs) > max_match_lines:
+        keep = np.linspace(0, len(pairs) - 1, max_match_lines).astype(int)
+        pairs = [pairs[k] for k in keep]
+    pairs = np.array(pairs, dtype=int).reshape(-1, 3)
+    c0 = centers[pairs[:, 0]]
+    c1 = centers[pairs[:, 1]]
+
+    seam_centroids = np.array(seam_centroids).reshape(-1, 2)
+
+    def rounded(a):
+        return np.round(a).astype(int).tolist()
+
+    return {
+        'z': z,
+        'tiles': {
+            'left': rounded(bounds[:, 0]),
+            'bottom': rounded(bounds[:, 1]),
+            'right': rounded(bounds[:, 2]),
+            'top': rounded(bounds[:, 3]),
+            'names': tile_ids.tolist(),
+            'labels': label,
+            'residual': residual},
+        'matches': {
+            'x0': rounded(c0[:, 0]),
+            'y0': rounded(c0[:, 1]),
+            'x1': rounded(c1[:, 0]),
+            'y1': rounded(c1[:, 1]),
+            'count': pairs[:, 2].tolist()},
+        'seams': {
+            'x': rounded(seam_centroids[:, 0]),
+            'y': rounded(seam_centroids[:, 1])},
+        'residual_range': [min(residual + [0]), max(residual + [1])],
+        'count_range': [0, int(pairs[:, 2].max()) if len(pairs) else 1]}
+
+
+def plot_compact_section_maps(render, stack, post_tspecs, matches, disconnected_tiles, gap_tiles, seam_centroids, stats, zvalues, out_html_dir=None, max_match_lines=2000):
+    # one html for all sections, each section's data is written to a
+    # separate script and only loaded when the section is selected
+    if out_html_dir is None:
+        out_html_dir = tempfile.mkdtemp()
+
+    name = "%s_%s" % (stack, datetime.datetime.now().strftime('%Y%m%d%H%S%M%f'))
+    data_dir = os.path.join(out_html_dir, "%s_sections" % name)
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    sections = {}
+    first = None
+    for args in zip(post_tspecs, matches, disconnected_tiles, gap_tiles, seam_centroids, stats, zvalues):
+        data = compact_section_data(*args, max_match_lines=max_match_lines)
+        z = str(args[6])
+        data['key'] = z
+        sections[z] = "%s/%s.js" % (os.path.basename(data_dir), z)
+        with open(os.path.join(data_dir, "%s.js" % z), 'w') as f:
+            f.write("window.montageQCSection(%s);\n" % json.dumps(data, separators=(',', ':')))
+        if first is None:
+            first = data
+
+    tile_source = ColumnDataSource(data=first['tiles'])
+    match_source = ColumnDataSource(data=first['matches'])
+    seam_source = ColumnDataSource(data=first['seams'])
+
+    TOOLS = "pan,box_zoom,reset,hover,tap,save"
+
+    label_mapper = CategoricalColorMapper(factors=['Gap tiles', 'Disconnected tiles', 'Stitched tiles'], palette=["red", "yellow", "blue"])
+    p = figure(title=str(first['z']), width=1000, height=1000, tools=TOOLS, match_aspect=True)
+    pp = p.quad(left='left', right='right', bottom='bottom', top='top', source=tile_source,
+                alpha=0.5, line_width=2, color={'field': 'labels', 'transform': label_mapper})
+    p.circle('x', 'y', source=seam_source, size=11)
+
+    urls = "%s:%d/render-ws/v1/owner/%s/project/%s/stack/%s/tile/@names/withNeighbors/jpeg-image?scale=0.1"%(render.DEFAULT_HOST, render.DEFAULT_PORT, render.DEFAULT_OWNER, render.DEFAULT_PROJECT, stack)
+    taptool = p.select(type=TapTool)
+    taptool.renderers = [pp]
+    taptool.callback = OpenURL(url=urls)
+
+    hover = p.select(dict(type=HoverTool))
+    hover.renderers = [pp]
+    hover.point_policy = "follow_mouse"
+    hover.tooltips = [("tileId", "@names"), ("x", "$x{int}"), ("y", "$y{int}")]
+
+    count_mapper = LinearColorMapper(palette=Plasma256, low=first['count_range'][0], high=first['count_range'][1])
+    mp = figure(width=800, height=700, background_fill_color='gray', tools="pan,box_zoom,reset,save", match_aspect=True)
+    mp.segment(x0='x0', y0='y0', x1='x1', y1='y1', source=match_source, line_width=2,
+               color={'field': 'count', 'transform': count_mapper})
+    mp.add_layout(ColorBar(color_mapper=count_mapper, label_standoff=12, location=(0,0)), 'right')
+    mp.xgrid.visible = False
+    mp.ygrid.visible = False
+
+    residual_mapper = LinearColorMapper(palette=Viridis256, low=first['residual_range'][0], high=first['residual_range'][1])
+    rp = figure(width=1000, height=1000, match_aspect=True)
+    rp.quad(left='left', right='right', bottom='bottom', top='top', source=tile_source,
+            fill_color={'field': 'residual', 'transform': residual_mapper}, line_color="black", line_width=0.05)
+    rp.add_layout(ColorBar(color_mapper=residual_mapper, label_standoff=12, border_line_color=None, location=(0,0)), 'right')
+    rp.xgrid.visible = False
+    rp.ygrid.visible = False
+
+    jscode = """
+        var cache = window.montageQCCache = window.montageQCCache || {};
+        window.montageQCSection = function(d) {
+            cache[d.key] = d;
+            tiles.data = d.tiles;
+            matches.data = d.matches;
+            seams.data = d.seams;
+            title.text = String(d.z);
+            residual_mapper.low = d.residual_range[0];
+            residual_mapper.high = d.residual_range[1];
+            count_mapper.low = d.count_range[0];
+            count_mapper.high = d.count_range[1];
+        };
+        var z = cb_obj.value;
+        if (cache[z] !== undefined) {
+            window.montageQCSection(cache[z]);
+        } else {
+            var s = document.createElement('script');
+            s.src = files[zs.indexOf(z)];
+            document.head.appendChild(s);
+        }
+    """
+    zs = sorted(sections, key=float)
+    select = Select(title="z", value=first['key'], options=zs)
+    select.js_on_change('value', CustomJS(args=dict(
+        tiles=tile_source, matches=match_source, seams=seam_source,
+        title=p.title, residual_mapper=residual_mapper,
+        count_mapper=count_mapper, zs=zs, files=[sections[z] for z in zs]),
+        code=jscode))
+
+    tabs = []
+    tabs.append(Panel(child=p, title="Defects"))
+    tabs.append(Panel(child=mp, title="Point match plot"))
+    tabs.append(Panel(child=rp, title="Mean tile residual"))
+
+    out_html = os.path.join(out_html_dir, "%s.html" % name)
+    output_file(out_html)
+    save(column(select, Tabs(tabs=tabs)))
+
+    return [out_html]
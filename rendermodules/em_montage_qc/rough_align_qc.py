@@ -1,13 +1,15 @@
 
 import renderapi
 import numpy as np
+import scipy.sparse
 from math import pi
 from shapely.geometry import Polygon
 from shapely.ops import cascaded_union
 import multiprocessing as mp
 import json
-import requests
+from rendermodules.utilities.render_session import get_session
 from functools import partial
+import cv2
 
 import tempfile
 
@@ -26,6 +28,8 @@ from rendermodules.utilities.matplotlib_utils import (
 import seaborn as sns
 
 from ..module.render_module import RenderModule, RenderModuleException
+from rendermodules.rough_align.downsample_mask_handler import (
+    polygon_list_from_mask)
 from rendermodules.em_montage_qc.schemas import RoughQCSchema, RoughQCOutputSchema
 
 
@@ -49,8 +53,7 @@ example = {
 
 
 def get_poly(stack, render, z):
-    s = requests.Session()
-    s.mount('http://', requests.adapters.HTTPAdapter(max_retries=5))
+    s = get_session()
     z = float(z) / 1.0
     rts = renderapi.resolvedtiles.get_resolved_tiles_from_z(stack, z, render=render, session=s)
     outpolys = []
@@ -60,6 +63,74 @@ def get_poly(stack, render, z):
     return cascaded_union(outpolys)
 
 
+def get_raster_footprint(stack, render, bounds, scale, z):
+    """section footprint as a boolean occupancy grid
+
+    Parameters
+    ----------
+    stack : str
+        render stack
+    render : renderapi.render.Render
+    bounds : dict
+        render bounds (minX, minY, maxX, maxY) of the grid,
+        should be shared by all footprints that are compared
+    scale : float
+        grid pixels per stack pixel
+    z : float
+        section to rasterize
+
+    Returns
+    -------
+    footprint : numpy array, bool
+        True where any transformed tile covers the grid pixel
+    """
+    s = get_session()
+    z = float(z) / 1.0
+    rts = renderapi.resolvedtiles.get_resolved_tiles_from_z(stack, z, render=render, session=s)
+    return rasterize_tiles(rts, bounds, scale)
+
+
+def rasterize_tiles(rts, bounds, scale):
+    """fill the transformed tile bboxes of a ResolvedTiles object
+    into an occupancy grid (see get_raster_footprint)"""
+    footprint = np.zeros(footprint_shape(bounds, scale), dtype='uint8')
+    if len(rts.tilespecs) == 0:
+        return footprint.astype(bool)
+
+    # all bboxes have the same number of points, map them in one go
+    quads = np.array([
+        tile.bbox_transformed(ndiv_inner=2, reference_tforms=rts.transforms)
+        for tile in rts.tilespecs])
+    quads = (quads - [bounds['minX'], bounds['minY']]) * scale
+    # fill tiles separately, a single fillPoly would leave overlaps empty
+    for quad in np.round(quads).astype(np.int32):
+        cv2.fillPoly(footprint, [quad], 1)
+    return footprint.astype(bool)
+
+
+def footprint_shape(bounds, scale):
+    return (int(np.ceil((bounds['maxY'] - bounds['minY']) * scale)) + 1,
+            int(np.ceil((bounds['maxX'] - bounds['minX']) * scale)) + 1)
+
+
+def footprint_to_poly(footprint, bounds, scale):
+    """shapely outline of a raster footprint in stack coordinates"""
+    tf = renderapi.transform.AffineModel(
+        M00=1.0 / scale, M11=1.0 / scale,
+        B0=bounds['minX'], B1=bounds['minY'])
+    polys = [p for p in polygon_list_from_mask(
+        footprint.astype('uint8'), transforms=[tf]) if p.area > 0]
+    return cascaded_union(polys)
+
+
+def union_bounds(bounds_list):
+    return {
+        'minX': min([b['minX'] for b in bounds_list]),
+        'minY': min([b['minY'] for b in bounds_list]),
+        'maxX': max([b['maxX'] for b in bounds_list]),
+        'maxY': max([b['maxY'] for b in bounds_list])}
+
+
 def plot_poly(axis, p, face, edge, alpha):
     (x1, xh) = axis.get_xlim()
     (y1, yh) = axis.get_ylim()
@@ -334,31 +405,105 @@ def plot_ious_bokeh(ious, zvalues):
     grid = gridplot(tabs)
     return grid
 
-def compute_ious(polys, zvalues):
-    adjlist = [(x,y) for x,y in zip(zvalues, zvalues[1:]) if abs(x-y) == 1]
-
-    #account for any missing zvalues
-    diff = [(y+x)//2 for x, y in zip(zvalues, zvalues[1:]) if abs(x-y) > 1]
-    # compute IoU
-    ious = np.zeros((len(zvalues)+len(diff), 3))
-
-    for adj in adjlist:
-        poly1 = polys[adj[0]]
-        poly2 = polys[adj[1]]
-        inter = poly1.intersection(poly2)
-        union_poly = cascaded_union([poly1, poly2])
-        try:
-            iou = inter.area / union_poly.area
-        except ZeroDivisionError:
-            iou = 0
-        i = adj[0]
-        j = adj[1]
-        ious[int(i-min(zvalues)), int(j-i+1)] = iou
-        ious[int(j-min(zvalues)), int(i-j+1)] = iou
+def compute_iou(fp1, fp2):
+    """intersection over union of two section footprints, either
+    shapely polygons or boolean arrays on the same grid"""
+    if isinstance(fp1, np.ndarray):
+        union_area = np.count_nonzero(fp1 | fp2)
+        inter_area = np.count_nonzero(fp1 & fp2)
+    else:
+        inter_area = fp1.intersection(fp2).area
+        union_area = cascaded_union([fp1, fp2]).area
+    try:
+        iou = inter_area / float(union_area)
+    except ZeroDivisionError:
+        iou = 0
+    return iou
+
+
+# footprints of the sections, set once per worker by set_footprints
+_footprints = {}
+
+
+def set_footprints(polys):
+    global _footprints
+    _footprints = polys
+
+
+def pair_iou(pair):
+    i, j = pair
+    return compute_iou(_footprints[i], _footprints[j])
+
+
+def compute_iou_matrix(polys, zvalues, band_width=1, pool_size=1):
+    """sparse matrix of footprint IoUs between sections up to
+    band_width apart
+
+    Parameters
+    ----------
+    polys : dict
+        footprint (shapely polygon or boolean array) keyed by z
+    zvalues : list
+        sorted z values present in polys
+    band_width : int
+        maximum z offset for which IoU is computed
+    pool_size : int
+        number of processes for the pairwise computations.  Each
+        worker receives the footprints once rather than per pair
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        symmetric (nz x nz) matrix indexed by z - min(zvalues)
+    """
+    zset = set(zvalues)
+    pairs = [(z, z + dz) for z in zvalues
+             for dz in range(1, band_width + 1) if z + dz in zset]
+    if pool_size > 1 and len(pairs) > 1:
+        with renderapi.client.WithPool(
+                pool_size, initializer=set_footprints,
+                initargs=(polys,)) as pool:
+            ious = pool.map(pair_iou, pairs)
+    else:
+        ious = [compute_iou(polys[i], polys[j]) for i, j in pairs]
+
+    n = int(max(zvalues) - min(zvalues)) + 1
+    rows = np.array([i for i, j in pairs], dtype=int) - int(min(zvalues))
+    cols = np.array([j for i, j in pairs], dtype=int) - int(min(zvalues))
+    upper = scipy.sparse.coo_matrix((ious, (rows, cols)), shape=(n, n))
+    return (upper + upper.T).tocsr()
+
+
+def compute_ious(polys, zvalues, band_width=1, pool_size=1):
+    """IoU of each section with its neighbors up to band_width away
+
+    Returns
+    -------
+    ious : numpy array
+        band storage of compute_iou_matrix,
+        ious[z - min(zvalues), dz + band_width] is the IoU of z and z + dz
+    """
+    iou_matrix = compute_iou_matrix(
+        polys, zvalues, band_width=band_width, pool_size=pool_size)
+    n = iou_matrix.shape[0]
+    ious = np.zeros((n, 2 * band_width + 1))
+    for dz in range(-band_width, band_width + 1):
+        if abs(dz) < n:
+            diag = iou_matrix.diagonal(dz)
+            start = max(0, -dz)
+            ious[start:start + diag.size, dz + band_width] = diag
 
     return ious
 
 def compute_distortion(inpoly, outpoly, z):
+    if isinstance(inpoly, np.ndarray):
+        dio = inpoly & ~outpoly
+        doi = outpoly & ~inpoly
+        distortion = np.round(
+            (np.count_nonzero(dio) + np.count_nonzero(doi)) /
+            float(np.count_nonzero(inpoly)), 5)
+        return dio, doi, distortion
+
     dio = inpoly.difference(outpoly)
     doi = outpoly.difference(inpoly)
     distortion = np.round((dio.area + doi.area) / inpoly.area, 5)
@@ -402,8 +547,22 @@ class RoughAlignmentQC(RenderModule):
         if len(zvalues) == 0:
             raise RenderModuleException('No valid zvalues found in stack for given range {} - {}'.format(self.args['minZ'], self.args['maxZ']))
 
-        # get the boundary polygon for each section
-        mypartial1 = partial(get_poly, self.args['output_downsampled_stack'], self.render)
+        # get the boundary polygon (or raster footprint) for each section
+        if self.args['footprint_method'] == 'raster':
+            # common grid for both stacks so footprints can be compared
+            bounds = union_bounds([
+                self.render.run(renderapi.stack.get_stack_bounds, stack)
+                for stack in [self.args['input_downsampled_stack'],
+                              self.args['output_downsampled_stack']]])
+            scale = float(self.args['raster_size']) / max(
+                bounds['maxX'] - bounds['minX'],
+                bounds['maxY'] - bounds['minY'])
+            get_footprint = partial(
+                get_raster_footprint, bounds=bounds, scale=scale)
+        else:
+            get_footprint = get_poly
+
+        mypartial1 = partial(get_footprint, self.args['output_downsampled_stack'], self.render)
         with renderapi.client.WithPool(self.args['pool_size']) as pool:
             boundary_polygons = pool.map(mypartial1, zvalues)
 
@@ -411,7 +570,7 @@ class RoughAlignmentQC(RenderModule):
         for poly, z in zip(boundary_polygons, zvalues):
             post_polys[z] = poly
 
-        mypartial2 = partial(get_poly, self.args['input_downsampled_stack'], self.render)
+        mypartial2 = partial(get_footprint, self.args['input_downsampled_stack'], self.render)
         with renderapi.client.WithPool(self.args['pool_size']) as pool:
             pre_boundary_polygons = pool.map(mypartial2, zvalues)
 
@@ -423,7 +582,9 @@ class RoughAlignmentQC(RenderModule):
             self.args['output_dir'] = tempfile.mkdtemp()
 
         # compute ious
-        ious = compute_ious(post_polys, zvalues)
+        ious = compute_ious(
+            post_polys, zvalues, band_width=self.args['iou_band_width'],
+            pool_size=self.args['pool_size'])
         #iou_plot = plot_ious(ious, zrange, self.args['output_dir'])
 
         # compute distortion
@@ -437,6 +598,14 @@ class RoughAlignmentQC(RenderModule):
             doi.append(do)
             distortion.append(dist)
 
+        if self.args['footprint_method'] == 'raster':
+            # outline the footprints for plotting
+            to_poly = partial(footprint_to_poly, bounds=bounds, scale=scale)
+            pre_boundary_polygons = list(map(to_poly, pre_boundary_polygons))
+            boundary_polygons = list(map(to_poly, boundary_polygons))
+            dio = list(map(to_poly, dio))
+            doi = list(map(to_poly, doi))
+
         dist_plt_name = None
         iou_plt_name = None
         if self.args['out_file_format'] == 'pdf': # pdf plots
@@ -47,6 +47,19 @@ class DetectMontageDefectsParameters(
         default=None,
         missing=None,
         description="Folder to save the Bokeh plot defaults to /tmp directory")
+    compact_plots = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description=("Write one html for all sections that loads each "
+                     "section's plot data on demand instead of one full "
+                     "html per section"))
+    max_match_lines = Int(
+        required=False,
+        default=2000,
+        missing=2000,
+        description=("maximum number of point match lines plotted per "
+                     "section in compact plots (0 plots all)"))
 
     @post_load
     def add_match_collection_owner(self, data):
@@ -111,7 +124,23 @@ class RoughQCSchema(RenderParameters):
         required=False,
         default="pdf",
         description="Do you want the output to be bokeh plots in html (option = 'html') or pdf files for plots (option = 'pdf', default)")
-    
+    footprint_method = Str(
+        validator=mm.validate.OneOf(['polygon', 'raster']),
+        required=False,
+        default="polygon",
+        missing="polygon",
+        description="How section footprints are computed. 'polygon' (default) unions exact tile polygons with shapely, 'raster' fills tile quads into a downsampled occupancy grid and computes IoU and distortion on the arrays")
+    iou_band_width = Int(
+        required=False,
+        default=1,
+        missing=1,
+        description="IoU is computed between each section and the sections up to this many z values away (default = 1, adjacent sections only)")
+    raster_size = Int(
+        required=False,
+        default=1024,
+        missing=1024,
+        description="size in pixels of the longest side of the occupancy grid for footprint_method='raster'")
+
 
 class RoughQCOutputSchema(argschema.schemas.DefaultSchema):
     iou_plot = OutputFile(
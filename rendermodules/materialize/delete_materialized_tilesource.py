@@ -3,6 +3,8 @@ delete materializations in a tilesource directory
 """
 import errno
 import os
+import time
+from functools import partial
 from multiprocessing.pool import ThreadPool
 
 import argschema
@@ -23,69 +25,129 @@ class DeleteMaterializedSectionsModule(argschema.ArgSchemaParser):
     default_output_schema = DeleteMaterializedSectionsOutput
 
     @staticmethod
-    def get_ts5_tiles(basedir, zs, levels=None):
+    def get_ts5_z_directories(basedir, zs, levels=None):
+        """(level, z) directories of a ts5 tilesource"""
         levels = ([int(l) for l in os.listdir(basedir) if l.isdigit()]
                   if levels is None else levels)
-        for lvl in sorted(levels):
-            lvldir = os.path.join(basedir, str(lvl))
-            for z in zs:
-                zdir = os.path.join(lvldir, str(z))
-                try:
-                    for r in os.listdir(zdir):
-                        rowdir = os.path.join(zdir, r)
-                        # python2 compatible
-                        for cfile_basename in os.listdir(rowdir):
-                            yield os.path.join(rowdir, cfile_basename)
-                except OSError as e:
-                    if e.errno == errno.ENOENT:
-                        pass
-                    else:
-                        raise
+        return [os.path.join(basedir, str(lvl), str(z))
+                for lvl in sorted(levels) for z in zs]
 
     @staticmethod
-    def get_ts5_directories(basedir, zs, levels=None):
-        levels = ([int(l) for l in os.listdir(basedir) if l.isdigit()]
-                  if levels is None else levels)
-        for lvl in sorted(levels):
-            lvldir = os.path.join(basedir, str(lvl))
-            for z in zs:
-                zdir = os.path.join(lvldir, str(z))
-                try:
-                    for r in os.listdir(zdir):
-                        rowdir = os.path.join(zdir, r)
-                        yield rowdir
-                except OSError as e:
-                    if e.errno == errno.ENOENT:
-                        pass
-                    else:
-                        raise
-                yield zdir
+    def get_row_directories(zdirs, pool=None):
+        """row directories of z directories, scanned in parallel
+        if a pool is given"""
+        def scan_zdir(zdir):
+            try:
+                return [e.path for e in os.scandir(zdir) if e.is_dir()]
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return []
+                raise
 
-    @classmethod
-    def get_z_tiles(cls, basedir, zs, tilesource, *args, **kwargs):
-        tilefn_generator_map = {5: cls.get_ts5_tiles}
-        return tilefn_generator_map[tilesource](basedir, zs, *args, **kwargs)
+        mapper = map if pool is None else pool.imap_unordered
+        for rowdirs in mapper(scan_zdir, zdirs):
+            for rowdir in rowdirs:
+                yield rowdir
+
+    @staticmethod
+    def delete_directory_files(d, dry_run=False):
+        """unlink all files in a directory
+
+        Parameters
+        ----------
+        d : str
+            directory in which to remove files
+        dry_run : bool
+            only count the files and bytes that would be removed
+
+        Returns
+        -------
+        nfiles : int
+            number of files (to be) removed
+        nbytes : int
+            total size of files (to be) removed
+        """
+        nfiles = 0
+        nbytes = 0
+        try:
+            entries = [e for e in os.scandir(d)
+                       if e.is_file(follow_symlinks=False)]
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return nfiles, nbytes
+            raise
+        for entry in entries:
+            try:
+                nbytes += entry.stat(follow_symlinks=False).st_size
+                if not dry_run:
+                    os.unlink(entry.path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            nfiles += 1
+        return nfiles, nbytes
+
+    @staticmethod
+    def remove_empty_directory(d):
+        try:
+            os.removedirs(d)  # should only remove empty directories
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
 
     @classmethod
     def get_z_directories(cls, basedir, zs, tilesource, *args, **kwargs):
-        dirname_generator_map = {5: cls.get_ts5_directories}
+        dirname_generator_map = {5: cls.get_ts5_z_directories}
         return dirname_generator_map[tilesource](basedir, zs, *args, **kwargs)
 
     def run(self):
-        pool = ThreadPool(self.args['pool_size'])
         zs = list(range(self.args['minZ'], self.args['maxZ'] + 1))
-        pool.map(os.remove, self.get_z_tiles(
-            self.args['basedir'],
-            zs,
-            self.args['tilesource']))
-        for d in self.get_z_directories(
-                self.args['basedir'], zs, self.args['tilesource']):
-            try:
-                os.removedirs(d)  # should only remove empty directories
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    raise
+        dry_run = self.args['dry_run']
+        zdirs = self.get_z_directories(
+            self.args['basedir'], zs, self.args['tilesource'])
+
+        pool = ThreadPool(self.args['pool_size'])
+        try:
+            rowdirs = list(self.get_row_directories(zdirs, pool=pool))
+
+            # one task per (level, z, row) directory
+            nfiles = 0
+            nbytes = 0
+            start = lastlog = time.time()
+            for dfiles, dbytes in pool.imap_unordered(
+                    partial(self.delete_directory_files, dry_run=dry_run),
+                    rowdirs):
+                nfiles += dfiles
+                nbytes += dbytes
+                now = time.time()
+                if now - lastlog >= self.args['progress_interval']:
+                    lastlog = now
+                    self.logger.info(
+                        "{} {} files ({} bytes) {:.1f} files/s".format(
+                            "found" if dry_run else "deleted",
+                            nfiles, nbytes, nfiles / (now - start)))
+            elapsed = time.time() - start
+            self.logger.info(
+                "{} {} files ({} bytes) in {:.1f}s".format(
+                    "would delete" if dry_run else "deleted",
+                    nfiles, nbytes, elapsed))
+
+            if not dry_run:
+                pool.map(self.remove_empty_directory, rowdirs)
+        finally:
+            pool.close()
+            pool.join()
+
+        if not dry_run:
+            # z directories without rows are removed as well
+            for d in zdirs:
+                self.remove_empty_directory(d)
 
+        self.output({
+            "num_files": nfiles,
+            "num_bytes": nbytes,
+            "dry_run": dry_run})
 
 if __name__ == "__main__":
     mod = DeleteMaterializedSectionsModule(input_data=example_input)
@@ -4,7 +4,13 @@ Materialize Render sections using BetterBox client
 """
 import os
 
+import renderapi
+from six.moves import urllib
+
+from rendermodules.materialize.materialize_ts5 import (
+    materialize_section, ts5_basedir)
 from rendermodules.module.render_module import (RenderModuleException, SparkModule)
+from rendermodules.utilities import render_session
 from rendermodules.materialize.schemas import (MaterializeSectionsParameters,
                                                MaterializeSectionsOutput)
 
@@ -36,6 +42,7 @@ class MaterializeSectionsError(RenderModuleException):
 class MaterializeSectionsModule(SparkModule):
     default_schema = MaterializeSectionsParameters
     default_output_schema = MaterializeSectionsOutput
+    local_className = "org.janelia.render.client.BoxClient"
 
     @classmethod
     def get_materialize_options(
@@ -78,9 +85,79 @@ class MaterializeSectionsModule(SparkModule):
     def get_args(cls, **kwargs):
         return cls.get_materialize_options(**kwargs)
 
+    @classmethod
+    def get_local_materialize_options(cls, zValues=None, **kwargs):
+        # the BoxClient does not take the spark-only options
+        # and takes z values as its main parameter rather than --z
+        return cls.get_materialize_options(
+            cleanUpPriorRun=None, explainPlan=None, maxImageCacheGb=None,
+            **kwargs) + ([] if zValues is None else
+                         cls.sanitize_cmd(list(zValues)))
+
+    @classmethod
+    def get_local_partition_args(cls, local_pool_size=None, renderGroup=None,
+                                 numberOfRenderGroups=None, cleanUpPriorRun=None,
+                                 explainPlan=None, maxImageCacheGb=None,
+                                 **kwargs):
+        if renderGroup is not None:
+            return [cls.get_local_materialize_options(
+                renderGroup=renderGroup,
+                numberOfRenderGroups=numberOfRenderGroups, **kwargs)]
+        numberOfRenderGroups = (local_pool_size if numberOfRenderGroups is None
+                                else numberOfRenderGroups)
+        if numberOfRenderGroups <= 1:
+            return [cls.get_local_materialize_options(**kwargs)]
+        # renderGroup is 1-indexed
+        return [cls.get_local_materialize_options(
+                    renderGroup=g, numberOfRenderGroups=numberOfRenderGroups,
+                    **kwargs)
+                for g in range(1, numberOfRenderGroups + 1)]
+
+    def get_render(self):
+        url = urllib.parse.urlparse(self.args['baseDataUrl'])
+        return renderapi.render.Render(
+            host='{}://{}'.format(url.scheme, url.hostname), port=url.port,
+            owner=self.args['owner'], project=self.args['project'],
+            session=render_session.get_session())
+
+    def run_python(self):
+        """materialize zValues in python, returns number of tiles written"""
+        unsupported = [k for k in ['maxOverviewWidthAndHeight',
+                                   'skipInterpolation', 'label',
+                                   'createIGrid']
+                       if self.args.get(k)]
+        if unsupported:
+            raise MaterializeSectionsError(
+                "{} not supported by the python executor".format(
+                    ", ".join(unsupported)))
+        render = self.get_render()
+        stack = self.args['stack']
+        width = self.args['width']
+        height = self.args['height']
+        basedir = ts5_basedir(self.args['rootDirectory'],
+                              self.args['project'], stack, width, height)
+        ntiles = 0
+        for z in self.args['zValues']:
+            ntiles += materialize_section(
+                render, stack, z, basedir, width, height,
+                maxLevel=self.args['maxLevel'],
+                ext=self.args.get('fmt', 'PNG').lower(),
+                renderGroup=self.args.get('renderGroup'),
+                numberOfRenderGroups=self.args.get('numberOfRenderGroups'),
+                forceGeneration=self.args.get('forceGeneration', False),
+                pool_size=self.args['pool_size'],
+                binaryMask=self.args.get('binaryMask'),
+                filter=self.args.get('filterListName') is not None)
+        return ntiles
+
     def run(self):
-        r = self.run_spark_command()
-        self.logger.debug("spark run completed with code {}".format(r))
+        if self.args['executor'] == 'python':
+            r = self.run_python()
+            self.logger.debug("python run wrote {} tiles".format(r))
+        else:
+            r = self.run_executor_command()
+            self.logger.debug("{} run completed with code {}".format(
+                self.args['executor'], r))
         output_d = {
             'zValues': self.args['zValues'],
             'rootDirectory': self.args['rootDirectory'],
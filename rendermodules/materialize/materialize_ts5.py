@@ -0,0 +1,224 @@
+"""
+materialize render sections to a TS5 tile pyramid in python
+
+Level 0 tiles are rendered once from the render-ws box endpoint
+(or read from an existing level 0 materialization) and every higher
+level is built by 2x reduction of the four tiles below it.  Tiles are
+written as <basedir>/<level>/<z>/<row>/<col>.<ext>, matching the
+BoxClient layout.
+"""
+import errno
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import imageio
+import numpy as np
+import renderapi
+
+logger = logging.getLogger(__name__)
+
+
+def ts5_basedir(rootDirectory, project, stack, width, height):
+    return os.path.join(
+        rootDirectory, project, stack, '{}x{}'.format(width, height))
+
+
+def ts5_tile_path(basedir, level, z, row, col, ext):
+    return os.path.join(
+        basedir, str(level), str(z), str(row), '{}.{}'.format(col, ext))
+
+
+def get_level0_boxes(render, stack, z, width, height):
+    """(row, col) of the level 0 boxes overlapping tiles in a section"""
+    tbs = render.run(renderapi.stack.get_tilebounds_for_z, stack, z)
+    boxes = set()
+    for tb in tbs:
+        rows = range(max(0, int(tb['minY'] // height)),
+                     int(tb['maxY'] // height) + 1)
+        cols = range(max(0, int(tb['minX'] // width)),
+                     int(tb['maxX'] // width) + 1)
+        boxes.update((r, c) for r in rows for c in cols)
+    return boxes
+
+
+def group_boxes(boxes, maxLevel=0, renderGroup=None,
+                numberOfRenderGroups=None):
+    """level 0 boxes of renderGroup (1-n).  Groups are contiguous
+    bands of maxLevel rows so that each group's pyramid is complete"""
+    if renderGroup is None or not numberOfRenderGroups:
+        return set(boxes)
+    toprows = sorted({r >> maxLevel for r, c in boxes})
+    grouprows = set(np.array_split(
+        np.array(toprows, dtype=int),
+        numberOfRenderGroups)[renderGroup - 1].tolist())
+    return {(r, c) for r, c in boxes if (r >> maxLevel) in grouprows}
+
+
+def morton_key(row_col):
+    """z-order key so that sibling tiles are processed together"""
+    row, col = row_col
+    key = 0
+    for bit in range(max(row, col).bit_length()):
+        key |= ((col >> bit) & 1) << (2 * bit)
+        key |= ((row >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def downsample_2x(img):
+    return cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2),
+                      interpolation=cv2.INTER_AREA)
+
+
+def write_tile(fn, img):
+    try:
+        os.makedirs(os.path.dirname(fn))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if fn.endswith('.jpg') and img.ndim == 3 and img.shape[2] == 4:
+        img = img[:, :, :3]
+    imageio.imwrite(fn, img)
+    return fn
+
+
+class TS5SectionMaterializer(object):
+    """build the TS5 pyramid of one section from its level 0 boxes
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    stack : str
+        stack to materialize
+    z : int
+        section z value
+    basedir : str
+        <rootDirectory>/<project>/<stack>/<width>x<height> directory
+    width : int
+        tile width
+    height : int
+        tile height
+    maxLevel : int
+        highest level to generate
+    ext : str
+        image extension (png, tif or jpg)
+    forceGeneration : bool
+        render level 0 tiles even if they exist on disk
+    render_kwargs : dict
+        additional keyword arguments to renderapi.image.get_bb_image
+    """
+    def __init__(self, render, stack, z, basedir, width, height, maxLevel=0,
+                 ext='png', forceGeneration=False, **render_kwargs):
+        self.render = render
+        self.stack = stack
+        self.z = z
+        self.basedir = basedir
+        self.width = width
+        self.height = height
+        self.maxLevel = maxLevel
+        self.ext = ext
+        self.forceGeneration = forceGeneration
+        self.render_kwargs = render_kwargs
+
+    def get_level0_tile(self, row_col):
+        row, col = row_col
+        fn = ts5_tile_path(self.basedir, 0, self.z, row, col, self.ext)
+        if not self.forceGeneration and os.path.isfile(fn):
+            return row_col, imageio.imread(fn), False
+        img = self.render.run(
+            renderapi.image.get_bb_image, self.stack, self.z,
+            col * self.width, row * self.height, self.width, self.height,
+            scale=1.0, **self.render_kwargs)
+        if isinstance(img, renderapi.errors.RenderError):
+            raise img
+        return row_col, img, True
+
+    def materialize(self, boxes, pool_size=8):
+        """render boxes and build their pyramid
+
+        Parameters
+        ----------
+        boxes : iterable of tuple
+            (row, col) of level 0 boxes to materialize
+        pool_size : int
+            number of rendering and of encoding threads
+
+        Returns
+        -------
+        int
+            number of tiles written
+        """
+        boxes = sorted(boxes, key=morton_key)
+        # number of existing children of each tile above level 0
+        levels = [set(boxes)]
+        nchildren = {}
+        for level in range(1, self.maxLevel + 1):
+            parents = {}
+            for r, c in levels[-1]:
+                key = (level, r // 2, c // 2)
+                parents[key] = parents.get(key, 0) + 1
+            nchildren.update(parents)
+            levels.append({(r, c) for _, r, c in parents})
+
+        pending = {}
+        results = []
+        render_pool = ThreadPool(pool_size)
+        encode_pool = ThreadPool(pool_size)
+
+        def add_tile(level, row, col, img, write=True):
+            if write:
+                results.append(encode_pool.apply_async(
+                    write_tile, (ts5_tile_path(
+                        self.basedir, level, self.z, row, col, self.ext),
+                        img)))
+            if level == self.maxLevel:
+                return
+            key = (level + 1, row // 2, col // 2)
+            if key not in pending:
+                pending[key] = [np.zeros(
+                    (2 * img.shape[0], 2 * img.shape[1]) + img.shape[2:],
+                    dtype=img.dtype), nchildren[key]]
+            canvas = pending[key]
+            y0 = (row % 2) * img.shape[0]
+            x0 = (col % 2) * img.shape[1]
+            canvas[0][y0:y0 + img.shape[0], x0:x0 + img.shape[1]] = img
+            canvas[1] -= 1
+            if canvas[1] == 0:
+                del pending[key]
+                add_tile(key[0], key[1], key[2], downsample_2x(canvas[0]))
+
+        try:
+            for (row, col), img, rendered in render_pool.imap(
+                    self.get_level0_tile, boxes):
+                add_tile(0, row, col, img, write=rendered)
+            for result in results:
+                result.get()
+        finally:
+            for pool in (render_pool, encode_pool):
+                pool.close()
+                pool.join()
+        return len(results)
+
+
+def materialize_section(render, stack, z, basedir, width, height,
+                        maxLevel=0, ext='png', renderGroup=None,
+                        numberOfRenderGroups=None, forceGeneration=False,
+                        pool_size=8, **render_kwargs):
+    """materialize the renderGroup portion of a section as TS5 tiles
+
+    Returns
+    -------
+    int
+        number of tiles written
+    """
+    boxes = group_boxes(
+        get_level0_boxes(render, stack, z, width, height),
+        maxLevel, renderGroup, numberOfRenderGroups)
+    materializer = TS5SectionMaterializer(
+        render, stack, z, basedir, width, height, maxLevel=maxLevel,
+        ext=ext, forceGeneration=forceGeneration, **render_kwargs)
+    ntiles = materializer.materialize(boxes, pool_size=pool_size)
+    logger.debug("wrote {} tiles for z {}".format(ntiles, z))
+    return ntiles
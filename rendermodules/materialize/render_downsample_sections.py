@@ -1,8 +1,14 @@
 from functools import partial
+import errno
+import os
 import time
-from multiprocessing.pool import ThreadPool
+import warnings
+import cv2
 import numpy as np
 import renderapi
+from six.moves import urllib
+from rendermodules.utilities import uri_utils
+from rendermodules.utilities.pool_utils import WithThreadPool
 from rendermodules.materialize.schemas import (RenderSectionAtScaleParameters,
                                                RenderSectionAtScaleOutput)
 from ..module.render_module import RenderModule, RenderModuleException
@@ -67,17 +73,163 @@ def create_tilespecs_without_mipmaps(render, montage_stack, level, z):
 
 
 
-# FIXME this should be provided in render-python external
-class WithThreadPool(ThreadPool):
-    def __init__(self, *args, **kwargs):
-        super(WithThreadPool, self).__init__(*args, **kwargs)
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, *args, **kwargs):
-        self.close()
-        self.join()
+def section_image_path(image_directory, project, stack, scale, z, imgformat):
+    """path of a section image as written by Render's RenderSectionClient"""
+    [q, r] = divmod(int(z), 1000)
+    s = int(r / 100)
+    return os.path.join(image_directory,
+                        project,
+                        stack,
+                        'sections_at_%s' % str(scale),
+                        '%03d' % q,
+                        '%d' % s,
+                        '%s.0.%s' % (str(int(z)), imgformat))
+
+
+def mipmap_level_for_scale(scale, levels):
+    """highest available mipmap level not coarser than scale"""
+    levels = sorted([int(l) for l in levels])
+    target = int(np.floor(np.log2(1. / scale))) if scale < 1 else 0
+    return max([l for l in levels if l <= target] or [levels[0]])
+
+
+def tile_affine(ts, reference_tforms=None, ngrid=5):
+    """3x3 affine from tile to world coordinates, fit to a grid of
+    points mapped through the tile transforms. Exact for lists of
+    affine transforms, a least squares approximation otherwise.
+    """
+    x, y = np.meshgrid(np.linspace(0, ts.width, ngrid),
+                       np.linspace(0, ts.height, ngrid))
+    src = np.vstack([x.ravel(), y.ravel()]).T
+    dst = renderapi.transform.estimate_dstpts(
+        ts.tforms, src=src, reference_tforms=reference_tforms)
+    A = np.hstack([src, np.ones((src.shape[0], 1))])
+    M = np.eye(3)
+    M[:2, :] = np.linalg.lstsq(A, dst, rcond=None)[0].T
+    return M
+
+
+def read_image_uri(uri, flags=cv2.IMREAD_ANYDEPTH):
+    img = cv2.imdecode(
+        np.frombuffer(uri_utils.uri_readbytes(uri), np.uint8), flags)
+    if img is None:
+        raise RenderModuleException("could not read image {}".format(uri))
+    return img
+
+
+def render_tile_patch(ts, scale, origin, canvas_shape, reference_tforms=None):
+    """warp the appropriate mipmap level of a tile onto the part of
+    a section canvas it covers
+
+    Parameters
+    ----------
+    ts : renderapi.tilespec.TileSpec
+    scale : float
+        canvas pixels per world pixel
+    origin : tuple
+        world (x, y) of the canvas origin
+    canvas_shape : tuple
+        (height, width) of the canvas
+    reference_tforms : list
+        shared transforms for ts
+
+    Returns
+    -------
+    tuple or None
+        (x0, y0, patch, alpha) with patch a uint8 image to be placed at
+        canvas[y0:, x0:] where alpha is True. None if the tile is
+        outside of the canvas.
+    """
+    level = mipmap_level_for_scale(scale, ts.ip.keys())
+    mipmap = ts.ip[str(level)]
+    img = read_image_uri(mipmap.imageUrl)
+
+    # mipmap pixels -> tile -> world -> canvas
+    D = np.diag([ts.width / float(img.shape[1]),
+                 ts.height / float(img.shape[0]), 1.])
+    S = np.array([[scale, 0, -scale * origin[0]],
+                  [0, scale, -scale * origin[1]],
+                  [0, 0, 1]])
+    M = S.dot(tile_affine(ts, reference_tforms)).dot(D)
+
+    h, w = img.shape[:2]
+    # rounding avoids off-by-one footprints from the least squares fit
+    corners = np.round(
+        M.dot([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]])[:2], 6)
+    x0, y0 = np.maximum(np.floor(corners.min(axis=1)), 0).astype(int)
+    x1 = int(min(np.ceil(corners[0].max()), canvas_shape[1]))
+    y1 = int(min(np.ceil(corners[1].max()), canvas_shape[0]))
+    if (x1 <= x0) or (y1 <= y0):
+        return None
+    M[:2, 2] -= [x0, y0]
+    size = (x1 - x0, y1 - y0)
+
+    minint = 0 if ts.minint is None else ts.minint
+    maxint = 255 if ts.maxint is None else ts.maxint
+    img = np.clip((img.astype('float32') - minint) *
+                  (255. / max(maxint - minint, 1)), 0, 255)
+    patch = cv2.warpAffine(img, M[:2], size, flags=cv2.INTER_LINEAR)
+
+    if mipmap.maskUrl is not None:
+        mask = cv2.resize(read_image_uri(mipmap.maskUrl, 0), (w, h),
+                          interpolation=cv2.INTER_NEAREST)
+    else:
+        mask = np.ones((h, w), dtype='uint8')
+    alpha = cv2.warpAffine(mask, M[:2], size, flags=cv2.INTER_NEAREST) > 0
+
+    return x0, y0, np.round(patch).astype('uint8'), alpha
+
+
+def render_section_at_scale(render, input_stack, image_directory, scale,
+                            imgformat, z, bounds=None, pool_size=1,
+                            project=None):
+    """render a section to an image in-process, without renderSectionClient
+
+    Tiles are warped with cv2.warpAffine from the mipmap level closest
+    to scale and painted in tilespec order onto a canvas covering
+    bounds (section bounds if None).
+    The image is written where RenderSectionClient would write it.
+
+    Returns
+    -------
+    str
+        path to the section image
+    """
+    project = render.DEFAULT_PROJECT if project is None else project
+    rts = render.run(
+        renderapi.resolvedtiles.get_resolved_tiles_from_z, input_stack, z)
+    if bounds is None:
+        bounds = render.run(
+            renderapi.stack.get_bounds_from_z, input_stack, z)
+    origin = (bounds['minX'], bounds['minY'])
+    canvas_shape = (
+        int(np.ceil((bounds['maxY'] - bounds['minY']) * scale)),
+        int(np.ceil((bounds['maxX'] - bounds['minX']) * scale)))
+    canvas = np.zeros(canvas_shape, dtype='uint8')
+
+    mypartial = partial(
+        render_tile_patch, scale=scale, origin=origin,
+        canvas_shape=canvas_shape, reference_tforms=rts.transforms)
+    with WithThreadPool(pool_size) as pool:
+        # imap keeps tilespec order for compositing
+        for result in pool.imap(mypartial, rts.tilespecs):
+            if result is None:
+                continue
+            x0, y0, patch, alpha = result
+            sub = canvas[y0:y0 + patch.shape[0], x0:x0 + patch.shape[1]]
+            sub[alpha] = patch[alpha]
+
+    filename = section_image_path(
+        image_directory, project, input_stack, scale, z, imgformat)
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if not cv2.imwrite(filename, canvas):
+        raise RenderModuleException(
+            "could not write section image {}".format(filename))
+    return filename
 
 
 class RenderSectionAtScale(RenderModule):
@@ -89,10 +241,32 @@ class RenderSectionAtScale(RenderModule):
             cls, zvalues, input_stack=None, level=1, pool_size=1,
             image_directory=None, scale=None, imgformat=None, doFilter=None,
             fillWithNoise=None, filterListName=None,
-            render=None, do_mp=True, bounds=None, **kwargs):
+            render=None, do_mp=True, bounds=None,
+            use_python_renderer=False, **kwargs):
         # temporary hack for nested pooling woes
         poolclass = (renderapi.client.WithPool if do_mp else WithThreadPool)
 
+        if use_python_renderer:
+            ignored = [k for k, v in [('doFilter', doFilter),
+                                      ('fillWithNoise', fillWithNoise),
+                                      ('filterListName', filterListName),
+                                      ('level', level not in (None, 1))]
+                       if v]
+            if ignored:
+                warnings.warn(
+                    "{} not implemented by the python renderer -- "
+                    "section images are rendered without them".format(
+                        ", ".join(ignored)), UserWarning)
+            # no temp stack needed, mipmap levels are chosen per tile
+            # threads go to tiles for a single section, else to sections
+            mypartial = partial(
+                render_section_at_scale, render, input_stack,
+                image_directory, scale, imgformat, bounds=bounds,
+                pool_size=(pool_size if len(zvalues) == 1 else 1))
+            with poolclass(pool_size) as pool:
+                pool.map(mypartial, zvalues)
+            return input_stack
+
         stack_has_mipmaps = check_stack_for_mipmaps(
             render, input_stack, zvalues)
 
@@ -80,6 +80,16 @@ class RenderSectionAtScaleParameters(RenderParameters):
         default=20,
         missing=20,
         description='number of parallel threads to use')
+    use_python_renderer = Boolean(
+        required=False,
+        default=False,
+        missing=False,
+        description=('render sections in python from the closest mipmap '
+                     'level with cv2.warpAffine instead of with a temp '
+                     'stack and renderSectionClient. Tile transforms are '
+                     'approximated by affines. doFilter, fillWithNoise '
+                     'and filterListName are not applied (a warning is '
+                     'raised if set). Default=False'))
 
     @post_load
     def validate_data(self, data):
@@ -115,6 +125,31 @@ class MaterializeSectionsParameters(
         "to JVM garbage collection."))  # TODO see Eric's
     zValues = List(Int, required=False, description=(
         "z indices to materialize"))
+    jarfile = Str(required=False, description=(
+        "spark jar to call java spark command"))
+    className = Str(required=False, description=(
+        "spark class to call"))
+    executor = Str(
+        required=False, default='spark', missing='spark',
+        validator=marshmallow.validate.OneOf(['spark', 'local', 'python']),
+        description=(
+            "'spark' to spark-submit the job, 'local' to run its "
+            "partitions as java processes on this machine, 'python' "
+            "to render level 0 boxes from render-ws and build the "
+            "higher levels by 2x reduction in python"))
+    pool_size = Int(required=False, default=8, missing=8, description=(
+        "number of rendering and of encoding threads of the "
+        "python executor"))
+
+    @post_load
+    def validate_java_options(self, data):
+        if data['executor'] != 'python':
+            missing = [k for k in ['jarfile', 'className']
+                       if data.get(k) is None]
+            if missing:
+                raise marshmallow.ValidationError(
+                    "{} required by the {} executor".format(
+                        ", ".join(missing), data['executor']))
 
 
 class MaterializeSectionsOutput(argschema.schemas.DefaultSchema):
@@ -141,6 +176,18 @@ class ValidateMaterializationParameters(argschema.ArgSchema):
         "base directory for materialization"))
     pool_size = argschema.fields.Int(required=False, description=(
         "size of pool to use to investigate image validity"))
+    header_only = argschema.fields.Boolean(
+        required=False, default=False, description=(
+            "validate tiles by checking the file size and format "
+            "header and trailer (png IEND chunk, jpg EOI marker, "
+            "tif strip extents) rather than decoding each image"))
+    scan_directories = argschema.fields.Boolean(
+        required=False, default=False, description=(
+            "find tiles by scanning each z directory in parallel "
+            "rather than enumerating the row and column range"))
+    failures_file = argschema.fields.OutputFile(required=False, description=(
+        "file to which failures are written, one per line, "
+        "as they are found"))
 
 
 class ValidateMaterializationOutput(argschema.schemas.DefaultSchema):
@@ -157,7 +204,16 @@ class DeleteMaterializedSectionsParameters(argschema.ArgSchema):
     pool_size = argschema.fields.Int(required=False, description=(
         "size of pool to use to delete files"))
     tilesource = argschema.fields.Int(required=False, default=5)
+    dry_run = argschema.fields.Boolean(required=False, default=False, description=(
+        "only estimate the number and size of files to delete"))
+    progress_interval = argschema.fields.Float(
+        required=False, default=10.0, description=(
+            "seconds between deletion progress log messages"))
 
 
 class DeleteMaterializedSectionsOutput(argschema.schemas.DefaultSchema):
-    pass
+    num_files = argschema.fields.Int(required=False, description=(
+        "number of files deleted (or to be deleted if dry_run)"))
+    num_bytes = argschema.fields.Int(required=False, description=(
+        "total size of files deleted (or to be deleted if dry_run)"))
+    dry_run = argschema.fields.Boolean(required=False)
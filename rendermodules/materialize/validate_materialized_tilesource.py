@@ -3,7 +3,9 @@
 verify and validate tilesource directory
 """
 import errno
+import itertools
 import os
+import struct
 from multiprocessing.pool import ThreadPool
 
 import argschema
@@ -30,6 +32,90 @@ example_input = {
 }
 
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+JPG_SOI = b'\xff\xd8'
+JPG_EOI = b'\xff\xd9'
+TIF_SIGNATURES = {b'II*\x00': '<', b'MM\x00*': '>'}
+BIGTIF_SIGNATURES = (b'II+\x00', b'MM\x00+')
+# (offsets, bytecounts) tag pairs for strips and tiles
+TIF_DATA_TAGS = ((273, 279), (324, 325))
+TIF_SHORT_LONG = {3: 'H', 4: 'I'}
+
+
+def png_is_complete(f, size):
+    """png starts with the signature and ends with an IEND chunk"""
+    if size < len(PNG_SIGNATURE) + len(PNG_IEND):
+        return False
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        return False
+    f.seek(size - len(PNG_IEND))
+    return f.read(len(PNG_IEND)) == PNG_IEND
+
+
+def jpg_is_complete(f, size):
+    """jpeg starts with an SOI marker and ends with an EOI marker"""
+    if size < len(JPG_SOI) + len(JPG_EOI):
+        return False
+    if f.read(len(JPG_SOI)) != JPG_SOI:
+        return False
+    f.seek(size - len(JPG_EOI))
+    return f.read(len(JPG_EOI)) == JPG_EOI
+
+
+def tif_is_complete(f, size):
+    """tiff header and first IFD are readable and the strips or tiles
+    referenced by the first IFD lie within the file"""
+    head = f.read(8)
+    if len(head) < 8:
+        return False
+    if head[:4] in BIGTIF_SIGNATURES:
+        return True
+    endian = TIF_SIGNATURES.get(head[:4])
+    if endian is None:
+        return False
+    ifd_offset = struct.unpack(endian + 'I', head[4:8])[0]
+    if ifd_offset + 2 > size:
+        return False
+    f.seek(ifd_offset)
+    nentries = struct.unpack(endian + 'H', f.read(2))[0]
+    entries = f.read(12 * nentries)
+    if len(entries) < 12 * nentries:
+        return False
+
+    tagvalues = {}
+    wanted = set(itertools.chain(*TIF_DATA_TAGS))
+    for i in range(nentries):
+        entry = entries[12 * i:12 * (i + 1)]
+        tag, fieldtype, count = struct.unpack(endian + 'HHI', entry[:8])
+        if tag not in wanted or fieldtype not in TIF_SHORT_LONG:
+            continue
+        fmt = endian + TIF_SHORT_LONG[fieldtype] * count
+        nbytes = struct.calcsize(fmt)
+        if nbytes <= 4:
+            data = entry[8:8 + nbytes]
+        else:
+            value_offset = struct.unpack(endian + 'I', entry[8:12])[0]
+            if value_offset + nbytes > size:
+                return False
+            f.seek(value_offset)
+            data = f.read(nbytes)
+        tagvalues[tag] = struct.unpack(fmt, data)
+
+    for offset_tag, count_tag in TIF_DATA_TAGS:
+        if offset_tag in tagvalues and count_tag in tagvalues:
+            return max([o + c for o, c in zip(
+                tagvalues[offset_tag], tagvalues[count_tag])]) <= size
+    return True
+
+
+header_checkers = {
+    "png": png_is_complete,
+    "jpg": jpg_is_complete,
+    "tif": tif_is_complete
+}
+
+
 class ValidateMaterialization(argschema.ArgSchemaParser):
     default_schema = ValidateMaterializationParameters
     default_output_schema = ValidateMaterializationOutput
@@ -55,10 +141,34 @@ class ValidateMaterialization(argschema.ArgSchemaParser):
                 return
         return True
 
+    @staticmethod
+    def try_check_file(fn, ext=None, allow_ENOENT=True, allow_EACCES=False):
+        """like try_load_file, but only checks the size, header and
+        trailer of the file rather than decoding it"""
+        ext = (os.path.splitext(fn)[-1].lstrip(os.extsep)
+               if ext is None else ext)
+        try:
+            with open(fn, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if not header_checkers[ext](f, size):
+                    return
+        except (IOError, struct.error) as e:
+            if isinstance(e, IOError):
+                if allow_ENOENT and (e.errno == errno.ENOENT):
+                    return True
+                elif not allow_EACCES and (e.errno == errno.EACCES):
+                    raise
+            return
+        return True
+
     @classmethod
     def try_load_tile(cls, tile_fn):
         return tile_fn if cls.try_load_file(tile_fn) is None else None
 
+    @classmethod
+    def try_check_tile(cls, tile_fn):
+        return tile_fn if cls.try_check_file(tile_fn) is None else None
+
     @staticmethod
     def rows_from_ts5(basedir, z, mmL=0):
         for d in os.listdir(os.path.join(basedir, str(mmL), str(z))):
@@ -95,17 +205,83 @@ class ValidateMaterialization(argschema.ArgSchemaParser):
                 for c in xrange(minCol, maxCol+1):
                     yield cls.tilefile_from_ts5(basedir, z, r, c, ext, mmL)
 
+    @staticmethod
+    def scan_z_tilefiles(basedir, z, minRow=None, maxRow=None,
+                         minCol=None, maxCol=None, ext="png", mmL=0):
+        """list the existing tile files of a z with os.scandir
+
+        Returns
+        -------
+        list of str
+            tile files in z within the (inclusive) row and column bounds
+        """
+        def in_bounds(i, mn, mx):
+            return (mn is None or i >= mn) and (mx is None or i <= mx)
+
+        zdir = os.path.join(basedir, str(mmL), str(z))
+        tilefiles = []
+        try:
+            rowentries = [e for e in os.scandir(zdir)
+                          if e.name.isdigit() and e.is_dir() and
+                          in_bounds(int(e.name), minRow, maxRow)]
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return tilefiles
+            raise
+        for rowentry in rowentries:
+            for entry in os.scandir(rowentry.path):
+                col, fext = os.path.splitext(entry.name)
+                if (fext == os.extsep + ext and col.isdigit() and
+                        in_bounds(int(col), minCol, maxCol)):
+                    tilefiles.append(entry.path)
+        return tilefiles
+
+    def scan_tilefiles(self, pool):
+        """tile files for all zs, scanning each z directory in the pool"""
+        def scan_z(z):
+            return self.scan_z_tilefiles(
+                self.args['basedir'], z,
+                self.args.get('minRow'), self.args.get('maxRow'),
+                self.args.get('minCol'), self.args.get('maxCol'),
+                self.args['ext'])
+        return itertools.chain.from_iterable(pool.imap_unordered(
+            scan_z, xrange(self.args['minZ'], self.args['maxZ'] + 1)))
+
     def run(self):
-        tile_files = self.build_tilefiles(
-            self.args['basedir'], self.args['minZ'], self.args['maxZ'],
-            self.args.get('minRow'), self.args.get('maxRow'),
-            self.args.get('minCol'), self.args.get('maxCol'), self.args['ext'])
         pool = ThreadPool(self.args.get('pool_size'))
+        if self.args['scan_directories']:
+            scan_pool = ThreadPool(self.args.get('pool_size'))
+            tile_files = self.scan_tilefiles(scan_pool)
+        else:
+            tile_files = self.build_tilefiles(
+                self.args['basedir'], self.args['minZ'], self.args['maxZ'],
+                self.args.get('minRow'), self.args.get('maxRow'),
+                self.args.get('minCol'), self.args.get('maxCol'),
+                self.args['ext'])
+        validate_tile = (self.try_check_tile if self.args['header_only']
+                         else self.try_load_tile)
         bad_files = filter(None, pool.imap_unordered(
-            self.try_load_tile, tile_files))
+            validate_tile, tile_files))
+
+        failures = []
+        failures_file = self.args.get('failures_file')
+        f = open(failures_file, 'w') if failures_file else None
+        try:
+            for bad_file in bad_files:
+                failures.append(bad_file)
+                if f is not None:
+                    f.write(bad_file + '\n')
+                    f.flush()
+        finally:
+            if f is not None:
+                f.close()
+            pool.close()
+            if self.args['scan_directories']:
+                scan_pool.close()
+
         self.output({
             "basedir": self.args["basedir"],
-            "failures": [i for i in bad_files]
+            "failures": failures
         })
 
 
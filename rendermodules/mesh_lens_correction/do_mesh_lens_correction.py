@@ -7,19 +7,21 @@ import os
 from shutil import copyfile
 import datetime
 from bigfeta import jsongz
+import pathlib2 as pathlib
 
 from ..module.render_module import RenderModule, RenderModuleException
 
 from .schemas \
         import MeshLensCorrectionSchema, DoMeshLensCorrectionOutputSchema
 from rendermodules.dataimport.generate_EM_tilespecs_from_metafile \
-        import GenerateEMTileSpecsModule
+        import GenerateEMTileSpecsModule, tilespecs_from_metafile
 from rendermodules.pointmatch.create_tilepairs \
-        import TilePairClientModule
+        import (TilePairClientModule, tilepairs_for_zs,
+                get_tilebounds_arrays_from_tilespecs)
 from em_stitch.lens_correction.mesh_and_solve_transform \
         import MeshAndSolveTransform
 from rendermodules.pointmatch.generate_point_matches_opencv \
-        import GeneratePointMatchesOpenCV
+        import GeneratePointMatchesOpenCV, compute_matches_for_tilepairs
 from rendermodules.utilities import uri_utils
 
 example = {
@@ -170,42 +172,101 @@ class MeshLensCorrection(RenderModule):
         args_for_pm['match_collection'] = self.args['match_collection']
         return args_for_pm
 
-    def run(self):
-        self.args['sectionId'] = self.get_sectionId_from_metafile_uri(
-                self.args['metafile_uri'])
-
-        if self.args['output_dir'] is None:
-            self.args['output_dir'] = tempfile.mkdtemp()
+    def generate_tilespecs(self):
+        maskUrl = (None if self.maskUrl is None
+                   else pathlib.Path(self.maskUrl).resolve().as_uri())
+        return tilespecs_from_metafile(
+                (self.args['metafile_uri'], self.args['z_index']),
+                sectionId=self.args['sectionId'],
+                maskUrl=maskUrl)
+
+    def generate_tilepairs(self, tilespecs):
+        tp_example = self.generate_tilepair_example()
+        return tilepairs_for_zs(
+                None, None, [self.args['z_index']], {self.args['z_index']},
+                xyNeighborFactor=tp_example['xyNeighborFactor'],
+                zNeighborDistance=tp_example['zNeighborDistance'],
+                excludeCornerNeighbors=tp_example['excludeCornerNeighbors'],
+                excludeSameLayerNeighbors=(
+                    tp_example['excludeSameLayerNeighbors']),
+                excludeCompletelyObscuredTiles=(
+                    tp_example['excludeCompletelyObscuredTiles']),
+                tilebounds=get_tilebounds_arrays_from_tilespecs(tilespecs))
+
+    def write_tilespecs(self, tilespecs):
+        stack = self.args['input_stack']
+        if stack not in self.render.run(
+                renderapi.render.get_stacks_by_owner_project):
+            self.render.run(renderapi.stack.create_stack, stack)
+        self.render.run(renderapi.stack.set_stack_state, stack, 'LOADING')
+        if self.args['overwrite_zlayer']:
+            try:
+                self.render.run(
+                        renderapi.stack.delete_section,
+                        stack, self.args['z_index'])
+            except renderapi.errors.RenderError as e:
+                self.logger.error(e)
+        self.render.run(
+                renderapi.client.import_tilespecs, stack, tilespecs)
+        if self.args['close_stack']:
+            self.render.run(
+                    renderapi.stack.set_stack_state, stack, 'COMPLETE')
+
+    def write_matches(self, matches):
+        delete_matches_if_exist(
+                self.render,
+                self.args['render']['owner'],
+                self.args['match_collection'],
+                self.args['sectionId'])
+        if len(matches) > 0:
+            self.render.run(
+                    renderapi.pointmatch.import_matches,
+                    self.args['match_collection'],
+                    matches)
 
-        if self.args['outfile'] is None:
-            outfile = tempfile.NamedTemporaryFile(suffix=".json",
-                                                  delete=False,
-                                                  dir=self.args['output_dir'])
-            outfile.close()
-            self.args['outfile'] = outfile.name
+    def run_in_memory(self):
+        """generate tilespecs, tile pairs and point matches without
+        round trips through render, writing them only if configured
 
-        out_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
-        out_file.close()
+        Returns
+        -------
+        rawtilespecs : list of renderapi.tilespec.TileSpec
+            tilespecs of the lens correction section
+        matches : list of dict
+            point matches within the section
+        """
+        rawtilespecs = self.generate_tilespecs()
 
-        args_for_input = dict(self.args)
+        if self.args['rerun_pointmatch']:
+            tilepairs = self.generate_tilepairs(rawtilespecs)
+            matches = compute_matches_for_tilepairs(
+                    rawtilespecs, tilepairs, dict(self.args),
+                    ncpus=self.args.get('ncpus', -1),
+                    logger=self.logger)
+            if self.args['write_matches']:
+                self.write_matches(matches)
+        else:
+            matches = renderapi.pointmatch.get_matches_within_group(
+                    self.args['match_collection'],
+                    self.args['sectionId'],
+                    render=self.render)
 
-        metafile = json.loads(uri_utils.uri_readbytes(
-            self.args['metafile_uri']))
+        if self.args['write_tilespecs']:
+            self.write_tilespecs(rawtilespecs)
 
-        self.maskUrl = make_mask(
-                self.args['mask_dir'],
-                metafile[0]['metadata']['camera_info']['width'],
-                metafile[0]['metadata']['camera_info']['height'],
-                self.args['mask_coords'],
-                mask_file=self.args['mask_file'],
-                basename=uri_utils.uri_basename(
-                    self.args['metafile_uri']) + '.png')
+        return rawtilespecs, matches
 
-        # argschema doesn't like the NumpyArray after processing it once
-        # we don't need it after mask creation
-        self.args['mask_coords'] = None
-        args_for_input['mask_coords'] = None
+    def run_modules(self, out_file):
+        """generate tilespecs, tile pairs and point matches by running
+        the stack, tile pair and point match modules through render
 
+        Returns
+        -------
+        rawtilespecs : list of renderapi.tilespec.TileSpec
+            tilespecs of the lens correction section
+        matches : list of dict
+            point matches within the section
+        """
         # create a stack with the lens correction tiles
         ts_example = self.generate_ts_example()
         mod = GenerateEMTileSpecsModule(input_data=ts_example,
@@ -242,11 +303,53 @@ class MeshLensCorrection(RenderModule):
                 ts_example['output_stack'],
                 ts_example['z'],
                 render=renderapi.connect(**ts_example['render']))
-        rawtdict = [t.to_dict() for t in rawtilespecs]
         matches = renderapi.pointmatch.get_matches_within_group(
                 self.args['match_collection'],
                 self.args['sectionId'],
                 render=renderapi.connect(**self.args['render']))
+        return rawtilespecs, matches
+
+    def run(self):
+        self.args['sectionId'] = self.get_sectionId_from_metafile_uri(
+                self.args['metafile_uri'])
+
+        if self.args['output_dir'] is None:
+            self.args['output_dir'] = tempfile.mkdtemp()
+
+        if self.args['outfile'] is None:
+            outfile = tempfile.NamedTemporaryFile(suffix=".json",
+                                                  delete=False,
+                                                  dir=self.args['output_dir'])
+            outfile.close()
+            self.args['outfile'] = outfile.name
+
+        out_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        out_file.close()
+
+        args_for_input = dict(self.args)
+
+        metafile = json.loads(uri_utils.uri_readbytes(
+            self.args['metafile_uri']))
+
+        self.maskUrl = make_mask(
+                self.args['mask_dir'],
+                metafile[0]['metadata']['camera_info']['width'],
+                metafile[0]['metadata']['camera_info']['height'],
+                self.args['mask_coords'],
+                mask_file=self.args['mask_file'],
+                basename=uri_utils.uri_basename(
+                    self.args['metafile_uri']) + '.png')
+
+        # argschema doesn't like the NumpyArray after processing it once
+        # we don't need it after mask creation
+        self.args['mask_coords'] = None
+        args_for_input['mask_coords'] = None
+
+        if self.args['in_memory_pipeline']:
+            rawtilespecs, matches = self.run_in_memory()
+        else:
+            rawtilespecs, matches = self.run_modules(out_file)
+        rawtdict = [t.to_dict() for t in rawtilespecs]
 
         self.logger.setLevel(self.args['log_level'])
 
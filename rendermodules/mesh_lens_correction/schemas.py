@@ -68,6 +68,25 @@ class MeshLensCorrectionSchema(PointMatchOpenCVParameters):
         default=True,
         missing=True,
         description="Close input stack")
+    in_memory_pipeline = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description=("pass tilespecs, tile pairs and point matches "
+                     "between stages in memory instead of through "
+                     "render and temporary json files"))
+    write_tilespecs = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description=("with in_memory_pipeline, write the generated "
+                     "tilespecs to input_stack"))
+    write_matches = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description=("with in_memory_pipeline, write the generated "
+                     "point matches to match_collection"))
     do_montage_QC = Bool(
         required=False,
         default=True,
@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import itertools
+from multiprocessing.pool import ThreadPool
 import subprocess
 import os
 
@@ -7,6 +9,7 @@ import renderapi
 from rendermodules.module.schemas import (
     RenderParameters, InputStackParameters, OutputStackParameters,
     SparkParameters)
+from rendermodules.utilities import render_session, resolvedtiles_cache
 
 
 class RenderModuleException(Exception):
@@ -26,7 +29,16 @@ class RenderModule(argschema.ArgSchemaParser):
         # TODO do we want output schema passed?
         super(RenderModule, self).__init__(
             schema_type=schema_type, *args, **kwargs)
-        self.render = renderapi.render.connect(**self.args['render'])
+        # share one keep-alive, retrying session per process
+        self.render = render_session.connect(**self.args['render'])
+
+    def get_resolved_tiles_from_zs(self, stack_zs, render=None,
+                                   pool_size=8):
+        """concurrently fetch resolved tiles for (stack, z) pairs
+        over the pooled session of render"""
+        render = self.render if render is None else render
+        return render_session.get_resolved_tiles_from_zs(
+            render, stack_zs, pool_size=pool_size)
 
 
 class StackInputModule(RenderModule):
@@ -36,6 +48,20 @@ class StackInputModule(RenderModule):
         super(StackInputModule, self).__init__(*args, **kwargs)
         self.input_stack = self.args['input_stack']
         self.zValues = self.args['zValues']
+        self.resolved_tiles_cache_dir = self.args.get(
+            'resolved_tiles_cache_dir')
+
+    def get_resolved_tiles_from_z(self, z, input_stack=None, render=None):
+        """get ResolvedTiles for a section of the input stack, through
+        the local cache if resolved_tiles_cache_dir is set"""
+        input_stack = self.input_stack if input_stack is None else input_stack
+        render = self.render if render is None else render
+
+        if self.resolved_tiles_cache_dir is None:
+            return renderapi.resolvedtiles.get_resolved_tiles_from_z(
+                input_stack, z, render=render)
+        return resolvedtiles_cache.get_resolved_tiles_from_z(
+            input_stack, z, render, self.resolved_tiles_cache_dir)
 
     def get_inputstack_zs(self, input_stack=None, render=None, **kwargs):
         input_stack = self.input_stack if input_stack is None else input_stack
@@ -72,17 +98,43 @@ class StackOutputModule(RenderModule):
                         else output_stack)
         render = self.render if render is None else render
 
-        for z in zValues:
+        def delete_z(z):
             try:
                 renderapi.stack.delete_section(
                     output_stack, z, render=render)
             except renderapi.errors.RenderError as e:
                 self.logger.error(e)
 
+        # deletes are independent, issue them concurrently
+        zValues = list(zValues)
+        pool_size = min(self.pool_size, len(zValues))
+        if pool_size > 1:
+            pool = ThreadPool(pool_size)
+            try:
+                pool.map(delete_z, zValues)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for z in zValues:
+                delete_z(z)
+
     def output_tilespecs_to_stack(self, tilespecs, output_stack=None,
                                   sharedTransforms=None, close_stack=None,
                                   overwrite_zlayer=None, render=None,
-                                  pool_size=None, **kwargs):
+                                  pool_size=None, import_chunk_size=None,
+                                  **kwargs):
+        """write tilespecs to the output stack
+
+        Parameters
+        ----------
+        tilespecs : list or iterable of renderapi.tilespec.TileSpec
+            tilespecs to import.  A generator is consumed lazily
+            and imported in chunks as tilespecs are produced
+        import_chunk_size : int or None
+            number of tilespecs per import.  If None, lists are
+            imported at once and iterables in chunks of 5000
+        """
         # TODO decorator to handle kwarg/attribute overrides?
         output_stack = (self.output_stack if output_stack is None
                         else output_stack)
@@ -92,7 +144,6 @@ class StackOutputModule(RenderModule):
         overwrite_zlayer = (self.overwrite_zlayer if overwrite_zlayer is None
                             else overwrite_zlayer)
 
-        renderapi.stack.create_stack(output_stack, render=render)
         if output_stack not in render.run(
                 renderapi.render.get_stacks_by_owner_project):
             # stack does not exist
@@ -105,30 +156,126 @@ class StackOutputModule(RenderModule):
         if overwrite_zlayer:
             self.delete_zValues(output_stack=output_stack, render=render,
                                 **kwargs)
-        renderapi.client.import_tilespecs_parallel(
-            output_stack, tilespecs, sharedTransforms=sharedTransforms,
-            pool_size=pool_size, close_stack=close_stack, render=render)
 
-    def validate_tilespecs(self, input_stack, output_stack, z, render=None):
-        missing_ts = []
+        if isinstance(tilespecs, list) and import_chunk_size is None:
+            renderapi.client.import_tilespecs_parallel(
+                output_stack, tilespecs, sharedTransforms=sharedTransforms,
+                pool_size=pool_size, close_stack=close_stack, render=render)
+            return
+
+        import_chunk_size = (5000 if import_chunk_size is None
+                             else import_chunk_size)
+        tilespecs = iter(tilespecs)
+        while True:
+            chunk = list(itertools.islice(tilespecs, import_chunk_size))
+            if not chunk:
+                break
+            renderapi.client.import_tilespecs_parallel(
+                output_stack, chunk, sharedTransforms=sharedTransforms,
+                pool_size=pool_size, close_stack=False, render=render)
+        if close_stack:
+            render.run(renderapi.stack.set_stack_state,
+                       output_stack, 'COMPLETE')
 
+    def validate_tilespecs(self, input_stack, output_stack, z, render=None):
         render = self.render if render is None else render
 
+        # tile bounds are much lighter than resolved tiles
+        in_ids = {tb['tileId'] for tb in render.run(
+            renderapi.stack.get_tilebounds_for_z, input_stack, z)}
+        out_ids = {tb['tileId'] for tb in render.run(
+            renderapi.stack.get_tilebounds_for_z, output_stack, z)}
+        if in_ids == out_ids:
+            return True
+
+        # confirm mismatches against the full resolved tiles
         input_rs = renderapi.resolvedtiles.get_resolved_tiles_from_z(input_stack, z, render=render)
         output_rs = renderapi.resolvedtiles.get_resolved_tiles_from_z(output_stack, z, render=render)
-        in_ids = set([t.tileId for t in input_rs.tilespecs])                                                                               
-        out_ids = set([t.tileId for t in output_rs.tilespecs])                                                                             
+        in_ids = set([t.tileId for t in input_rs.tilespecs])
+        out_ids = set([t.tileId for t in output_rs.tilespecs])
         if in_ids != out_ids: # pragma no cover
             return False
         else:
             return True
-        
 
 
 class StackTransitionModule(StackOutputModule, StackInputModule):
     def __init__(self, *args, **kwargs):
         super(StackTransitionModule, self).__init__(*args, **kwargs)
 
+    def transform_sections(self, rewrite_section, zValues=None,
+                           input_stack=None, output_stack=None,
+                           delete_zValues=None, close_stack=None,
+                           overwrite_zlayer=None, render=None,
+                           pool_size=None):
+        """rewrite the tilespecs of input stack sections into the output
+        stack, fetching, rewriting and importing sections concurrently.
+        The output stack is set to LOADING once before any import and
+        closed once after all sections are written.
+
+        Parameters
+        ----------
+        rewrite_section : callable
+            function rewrite_section(z, resolvedtiles) returning
+            (tilespecs, sharedTransforms) to import for section z.
+            Called from worker threads, so it should not depend on
+            shared mutable state
+        zValues : list of float
+            input stack sections to rewrite.  Defaults to self.zValues
+        delete_zValues : list of float
+            output stack sections removed if overwrite_zlayer.
+            Defaults to zValues
+
+        Returns
+        -------
+        list of float
+            zValues that were rewritten
+        """
+        zValues = list(self.zValues if zValues is None else zValues)
+        input_stack = self.input_stack if input_stack is None else input_stack
+        output_stack = (self.output_stack if output_stack is None
+                        else output_stack)
+        render = self.render if render is None else render
+        close_stack = self.close_stack if close_stack is None else close_stack
+        pool_size = self.pool_size if pool_size is None else pool_size
+        overwrite_zlayer = (self.overwrite_zlayer if overwrite_zlayer is None
+                            else overwrite_zlayer)
+        delete_zValues = zValues if delete_zValues is None else delete_zValues
+
+        if output_stack not in render.run(
+                renderapi.render.get_stacks_by_owner_project):
+            render.run(renderapi.stack.create_stack, output_stack)
+        render.run(renderapi.stack.set_stack_state, output_stack, 'LOADING')
+
+        if overwrite_zlayer:
+            self.delete_zValues(zValues=delete_zValues,
+                                output_stack=output_stack, render=render)
+
+        def process_z(z):
+            tilespecs, sharedTransforms = rewrite_section(
+                z, self.get_resolved_tiles_from_z(
+                    z, input_stack=input_stack, render=render))
+            if tilespecs:
+                renderapi.client.import_tilespecs(
+                    output_stack, tilespecs,
+                    sharedTransforms=sharedTransforms, render=render)
+            return z
+
+        # pool threads prefetch later sections while earlier ones import
+        pool = ThreadPool(max(1, min(pool_size, len(zValues))))
+        try:
+            for z in pool.imap(process_z, zValues):
+                self.logger.debug("wrote section {} to {}".format(
+                    z, output_stack))
+        finally:
+            pool.close()
+            pool.join()
+
+        if close_stack:
+            render.run(renderapi.stack.set_stack_state,
+                       output_stack, 'COMPLETE')
+        return zValues
+
 
 class SparkModuleError(RenderModuleException):
     """error thrown by rendermodules spark modules"""
@@ -137,6 +284,9 @@ class SparkModuleError(RenderModuleException):
 class SparkModule(argschema.ArgSchemaParser):
     default_schema = SparkParameters
 
+    # non-spark java client run per partition by the local executor
+    local_className = None
+
     @staticmethod
     def sanitize_cmd(cmd):
         def jbool_str(c):
@@ -194,6 +344,49 @@ class SparkModule(argschema.ArgSchemaParser):
         return subprocess.check_call(
             self.get_spark_command(**self.args), **kwargs)
 
+    @classmethod
+    def get_local_call(cls, jarfile=None, memory=None, driverMemory=None,
+                       **kwargs):
+        javamem = driverMemory if memory is None else memory
+        return cls.sanitize_cmd(
+            ['java'] +
+            ([] if javamem is None else ['-Xmx{}'.format(javamem)]) +
+            ['-cp', jarfile, cls.local_className])
+
+    @classmethod
+    def get_local_partition_args(cls, local_pool_size=None, **kwargs):
+        """override to split the spark job into arguments for
+        local_className, one list per partition"""
+        raise SparkModuleError(
+            '{} does not support local execution'.format(cls.__name__))
+
+    @classmethod
+    def get_local_commands(cls, **kwargs):
+        return [cls.get_local_call(**kwargs) + args
+                for args in cls.get_local_partition_args(**kwargs)]
+
+    def run_local_command(self, **kwargs):
+        """run the partitions of the spark job as concurrent local
+        java processes instead of submitting to spark"""
+        cmds = self.get_local_commands(**self.args)
+        pool_size = min(self.args['local_pool_size'], len(cmds))
+        if pool_size <= 1:
+            return max([subprocess.check_call(cmd, **kwargs)
+                        for cmd in cmds] + [0])
+        # threads only wait on the java processes
+        pool = ThreadPool(pool_size)
+        try:
+            return max(pool.map(
+                lambda cmd: subprocess.check_call(cmd, **kwargs), cmds))
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_executor_command(self, **kwargs):
+        if self.args['executor'] == 'local':
+            return self.run_local_command(**kwargs)
+        return self.run_spark_command(**kwargs)
+
 
 if __name__ == '__main__':
     example_input = {
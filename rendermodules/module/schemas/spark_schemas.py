@@ -1,5 +1,8 @@
+import multiprocessing
+
 import argschema
-from argschema.fields import Str, InputDir, List, InputFile, Dict
+from argschema.fields import Str, InputDir, List, InputFile, Dict, Int
+from marshmallow import ValidationError, validate, post_load
 
 
 class SparkOptions(argschema.schemas.DefaultSchema):
@@ -12,7 +15,7 @@ class SparkOptions(argschema.schemas.DefaultSchema):
     memory = Str(
         required=False,
         description="Memory required for spark job")
-    sparkhome = InputDir(required=True, description=(
+    sparkhome = InputDir(required=False, description=(
         "Spark home directory containing bin/spark_submit"))
     spark_files = List(InputFile, required=False, description=(
         "list of spark files to add to the spark submit command"))
@@ -22,5 +25,24 @@ class SparkOptions(argschema.schemas.DefaultSchema):
 
 
 class SparkParameters(SparkOptions):
-    masterUrl = Str(required=True, description=(
+    masterUrl = Str(required=False, description=(
         "spark master url.  For local execution local[num_procs,num_retries]"))
+    executor = Str(
+        required=False, default='spark', missing='spark',
+        validator=validate.OneOf(['spark', 'local']), description=(
+            "'spark' to spark-submit the job, 'local' to run its "
+            "partitions as java processes on this machine"))
+    local_pool_size = Int(
+        required=False, default=multiprocessing.cpu_count(),
+        missing=multiprocessing.cpu_count(), description=(
+            "number of concurrent java processes of the local executor"))
+
+    @post_load
+    def validate_executor(self, data):
+        if data['executor'] == 'spark':
+            missing = [k for k in ['masterUrl', 'sparkhome']
+                       if data.get(k) is None]
+            if missing:
+                raise ValidationError(
+                    "{} required by the spark executor".format(
+                        ", ".join(missing)))
@@ -118,6 +118,11 @@ class InputStackParameters(RenderParameters, ZValueParameters,
     """template schema for schemas which take input from a stack
     """
     input_stack = argschema.fields.Str(required=True)
+    resolved_tiles_cache_dir = argschema.fields.Str(
+        required=False, default=None, allow_none=True, description=(
+            "directory of a local cache of input ResolvedTiles, "
+            "invalidated by the stack's lastModifiedTimestamp. "
+            "Sections are always fetched from render if omitted"))
 
     def _override_input(self, data):
         super(InputStackParameters, self)._override_input(data)
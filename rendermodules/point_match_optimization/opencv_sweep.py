@@ -0,0 +1,225 @@
+"""
+in-process OpenCV point match parameter sweep for PtMatchOptimization.
+
+Each tile is rendered once per renderScale and its SIFT features are
+computed once per feature parameter set, so parameter sets that only
+vary the match filter reuse the same features.
+
+The java SIFT options are mapped onto OpenCV as follows:
+    SIFTsteps -> nOctaveLayers
+    SIFTmaxScale -> the image is downsampled by this factor before detection
+    SIFTminScale -> keypoints from octaves downsampled by more than
+        SIFTminScale relative to the detection image are dropped
+    SIFTfdSize -> only part of the feature cache key, OpenCV descriptors
+        are always 4x4 samples
+    matchRod -> Lowe's ratio test
+    matchModelType, matchMaxEpsilon, matchIterations -> RANSAC model fit
+    matchMinNumInliers, matchMaxNumInliers, matchMinInlierRatio ->
+        inlier acceptance
+matchMaxTrust has no OpenCV equivalent and is ignored.
+"""
+from functools import partial
+
+import cv2
+import numpy as np
+import renderapi
+
+from rendermodules.utilities.pool_utils import WithThreadPool
+
+feature_keys = ['renderScale', 'SIFTsteps', 'SIFTfdSize',
+                'SIFTminScale', 'SIFTmaxScale']
+
+
+def sift_create(**kwargs):
+    try:
+        return cv2.SIFT_create(**kwargs)
+    except AttributeError:
+        return cv2.xfeatures2d.SIFT_create(**kwargs)
+
+
+def get_tile_image(render, stack, tileId, renderScale, url_options):
+    """render a tile for matching as a grayscale uint8 array"""
+    im = render.run(renderapi.image.get_tile_image_data,
+                    stack,
+                    tileId,
+                    normalizeForMatching=url_options['normalizeForMatching'],
+                    excludeAllTransforms=url_options['excludeAllTransforms'],
+                    scale=renderScale,
+                    filter=url_options['renderWithFilter'])
+    if im.ndim == 3:
+        im = cv2.cvtColor(im[:, :, :3], cv2.COLOR_RGB2GRAY)
+    return im.astype(np.uint8)
+
+
+def compute_features(im, renderScale, SIFTsteps, SIFTfdSize,
+                     SIFTminScale, SIFTmaxScale):
+    """SIFT keypoints and descriptors of a rendered tile
+
+    Returns
+    -------
+    xy : numpy.ndarray
+        Nx2 keypoint positions in full resolution tile coordinates
+    des : numpy.ndarray
+        NxM float32 descriptors
+    """
+    im = cv2.resize(im, (0, 0), fx=SIFTmaxScale, fy=SIFTmaxScale,
+                    interpolation=cv2.INTER_AREA)
+    sift = sift_create(nOctaveLayers=int(SIFTsteps))
+    kp, des = sift.detectAndCompute(im, None)
+    if des is None or not kp:
+        return np.empty((0, 2)), np.empty((0, 128), dtype=np.float32)
+    # octave is packed as a signed byte, each octave halves the image
+    octaves = np.array([k.octave & 255 for k in kp])
+    octaves[octaves >= 128] -= 256
+    keep = 0.5 ** octaves >= SIFTminScale
+    xy = np.array([k.pt for k in kp])[keep]
+    return xy / (SIFTmaxScale * renderScale), des[keep]
+
+
+def fit_model(pxy, qxy, matchModelType, matchMaxEpsilon, matchIterations):
+    """RANSAC fit of q = M(p), returns a boolean inlier mask"""
+    if matchModelType == 'TRANSLATION':
+        d = qxy - pxy
+        res = np.linalg.norm(d - np.median(d, axis=0), axis=1)
+        return res <= matchMaxEpsilon
+    estimate = (cv2.estimateAffine2D if matchModelType == 'AFFINE'
+                else cv2.estimateAffinePartial2D)
+    M, mask = estimate(pxy.astype(np.float32), qxy.astype(np.float32),
+                       method=cv2.RANSAC,
+                       ransacReprojThreshold=matchMaxEpsilon,
+                       maxIters=int(matchIterations))
+    if M is None:
+        return np.zeros(len(pxy), dtype=bool)
+    return mask.ravel().astype(bool)
+
+
+def match_features(pfeatures, qfeatures, matchRod=0.92, matchModelType='AFFINE',
+                   matchMaxEpsilon=20.0, matchIterations=1000,
+                   matchMinNumInliers=10, matchMaxNumInliers=500,
+                   matchMinInlierRatio=0.0, renderScale=1.0, **kwargs):
+    """filtered matches between the features of two tiles
+
+    Returns
+    -------
+    pxy, qxy : numpy.ndarray
+        Nx2 matched positions in full resolution tile coordinates
+    """
+    empty = (np.empty((0, 2)), np.empty((0, 2)))
+    (pxy, pdes), (qxy, qdes) = pfeatures, qfeatures
+    if len(pdes) < 2 or len(qdes) < 2:
+        return empty
+    matcher = cv2.BFMatcher(cv2.NORM_L2)
+    good = [m for m, n in (mn for mn in matcher.knnMatch(pdes, qdes, k=2)
+                           if len(mn) == 2)
+            if m.distance < matchRod * n.distance]
+    if len(good) < max(matchMinNumInliers, 3):
+        return empty
+    pm = pxy[[m.queryIdx for m in good]]
+    qm = qxy[[m.trainIdx for m in good]]
+    # epsilon is in rendered pixels, matches are in full resolution
+    inliers = fit_model(pm * renderScale, qm * renderScale, matchModelType,
+                        matchMaxEpsilon, matchIterations)
+    ninliers = np.count_nonzero(inliers)
+    if (ninliers < matchMinNumInliers or
+            ninliers < matchMinInlierRatio * len(good)):
+        return empty
+    pm, qm = pm[inliers], qm[inliers]
+    if matchMaxNumInliers > 0 and ninliers > matchMaxNumInliers:
+        pm, qm = pm[:matchMaxNumInliers], qm[:matchMaxNumInliers]
+    return pm, qm
+
+
+def tile_features(fkey_images):
+    """features of tiles for one feature parameter combination
+
+    Parameters
+    ----------
+    fkey_images : tuple
+        feature parameters ordered as feature_keys and a dict of
+        grayscale images keyed by tileId rendered at their renderScale
+    """
+    fkey, images = fkey_images
+    fparams = dict(zip(feature_keys, fkey))
+    return fkey, {tId: compute_features(im, **fparams)
+                  for tId, im in images.items()}
+
+
+def sweep_option(tilepairs, option_keys, option_features):
+    """match all tile pairs for one parameter set
+
+    Returns
+    -------
+    list of list of dict
+        render point match lists (empty if no matches) per tile pair
+    """
+    option, features = option_features
+    ops = dict(zip(option_keys, option))
+    results = []
+    for tp in tilepairs:
+        pxy, qxy = match_features(features[tp['tileId1']],
+                                  features[tp['tileId2']], **ops)
+        if len(pxy) == 0:
+            results.append([])
+            continue
+        results.append([{
+            "pGroupId": tp['pGroupId'],
+            "qGroupId": tp['qGroupId'],
+            "pId": tp['tileId1'],
+            "qId": tp['tileId2'],
+            "matches": {
+                "p": pxy.T.tolist(),
+                "q": qxy.T.tolist(),
+                "w": np.ones(len(pxy)).tolist()}}])
+    return results
+
+
+def get_tile_images(render, stack, tileIds, renderScales, url_options):
+    """render each tile once per renderScale
+
+    Returns
+    -------
+    dict
+        grayscale images keyed by (tileId, renderScale)
+    """
+    return {(tId, s): get_tile_image(render, stack, tId, s, url_options)
+            for s in set(renderScales) for tId in tileIds}
+
+
+def run_sweep(images, tilepairs, option_keys, options, pool_size=1):
+    """match tile pairs for all parameter sets in process
+
+    Parameters
+    ----------
+    images : dict
+        grayscale tile images keyed by (tileId, renderScale)
+        as returned by get_tile_images
+    tilepairs : list of dict
+        tile pairs with keys tileId1, tileId2, pGroupId, qGroupId
+    option_keys : list of str
+        SIFT option names
+    options : list of tuple
+        parameter sets ordered as option_keys
+    pool_size : int
+        number of threads.  OpenCV releases the GIL, so threads
+        share the images and features rather than copying them
+
+    Returns
+    -------
+    list of list of list of dict
+        point matches per parameter set per tile pair
+    """
+    opdicts = [dict(zip(option_keys, op)) for op in options]
+    tileIds = sorted({tp[k] for tp in tilepairs
+                      for k in ['tileId1', 'tileId2']})
+    fkeys = [tuple(op[k] for k in feature_keys) for op in opdicts]
+
+    def fkey_images(fkey):
+        renderScale = dict(zip(feature_keys, fkey))['renderScale']
+        return fkey, {tId: images[(tId, renderScale)] for tId in tileIds}
+
+    with WithThreadPool(pool_size) as pool:
+        features = dict(pool.map(
+            tile_features, map(fkey_images, sorted(set(fkeys)))))
+        return pool.map(
+            partial(sweep_option, tilepairs, option_keys),
+            [(op, features[fkey]) for op, fkey in zip(options, fkeys)])
@@ -13,7 +13,9 @@ from functools import partial
 from operator import itemgetter
 from shapely.geometry import Polygon
 from jinja2 import FileSystemLoader, Environment
+from rendermodules.utilities.pool_utils import WithThreadPool
 from rendermodules.module.render_module import RenderModule
+from rendermodules.point_match_optimization import opencv_sweep
 from rendermodules.point_match_optimization.schemas import PtMatchOptimizationParameters, PtMatchOptimizationParametersOutput
 
 # FIXME unused matplotlib imports?
@@ -85,14 +87,6 @@ ex = {
 }
 
 
-def polys_overlap(ts, buffer=0):
-    ts1 = ts[0]
-    ts2 = ts[1]
-    p1 = Polygon(ts1.bbox_transformed(ndiv_inner=1))
-    p2 = Polygon(ts2.bbox_transformed(ndiv_inner=1))
-    return p1.intersects(p2)
-
-
 def get_parameter_sets_and_strings(SIFT_options):
     #length = [len(x) for x in SIFT_options]
     #maxlen = np.max(length)
@@ -161,7 +155,11 @@ def draw_matches(render, stack, tile1, tile2, ptmatches, scale, outdir, url_opti
                       normalizeForMatching=url_options['normalizeForMatching'],
                       scale=scale,
                       filter=url_options['renderWithFilter'])
+    return draw_match_image(img1, img2, ptmatches, scale, outdir, color)
 
+
+def draw_match_image(img1, img2, ptmatches, scale, outdir, color=None):
+    # draw ptmatches between two images rendered at scale
     if img1.shape > img2.shape:
         img2 = cv2.resize(img2, img1.shape)
     if img2.shape > img1.shape:
@@ -338,6 +336,29 @@ def compute_point_matches_for_tilepair(render, stack, url_options, option_keys,
     return return_struct
 '''
 
+def get_collection_name(options):
+    collection_name = 'pms'
+    for value in options:
+        collection_name += '_%s'%(str(value).replace('.', 'D'))
+    return collection_name
+
+
+def get_tilepair_url(render, stack, collection_name, tID):
+    # tilepair viewer url for a tile pair and parameter setting
+    tilepair_base_url = '%s:%d/render-ws/view/tile-pair.html'%(render.DEFAULT_KWARGS['host'], render.DEFAULT_KWARGS['port'])
+    tilepair_base_url += '?renderStackOwner=%s'%(render.DEFAULT_KWARGS['owner'])
+    tilepair_base_url += '&renderStackProject=%s'%(render.DEFAULT_KWARGS['project'])
+    tilepair_base_url += '&renderStack=%s'%(stack)
+    tilepair_base_url += '&renderScale=0.2'
+    tilepair_base_url += '&matchOwner=%s'%(render.DEFAULT_KWARGS['owner'])
+    tilepair_base_url += '&matchCollection=%s'%(collection_name)
+    tilepair_base_url += '&pId=%s'%(tID['tileId1'])
+    tilepair_base_url += '&pGroupId=%s'%(tID['pGroupId'])
+    tilepair_base_url += '&qId=%s'%(tID['tileId2'])
+    tilepair_base_url += '&qGroupId=%s'%(tID['qGroupId'])
+    return tilepair_base_url
+
+
 def compute_point_matches(render, stack, tileID, output_dir, url_options, option_keys, options):
 
     return_struct = {}
@@ -349,11 +370,8 @@ def compute_point_matches(render, stack, tileID, output_dir, url_options, option
     return_struct['ptmatch_count'] = []
     return_struct['tilepair_url'] = []
 
-    collection_name = 'pms'
-    ops = {}
-    for param, value in zip(option_keys, options):
-        ops[param] = value
-        collection_name += '_%s'%(str(value).replace('.', 'D'))
+    collection_name = get_collection_name(options)
+    ops = dict(zip(option_keys, options))
 
     tileids = []
     for tID in tileID:
@@ -409,40 +427,101 @@ def compute_point_matches(render, stack, tileID, output_dir, url_options, option
                                                         url_options,
                                                         ops['renderScale'])
 
-        # create the tilepair url for this parameter setting
-        tilepair_base_url = '%s:%d/render-ws/view/tile-pair.html'%(render.DEFAULT_KWARGS['host'], render.DEFAULT_KWARGS['port'])
-        tilepair_base_url += '?renderStackOwner=%s'%(render.DEFAULT_KWARGS['owner'])
-        tilepair_base_url += '&renderStackProject=%s'%(render.DEFAULT_KWARGS['project'])
-        tilepair_base_url += '&renderStack=%s'%(stack)
-        tilepair_base_url += '&renderScale=0.2'
-        tilepair_base_url += '&matchOwner=%s'%(render.DEFAULT_KWARGS['owner'])
-        tilepair_base_url += '&matchCollection=%s'%(collection_name)
-        tilepair_base_url += '&pId=%s'%(tile1)
-        tilepair_base_url += '&pGroupId=%s'%(pGroupId)
-        tilepair_base_url += '&qId=%s'%(tile2)
-        tilepair_base_url += '&qGroupId=%s'%(qGroupId)
-
         return_struct['match_img_filename'].append(match_img_filename)
-        return_struct['tilepair_url'].append(tilepair_base_url)
+        return_struct['tilepair_url'].append(
+            get_tilepair_url(render, stack, collection_name, tID))
         return_struct['ptmatch_count'].append(ptmatch_count)
 
     return_struct['img_url_count_zipped'] = zip(return_struct['match_img_filename'], return_struct['tilepair_url'], return_struct['ptmatch_count'])
     return return_struct
 
 
+def compute_point_matches_from_sweep(render, stack, tileID, output_dir, images, option_keys, options, ptmatches):
+    # store and draw matches computed by opencv_sweep.run_sweep for one parameter set
+    return_struct = {}
+    return_struct['options'] = options
+    return_struct['keys'] = option_keys
+    return_struct['zipped'] = zip(option_keys, options)
+    return_struct['match_img_filename'] = []
+    return_struct['ptmatch_count'] = []
+    return_struct['tilepair_url'] = []
+
+    collection_name = get_collection_name(options)
+    renderScale = dict(zip(option_keys, options))['renderScale']
+
+    matches = [m for pm in ptmatches for m in pm]
+    if len(matches) > 0:
+        renderapi.pointmatch.import_matches(collection_name, matches, render=render)
+
+    return_struct['collection_name'] = collection_name
+    return_struct['outdir'] = output_dir
+
+    for tID, pm in zip(tileID, ptmatches):
+        match_img_filename = draw_match_image(images[(tID['tileId1'], renderScale)],
+                                              images[(tID['tileId2'], renderScale)],
+                                              pm,
+                                              renderScale,
+                                              output_dir)
+
+        return_struct['match_img_filename'].append(match_img_filename)
+        return_struct['tilepair_url'].append(
+            get_tilepair_url(render, stack, collection_name, tID))
+        return_struct['ptmatch_count'].append(
+            len(pm[0]['matches']['p'][0]) if len(pm) > 0 else 0)
+
+    return_struct['img_url_count_zipped'] = zip(return_struct['match_img_filename'], return_struct['tilepair_url'], return_struct['ptmatch_count'])
+    return return_struct
+
+
+def get_tilespecs_for_tileIds(stack, tileIds_by_group, render, pool_size=5):
+    # fetch each tilespec once, a section at a time where the groupId
+    # is a sectionId of the stack and tile by tile otherwise
+    section_z = {d['sectionId']: d['z'] for d in
+                 renderapi.stack.get_stack_sectionData(stack, render=render)}
+    zs = {section_z[g] for g in tileIds_by_group if g in section_z}
+    tileIds = set().union(*tileIds_by_group.values())
+
+    with WithThreadPool(pool_size) as pool:
+        tspecs = {ts.tileId: ts for tss in pool.map(
+                      partial(renderapi.tilespec.get_tile_specs_from_z,
+                              stack, render=render), zs)
+                  for ts in tss if ts.tileId in tileIds}
+        missing = sorted(tileIds.difference(tspecs))
+        tspecs.update({ts.tileId: ts for ts in pool.map(
+            partial(renderapi.tilespec.get_tile_spec,
+                    stack, render=render), missing)})
+    return tspecs
+
+
 def filter_tile_pairs(stack, neighborPairs, render, pool_size=5):
     # returns a list of filtered tilepairs in the neighborPairs format
-    do_overlap = []
-    t0 = time.time()
-    ts1 = [renderapi.tilespec.get_tile_spec(stack, id['p']['id'], render=render) for id in neighborPairs]
-    ts2 = [renderapi.tilespec.get_tile_spec(stack, id['q']['id'], render=render) for id in neighborPairs]
-    t1 = time.time()
-    print(t1-t0)
-    mypartial = partial(polys_overlap)
-    with renderapi.client.WithPool(pool_size) as pool:
-        do_overlap = pool.map(mypartial, zip(ts1, ts2))
-
-    filtered_tilepairs = [np for np, do in zip(neighborPairs, do_overlap) if do == True]
+    tileIds_by_group = {}
+    for pair in neighborPairs:
+        for k in ['p', 'q']:
+            tileIds_by_group.setdefault(
+                pair[k]['groupId'], set()).add(pair[k]['id'])
+    tspecs = get_tilespecs_for_tileIds(
+        stack, tileIds_by_group, render, pool_size)
+
+    tileIds = sorted(tspecs)
+    index = {tileId: i for i, tileId in enumerate(tileIds)}
+    polys = [Polygon(tspecs[tileId].bbox_transformed(ndiv_inner=1))
+             for tileId in tileIds]
+    bounds = np.array([poly.bounds for poly in polys]).reshape(-1, 4)
+
+    pairs = [pair for pair in neighborPairs
+             if pair['p']['id'] in index and pair['q']['id'] in index]
+    pi = np.array([index[pair['p']['id']] for pair in pairs], dtype=int)
+    qi = np.array([index[pair['q']['id']] for pair in pairs], dtype=int)
+
+    # bounding boxes must intersect before testing the polygons
+    bp = bounds[pi]
+    bq = bounds[qi]
+    candidates = ((bp[:, 0] <= bq[:, 2]) & (bq[:, 0] <= bp[:, 2]) &
+                  (bp[:, 1] <= bq[:, 3]) & (bq[:, 1] <= bp[:, 3]))
+
+    filtered_tilepairs = [pair for pair, p, q, c in zip(pairs, pi, qi, candidates)
+                          if c and polys[p].intersects(polys[q])]
     return filtered_tilepairs
 
 
@@ -540,17 +619,36 @@ class PtMatchOptimization(RenderModule):
                                                                     tileids))
         '''
 
-        mypartial = partial(compute_point_matches,
-                            self.render,
-                            self.args['stack'],
-                            tileIds,
-                            self.args['outputDirectory'],
-                            self.args['url_options'],
-                            keys)
-
-        #print(options)
-        with renderapi.client.WithPool(self.args['pool_size']) as pool:
-            return_struct = pool.map(mypartial, options)
+        if self.args['use_opencv_sweep']:
+            # render tiles and compute features once, match in process
+            images = opencv_sweep.get_tile_images(
+                self.render, self.args['stack'],
+                {t[k] for t in tileIds for k in ['tileId1', 'tileId2']},
+                [dict(zip(keys, op))['renderScale'] for op in options],
+                self.args['url_options'])
+            ptmatches = opencv_sweep.run_sweep(
+                images, tileIds, keys, options, self.args['pool_size'])
+            return_struct = [compute_point_matches_from_sweep(self.render,
+                                                              self.args['stack'],
+                                                              tileIds,
+                                                              self.args['outputDirectory'],
+                                                              images,
+                                                              keys,
+                                                              op,
+                                                              pm)
+                             for op, pm in zip(options, ptmatches)]
+        else:
+            mypartial = partial(compute_point_matches,
+                                self.render,
+                                self.args['stack'],
+                                tileIds,
+                                self.args['outputDirectory'],
+                                self.args['url_options'],
+                                keys)
+
+            #print(options)
+            with renderapi.client.WithPool(self.args['pool_size']) as pool:
+                return_struct = pool.map(mypartial, options)
 
         #return_struct = []
         #for ops in options:
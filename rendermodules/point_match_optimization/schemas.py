@@ -174,7 +174,15 @@ class PtMatchOptimizationParameters(RenderParameters):
         default=10,
         missing=10,
         description='Pool size for parallel processing')
-        
+    use_opencv_sweep = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description=('match with OpenCV SIFT in process, rendering each '
+                     'tile once per renderScale and reusing features '
+                     'across match filter parameters, rather than '
+                     'running the java point match client per parameter set'))
+
     @post_load
     def validate_data(self, data):
         if data['max_tilepairs_with_matches'] == 0:
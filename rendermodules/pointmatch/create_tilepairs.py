@@ -1,8 +1,13 @@
 
+from functools import partial
 import json
 import os
 import subprocess
+import numpy as np
 import renderapi
+from scipy.spatial import cKDTree
+from shapely.geometry import box
+from shapely.ops import unary_union
 from ..module.render_module import RenderModule
 from rendermodules.pointmatch.schemas import TilePairClientParameters, TilePairClientOutputParameters
 
@@ -31,6 +36,185 @@ example = {
 
 
 
+def get_tilebounds_arrays(render, stack, z):
+    """tileIds, groupIds and Nx4 (minX, minY, maxX, maxY) bounds of a z"""
+    tbs = render.run(renderapi.stack.get_tilebounds_for_z, stack, z)
+    ids = [tb['tileId'] for tb in tbs]
+    groupIds = [tb.get('sectionId') or str(float(z)) for tb in tbs]
+    bounds = np.array([[tb['minX'], tb['minY'], tb['maxX'], tb['maxY']]
+                       for tb in tbs], dtype=float).reshape(-1, 4)
+    return ids, groupIds, bounds
+
+
+def get_tilebounds_arrays_from_tilespecs(tilespecs):
+    """tileIds, groupIds and Nx4 (minX, minY, maxX, maxY) bounds
+    of in-memory tilespecs keyed by z"""
+    sections = {}
+    for ts in tilespecs:
+        xy = ts.bbox_transformed(ndiv_inner=0)
+        ids, groupIds, bounds = sections.setdefault(ts.z, ([], [], []))
+        ids.append(ts.tileId)
+        groupIds.append(ts.layout.sectionId or str(float(ts.z)))
+        bounds.append(np.concatenate([xy.min(axis=0), xy.max(axis=0)]))
+    return {z: (ids, groupIds, np.array(bounds, dtype=float).reshape(-1, 4))
+            for z, (ids, groupIds, bounds) in sections.items()}
+
+
+def find_obscured_tiles(ids, bounds):
+    """mask of tiles completely covered by reacquired tiles, where
+    reacquired tiles are those with a lexicographically greater tileId
+
+    Parameters
+    ----------
+    ids : list of str
+        tileIds
+    bounds : numpy.ndarray
+        Nx4 array of minX, minY, maxX, maxY
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean mask, True for completely obscured tiles
+    """
+    obscured = np.zeros(len(ids), dtype=bool)
+    for i in range(len(ids)):
+        # vectorized bbox pre-check before the exact coverage test
+        candidates = np.flatnonzero(
+            (bounds[:, 0] < bounds[i, 2]) & (bounds[:, 2] > bounds[i, 0]) &
+            (bounds[:, 1] < bounds[i, 3]) & (bounds[:, 3] > bounds[i, 1]))
+        candidates = [j for j in candidates if ids[j] > ids[i]]
+        if candidates and unary_union(
+                [box(*bounds[j]) for j in candidates]).contains(
+                    box(*bounds[i])):
+            obscured[i] = True
+    return obscured
+
+
+def relative_positions(pbounds, qbounds):
+    pc = (pbounds[:2] + pbounds[2:]) / 2.
+    qc = (qbounds[:2] + qbounds[2:]) / 2.
+    dx, dy = qc - pc
+    if abs(dx) >= abs(dy):
+        return ("LEFT", "RIGHT") if dx > 0 else ("RIGHT", "LEFT")
+    return ("TOP", "BOTTOM") if dy > 0 else ("BOTTOM", "TOP")
+
+
+def tilepairs_for_zs(render, stack, zs, stack_zs, xyNeighborFactor=0.9,
+                     zNeighborDistance=2, excludeCornerNeighbors=True,
+                     excludeSameLayerNeighbors=False,
+                     excludeCompletelyObscuredTiles=True, tilebounds=None):
+    """generate the neighbor pairs originating from a chunk of zs.
+    Neighbors are searched in the sections z to z + zNeighborDistance,
+    which covers every pair exactly once over all zs.
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    stack : str
+        stack of tile bounds
+    zs : list of float
+        sections whose pairs to generate
+    stack_zs : set of float
+        all z values of the stack
+    xyNeighborFactor : float
+        neighbor search radius as a fraction of max(width, height)
+    zNeighborDistance : int
+        maximum z distance between paired tiles
+    excludeCornerNeighbors : bool
+        exclude neighbors whose center lies outside both the x and y
+        range of the tile
+    excludeSameLayerNeighbors : bool
+        exclude pairs within a section
+    excludeCompletelyObscuredTiles : bool
+        exclude tiles completely covered by reacquired tiles
+    tilebounds : dict or None
+        (tileIds, groupIds, bounds) keyed by z as returned by
+        get_tilebounds_arrays_from_tilespecs, used instead of
+        querying render for the tile bounds
+
+    Returns
+    -------
+    list of dict
+        neighbor pairs in TilePairClient json format
+    """
+    section_cache = {}
+
+    def get_section(z):
+        if z not in section_cache:
+            ids, groupIds, bounds = (
+                get_tilebounds_arrays(render, stack, z) if tilebounds is None
+                else tilebounds.get(z, ([], [], np.empty((0, 4)))))
+            if excludeCompletelyObscuredTiles and len(ids):
+                keep = ~find_obscured_tiles(ids, bounds)
+                ids = [i for i, k in zip(ids, keep) if k]
+                groupIds = [g for g, k in zip(groupIds, keep) if k]
+                bounds = bounds[keep]
+            centers = (bounds[:, :2] + bounds[:, 2:]) / 2.
+            tree = cKDTree(centers) if len(ids) else None
+            section_cache[z] = (ids, groupIds, bounds, centers, tree)
+        return section_cache[z]
+
+    pairs = []
+    for z in zs:
+        ids, groupIds, bounds, centers, _ = get_section(z)
+        if not ids:
+            continue
+        radii = xyNeighborFactor * np.maximum(
+            bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        for dz in range(zNeighborDistance + 1):
+            nz = z + dz
+            if nz not in stack_zs or (dz == 0 and excludeSameLayerNeighbors):
+                continue
+            nids, ngroupIds, nbounds, ncenters, ntree = get_section(nz)
+            if ntree is None:
+                continue
+            for i in range(len(ids)):
+                for j in ntree.query_ball_point(centers[i], radii[i]):
+                    if dz == 0 and j <= i:
+                        continue
+                    if excludeCornerNeighbors and not (
+                            bounds[i, 0] <= ncenters[j, 0] <= bounds[i, 2] or
+                            bounds[i, 1] <= ncenters[j, 1] <= bounds[i, 3]):
+                        continue
+                    p = {"groupId": groupIds[i], "id": ids[i]}
+                    q = {"groupId": ngroupIds[j], "id": nids[j]}
+                    pb, qb = bounds[i], nbounds[j]
+                    if (q["groupId"], q["id"]) < (p["groupId"], p["id"]):
+                        p, q, pb, qb = q, p, qb, pb
+                    if dz == 0:
+                        p["relativePosition"], q["relativePosition"] = (
+                            relative_positions(pb, qb))
+                    pairs.append({"p": p, "q": q})
+        # sections below the next chunk's zs are no longer needed
+        section_cache.pop(z, None)
+    return pairs
+
+
+def write_tilepairs(render, stack, baseStack, zs, stack_zs, outjson,
+                    pool_size=1, zChunkSize=100, **kwargs):
+    """generate tile pairs in python, parallelized over chunks of zs
+    and streamed to a TilePairClient style json file"""
+    chunks = [zs[i:i + zChunkSize] for i in range(0, len(zs), zChunkSize)]
+    mypartial = partial(tilepairs_for_zs, render, stack,
+                        stack_zs=stack_zs, **kwargs)
+    template = (
+        "{{baseDataUrl}}/owner/{owner}/project/{project}/"
+        "stack/{stack}/tile/{{id}}/render-parameters").format(
+            owner=render.DEFAULT_OWNER, project=render.DEFAULT_PROJECT,
+            stack=baseStack)
+    npairs = 0
+    with open(outjson, 'w') as f, renderapi.client.WithPool(pool_size) as pool:
+        f.write('{{\n"renderParametersUrlTemplate": {},\n'
+                '"neighborPairs": ['.format(json.dumps(template)))
+        for chunk_pairs in pool.imap(mypartial, chunks):
+            for pair in chunk_pairs:
+                f.write((',\n' if npairs else '\n') + json.dumps(pair))
+                npairs += 1
+        f.write('\n]\n}\n')
+    return npairs
+
+
 class TilePairClientModule(RenderModule):
     default_schema = TilePairClientParameters
     default_output_schema = TilePairClientOutputParameters
@@ -56,6 +240,22 @@ class TilePairClientModule(RenderModule):
                                 self.args['output_dir'],
                                 tilepairJsonFile)
 
+        if self.args['use_python_client']:
+            zs = sorted(z for z in zvalues
+                        if self.args['minZ'] <= z <= self.args['maxZ'])
+            write_tilepairs(
+                self.render, self.args['stack'], self.args['baseStack'],
+                zs, set(zvalues), tilepairJsonFile,
+                pool_size=self.args['pool_size'],
+                zChunkSize=self.args['zChunkSize'],
+                xyNeighborFactor=self.args['xyNeighborFactor'],
+                zNeighborDistance=self.args['zNeighborDistance'],
+                excludeCornerNeighbors=self.args['excludeCornerNeighbors'],
+                excludeSameLayerNeighbors=self.args['excludeSameLayerNeighbors'],
+                excludeCompletelyObscuredTiles=self.args['excludeCompletelyObscuredTiles'])
+            self.output({'tile_pair_file': tilepairJsonFile})
+            return
+
         tilepairs = self.render.run(
                         renderapi.client.tilePairClient,
                         self.args['stack'],
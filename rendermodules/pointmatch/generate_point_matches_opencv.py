@@ -12,7 +12,7 @@ from six.moves import urllib
 from .schemas import \
         PointMatchOpenCVParameters, \
         PointMatchClientOutputSchema
-from rendermodules.utilities import uri_utils
+from rendermodules.utilities import render_session, uri_utils
 
 
 example = {
@@ -126,7 +126,16 @@ def read_downsample_equalize_mask(
     return read_downsample_equalize_mask_uri(uri_impath, *args, **kwargs)
 
 
-def find_matches(fargs):
+def compute_matches(fargs):
+    """match one tile pair without storing the result
+
+    Returns
+    -------
+    pm : dict or None
+        render point match dict, None if no matches were found
+    stats : list
+        [impaths, len(kp1), len(kp2), len(k1), len(k2)]
+    """
     [impaths, ids, gids, args] = fargs
 
     pim = read_downsample_equalize_mask_uri(
@@ -174,6 +183,7 @@ def find_matches(fargs):
         k1 += result[0]
         k2 += result[1]
 
+    pm_dict = None
     if len(k1) >= 1:
         k1 = np.array(k1) / args['downsample_scale']
         k2 = np.array(k2) / args['downsample_scale']
@@ -184,15 +194,23 @@ def find_matches(fargs):
             k1 = k1[a[0: args['matchMax']], :]
             k2 = k2[a[0: args['matchMax']], :]
 
-        render = renderapi.connect(**args['render'])
         pm_dict = make_pm(ids, gids, k1, k2)
 
+    return pm_dict, [impaths, len(kp1), len(kp2), len(k1), len(k2)]
+
+
+def find_matches(fargs):
+    args = fargs[3]
+    pm_dict, stats = compute_matches(fargs)
+
+    if pm_dict is not None:
+        render = render_session.connect(**args['render'])
         renderapi.pointmatch.import_matches(
           args['match_collection'],
           [pm_dict],
           render=render)
 
-    return [impaths, len(kp1), len(kp2), len(k1), len(k2)]
+    return stats
 
 
 def make_pm(ids, gids, k1, k2):
@@ -242,6 +260,19 @@ def load_pairjson(tilepair_file, logger=logging.getLogger()):
     return tpjson
 
 
+def make_match_fargs(tilespecs, tile_index, args):
+    """find_matches arguments for each tile pair in tile_index"""
+    fargs = []
+    for i in range(tile_index.shape[0]):
+        impaths = [[t.ip[0].imageUrl, t.ip[0].maskUrl]
+                   for t in tilespecs[tile_index[i]]]
+        ids = [t.tileId for t in tilespecs[tile_index[i]]]
+        gids = [t.layout.sectionId
+                for t in tilespecs[tile_index[i]]]
+        fargs.append([impaths, ids, gids, args])
+    return fargs
+
+
 def load_tilespecs(render, input_stack, unique_ids):
     tilespecs = []
     for tid in unique_ids:
@@ -252,6 +283,50 @@ def load_tilespecs(render, input_stack, unique_ids):
     return np.array(tilespecs)
 
 
+def compute_matches_for_tilepairs(tilespecs, neighborPairs, args, ncpus=-1,
+                                  logger=logging.getLogger()):
+    """match the tile pairs of in-memory tilespecs
+
+    Parameters
+    ----------
+    tilespecs : list of renderapi.tilespec.TileSpec
+        tilespecs containing all tiles of neighborPairs
+    neighborPairs : list of dict
+        tile pairs in TilePairClient json format
+    args : dict
+        PointMatchOpenCVParameters
+    ncpus : int
+        number of processes, -1 for all cpus
+
+    Returns
+    -------
+    list of dict
+        render point matches, which are not imported to render
+    """
+    if len(neighborPairs) == 0:
+        return []
+    if ncpus == -1:
+        ncpus = multiprocessing.cpu_count()
+
+    unique_ids, tile_index = parse_tileids(
+        {'neighborPairs': neighborPairs}, logger=logger)
+    tileId_to_ts = {t.tileId: t for t in tilespecs}
+    tilespecs = np.array([tileId_to_ts[tid] for tid in unique_ids])
+
+    matches = []
+    with renderapi.client.WithPool(ncpus) as pool:
+        for pm, r in pool.imap_unordered(
+                compute_matches,
+                make_match_fargs(tilespecs, tile_index, args)):
+            log = "\n%s\n%s\n" % (r[0][0], r[0][1])
+            log += "  (%d, %d) features found" % (r[1], r[2])
+            log += "  (%d, %d) matches made" % (r[3], r[4])
+            logger.debug(log)
+            if pm is not None:
+                matches.append(pm)
+    return matches
+
+
 class GeneratePointMatchesOpenCV(ArgSchemaParser):
     default_schema = PointMatchOpenCVParameters
     default_output_schema = PointMatchClientOutputSchema
@@ -277,23 +352,7 @@ class GeneratePointMatchesOpenCV(ArgSchemaParser):
             ncpus = multiprocessing.cpu_count()
 
         with renderapi.client.WithPool(ncpus) as pool:
-            index_list = range(tile_index.shape[0])
-
-            fargs = []
-            for i in index_list:
-                impaths = [[t.ip[0].imageUrl, t.ip[0].maskUrl]
-                           for t in tilespecs[tile_index[i]]]
-                # impaths = [
-                #            [urllib.parse.unquote(
-                #                urllib.parse.urlparse(url).path)
-                #                if url is not None else None
-                #                for url in [t.ip[0].imageUrl, t.ip[0].maskUrl]]
-                #            for t in tilespecs[tile_index[i]]
-                #           ]
-                ids = [t.tileId for t in tilespecs[tile_index[i]]]
-                gids = [t.layout.sectionId
-                        for t in tilespecs[tile_index[i]]]
-                fargs.append([impaths, ids, gids, self.args])
+            fargs = make_match_fargs(tilespecs, tile_index, self.args)
 
             for r in pool.imap_unordered(find_matches, fargs):
                 log = "\n%s\n%s\n" % (r[0][0], r[0][1])
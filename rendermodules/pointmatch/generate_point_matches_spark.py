@@ -79,6 +79,9 @@ def get_host_port_dict_from_url(url):
 class PointMatchClientModuleSpark(SparkModule):
     default_schema = PointMatchClientParametersSpark
     default_output_schema = PointMatchClientOutputSchema
+    local_className = "org.janelia.render.client.PointMatchClient"
+    # bounds the command line length of each local partition
+    local_max_pairs_per_partition = 1000
 
     @classmethod
     def get_pointmatch_args(cls, baseDataUrl=None, owner=None,
@@ -136,9 +139,50 @@ class PointMatchClientModuleSpark(SparkModule):
         return cls.sanitize_cmd(cls.get_pointmatch_args(**kwargs))
 
 
+    @classmethod
+    def get_canvas_urls(cls, tpjson, baseDataUrl, renderWithFilter=None,
+                        renderWithoutMask=None):
+        query = (cls.get_cmd_opt(renderWithFilter, 'filter') +
+                 cls.get_cmd_opt(renderWithoutMask, 'excludeMask') +
+                 ['normalizeForMatching', True])
+        query = cls.sanitize_cmd(query)
+        query = '&'.join(
+            '{}={}'.format(k, v) for k, v in zip(query[::2], query[1::2]))
+        template = tpjson['renderParametersUrlTemplate'].replace(
+            '{baseDataUrl}', baseDataUrl)
+        return [
+            [template.replace('{id}', pair[k]['id']) + '?' + query
+             for k in ['p', 'q']]
+            for pair in tpjson['neighborPairs']]
+
+    @classmethod
+    def get_local_partition_args(cls, local_pool_size=None, pairJson=None,
+                                 baseDataUrl=None, owner=None,
+                                 collection=None, renderWithFilter=None,
+                                 renderWithoutMask=None, **kwargs):
+        with open(pairJson, 'r') as f:
+            tpjson = json.load(f)
+        canvas_urls = cls.get_canvas_urls(
+            tpjson, baseDataUrl, renderWithFilter, renderWithoutMask)
+
+        # the feature cache is spark only
+        sift_params = form_sift_params_list(
+            dict(kwargs, maxFeatureCacheGb=None))
+        base_args = cls.sanitize_cmd(
+            ['--baseDataUrl', baseDataUrl, '--owner', owner,
+             '--collection', collection] + sift_params)
+
+        npartitions = max(
+            local_pool_size,
+            -(-len(canvas_urls) // cls.local_max_pairs_per_partition))
+        return [base_args + [url for pair in canvas_urls[i::npartitions]
+                             for url in pair]
+                for i in range(min(npartitions, len(canvas_urls)))]
+
     def run(self):
-        r = self.run_spark_command()
-        self.logger.debug("spark run completed with code {}".format(r))
+        r = self.run_executor_command()
+        self.logger.debug("{} run completed with code {}".format(
+            self.args['executor'], r))
 
 
 
@@ -73,6 +73,22 @@ class TilePairClientParameters(RenderParameters):
         default='6G',
         missing='6G',
         description="Memory for the java client to run")
+    use_python_client = Bool(
+        required=False,
+        default=False,
+        missing=False,
+        description="Generate tile pairs in python rather than with "
+        "the java TilePairClient")
+    pool_size = Int(
+        required=False,
+        default=1,
+        missing=1,
+        description="Number of processes generating python tile pairs")
+    zChunkSize = Int(
+        required=False,
+        default=100,
+        missing=100,
+        description="Number of sections per python tile pair job")
 
     @post_load
     def validate_data(self, data):
@@ -245,6 +261,34 @@ class SwapPointMatches(RenderParameters):
         default=5,
         missing=5,
         description="Pool size")
+    batch_size = Int(
+        required=False,
+        default=10000,
+        missing=10000,
+        description="Maximum number of point matches per import")
+    use_temp_collections = Bool(
+        required=False,
+        default=True,
+        missing=True,
+        description=("Stage the original matches in temp collections "
+                     "before they are deleted from the swapped collections. "
+                     "If False they are staged in files in "
+                     "progress_directory"))
+    progress_directory = Str(
+        required=False,
+        default=None,
+        missing=None,
+        description=("Directory recording how far the swap of each group "
+                     "has progressed, so that an interrupted swap can be "
+                     "resumed by rerunning the module"))
+
+    @post_load
+    def validate_data(self, data):
+        if not data['use_temp_collections'] and \
+                data['progress_directory'] is None:
+            raise mm.ValidationError(
+                "progress_directory is required to stage matches "
+                "without temp collections")
 
 class SwapPointMatchesOutput(DefaultSchema):
     source_collection = Str(
@@ -1,9 +1,15 @@
+import gzip
+import itertools
+import json
+import logging
+import os
 import renderapi
-import requests
+from rendermodules.utilities.render_session import get_session
 from functools import partial
 from rendermodules.module.render_module import RenderModule, RenderModuleException
 from rendermodules.pointmatch.schemas import SwapPointMatches, SwapPointMatchesOutput
-import time
+
+logger = logging.getLogger(__name__)
 
 example = {
     "render": {
@@ -19,80 +25,353 @@ example = {
     "zValues": [1015]
 }
 
-def swap_pt_matches(render, source_collection, target_collection, z, match_owner=None):
-    session = requests.Session()
-    session.mount('http://', requests.adapters.HTTPAdapter(max_retries=5))
-
-    groupid = "{}.0".format(str(z))
-    match_owner = match_owner if match_owner is not None else render.DEFAULT_OWNER
-
-    # get all pt matches for this group (both within and outside group point matches)
-    sourcematches = renderapi.pointmatch.get_matches_with_group(source_collection, 
-                                                                groupid, 
-                                                                owner=match_owner,
-                                                                render=render,
-                                                                session=session)
-    targetmatches = renderapi.pointmatch.get_matches_with_group(target_collection,
-                                                                groupid,
-                                                                owner=match_owner,
-                                                                render=render,
-                                                                session=session)
-    # write them to a temp collection
-    gid = int(float(groupid))
-    temp_col1 = "temp_{}_{}_{}".format(source_collection, str(gid), time.strftime("%m%d%y_%H%M%S"))
-    temp_col2 = "temp_{}_{}_{}".format(target_collection, str(gid), time.strftime("%m%d%y_%H%M%S"))
-
-    try:
-        renderapi.pointmatch.import_matches(temp_col1, sourcematches, owner=match_owner, render=render, session=session)
-        renderapi.pointmatch.import_matches(temp_col2, targetmatches, owner=match_owner, render=render, session=session)
-    except Exception as e:
-        print("Could not create temp point match collections {}".format(e))
-        return False
-    
-    # get the qgroupIds in source matches
-    sourcegroupIds = [m['qGroupId'] for m in sourcematches]
-
-    # delete the matches between groupid and sourcegroupIds
-    for sg in sourcegroupIds:
-        renderapi.pointmatch.delete_point_matches_between_groups(source_collection,
-                                                                    groupid,
-                                                                    sg,
-                                                                    owner=match_owner,
-                                                                    render=render,
-                                                                    session=session)
-    targetgroupIds = [m['qGroupId'] for m in targetmatches]
-    for tg in targetgroupIds:
-        renderapi.pointmatch.delete_point_matches_between_groups(target_collection,
-                                                                groupid,
-                                                                tg,
-                                                                owner=match_owner,
-                                                                render=render,
-                                                                session=session)
-    try:
-        # import source matches into target collection
-        renderapi.pointmatch.import_matches(target_collection,
-                                            sourcematches,
-                                            owner=match_owner,
-                                            render=render,
-                                            session=session)
-        # import target matches into source collection
-        renderapi.pointmatch.import_matches(source_collection,
-                                            targetmatches,
-                                            owner=match_owner,
-                                            render=render,
-                                            session=session)
-    except Exception as e:
-        print("Cannot swap point matches, but temp collections {} and {} have been created for z = {}".format(temp_col1, temp_col2, z))
-        return False
-    
-    try:
-        # delete the two temp collections
-        renderapi.pointmatch.delete_collection(temp_col1, owner=match_owner, render=render, session=session)
-        renderapi.pointmatch.delete_collection(temp_col2, owner=match_owner, render=render, session=session)
-    except Exception as e:
-        print("Could not delete temp collections {} and {}".format(temp_col1, temp_col2))
-
-    return True
+# a group is swapped in three phases, each recorded in its progress file
+STAGED = "staged"
+DELETED = "deleted"
+IMPORTED = "imported"
+
+
+def iter_json_array(chunks):
+    """decode the elements of a json array from chunks of its text
+    without holding the whole array in memory"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("expected a json array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # element continues in the next chunk
+                break
+            yield obj
+        buf = buf[pos:]
+    if started:
+        raise ValueError("truncated json array")
+
+
+def iter_pages(iterable, page_size):
+    iterator = iter(iterable)
+    while True:
+        page = list(itertools.islice(iterator, page_size))
+        if not page:
+            return
+        yield page
+
+
+def group_match_urls(render, collection, groupid, owner):
+    """render-ws urls of the matches within and outside a group"""
+    url = renderapi.render.format_baseurl(
+        render.DEFAULT_HOST, render.DEFAULT_PORT) + (
+            "/owner/{}/matchCollection/{}/group/{}".format(
+                owner, collection, groupid))
+    return [url + "/matchesWithinGroup", url + "/matchesOutsideGroup"]
+
+
+def iter_group_matches(render, collection, groupid, owner, session,
+                       chunk_size=2 ** 20):
+    """stream every match touching a group"""
+    for url in group_match_urls(render, collection, groupid, owner):
+        r = session.get(url, stream=True)
+        try:
+            if r.status_code != 200:
+                raise renderapi.errors.RenderError(
+                    "request to {} returned error code {} with "
+                    "message {}".format(r.url, r.status_code, r.text))
+            r.encoding = r.encoding or 'utf-8'
+            for match in iter_json_array(
+                    r.iter_content(chunk_size, decode_unicode=True)):
+                yield match
+        finally:
+            r.close()
+
+
+def delete_group_matches(render, collection, groupid, owner, session):
+    """delete every match touching a group with one request each for
+    the matches outside and within the group"""
+    within_url, outside_url = group_match_urls(
+        render, collection, groupid, owner)
+    renderapi.pointmatch.rest_delete(session, outside_url)
+    renderapi.pointmatch.delete_point_matches_between_groups(
+        collection, groupid, groupid, owner=owner, render=render,
+        session=session)
+
+
+def import_matches_in_batches(collection, matches, batch_size=10000,
+                              **kwargs):
+    for page in iter_pages(matches, batch_size):
+        renderapi.pointmatch.import_matches(collection, page, **kwargs)
+
+
+class TempCollectionStage(object):
+    """originals of a group's matches staged in a temp collection"""
+    def __init__(self, render, collection, groupid, owner, session):
+        self.render = render
+        self.groupid = groupid
+        self.owner = owner
+        self.session = session
+        self.name = "temp_{}_{}".format(collection, int(float(groupid)))
+
+    def __str__(self):
+        return "temp collection {}".format(self.name)
+
+    def exists(self):
+        return self.name in [
+            c['collectionId']['name'] for c in
+            renderapi.pointmatch.get_matchcollections(
+                owner=self.owner, render=self.render,
+                session=self.session)]
+
+    def clear(self):
+        try:
+            renderapi.pointmatch.delete_collection(
+                self.name, owner=self.owner, render=self.render,
+                session=self.session)
+        except renderapi.errors.RenderError:
+            # nothing was staged
+            pass
+
+    def write(self, matches, batch_size):
+        import_matches_in_batches(
+            self.name, matches, batch_size=batch_size, owner=self.owner,
+            render=self.render, session=self.session)
+
+    def read(self):
+        return iter_group_matches(self.render, self.name, self.groupid,
+                                  self.owner, self.session)
+
+
+class FileStage(object):
+    """originals of a group's matches staged in a gzipped json lines file"""
+    def __init__(self, progress_file, collection):
+        self.path = "{}_{}.json.gz".format(
+            os.path.splitext(progress_file)[0], collection)
+
+    def __str__(self):
+        return "file {}".format(self.path)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def write(self, matches, batch_size):
+        with gzip.open(self.path, 'wt') as f:
+            for match in matches:
+                f.write(json.dumps(match) + '\n')
+
+    def read(self):
+        with gzip.open(self.path, 'rt') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def swap_progress_file(progress_directory, source_collection,
+                       target_collection, groupid):
+    return os.path.join(progress_directory, "swap_{}_{}_{}.txt".format(
+        source_collection, target_collection, groupid))
+
+
+def read_swap_progress(progress_file):
+    if progress_file is None or not os.path.isfile(progress_file):
+        return set()
+    with open(progress_file, 'r') as f:
+        return {l.strip() for l in f if l.strip()}
+
+
+def write_swap_progress(progress_file, phase):
+    if progress_file is not None:
+        with open(progress_file, 'a') as f:
+            f.write("{}\n".format(phase))
+
+
+class GroupSwap(object):
+    """swap the point matches of a group between two collections.
+
+    Matches are streamed from render-ws and imported in fixed-size
+    batches, so memory does not grow with the number of matches.
+    Swapping all groups runs stage, delete and import over every group
+    in turn, so that matches between two swapped groups are staged by
+    both before either deletes them.  Completed phases are recorded in
+    a progress file, so rerunning an interrupted swap resumes it.
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    source_collection : str
+        first match collection
+    target_collection : str
+        second match collection
+    z : int
+        z of the group to swap
+    match_owner : str
+        owner of the match collections
+    batch_size : int
+        maximum number of matches per import
+    use_temp_collections : bool
+        stage the original matches in temp collections rather than
+        in files in progress_directory
+    progress_directory : str or None
+        directory recording the completed phases of the swap
+    """
+    def __init__(self, render, source_collection, target_collection, z,
+                 match_owner=None, batch_size=10000,
+                 use_temp_collections=True, progress_directory=None):
+        if not use_temp_collections and progress_directory is None:
+            raise RenderModuleException(
+                "progress_directory is required to stage matches "
+                "without temp collections")
+        self.render = render
+        self.collections = [source_collection, target_collection]
+        self.groupid = "{}.0".format(str(z))
+        self.owner = (match_owner if match_owner is not None
+                      else render.DEFAULT_OWNER)
+        self.batch_size = batch_size
+        self.progress_file = (
+            None if progress_directory is None else swap_progress_file(
+                progress_directory, source_collection, target_collection,
+                self.groupid))
+        self.use_temp_collections = use_temp_collections
+
+    def stages(self, session):
+        if self.use_temp_collections:
+            return [TempCollectionStage(self.render, c, self.groupid,
+                                        self.owner, session)
+                    for c in self.collections]
+        return [FileStage(self.progress_file, c) for c in self.collections]
+
+    def stage(self):
+        """copy the group's matches of both collections to their stages"""
+        if STAGED in read_swap_progress(self.progress_file):
+            return True
+        session = get_session()
+        stages = self.stages(session)
+        if self.progress_file is None and any(s.exists() for s in stages):
+            # without progress these may be the only copy of the originals
+            logger.error("{} and {} of group {} are left from an "
+                         "interrupted swap".format(
+                             stages[0], stages[1], self.groupid))
+            return False
+        try:
+            for collection, stage in zip(self.collections, stages):
+                # drop anything staged by an interrupted run
+                stage.clear()
+                stage.write(iter_group_matches(
+                    self.render, collection, self.groupid, self.owner,
+                    session), self.batch_size)
+        except Exception as e:
+            logger.error("Could not stage point matches of group {}: "
+                         "{}".format(self.groupid, e))
+            return False
+        write_swap_progress(self.progress_file, STAGED)
+        return True
+
+    def delete(self):
+        """delete the group's matches from both collections"""
+        if DELETED in read_swap_progress(self.progress_file):
+            return True
+        session = get_session()
+        try:
+            for collection in self.collections:
+                delete_group_matches(self.render, collection, self.groupid,
+                                     self.owner, session)
+        except Exception as e:
+            logger.error("Could not delete point matches of group {}, "
+                         "originals are staged: {}".format(self.groupid, e))
+            return False
+        write_swap_progress(self.progress_file, DELETED)
+        return True
+
+    def import_swapped(self):
+        """import each collection's staged matches into the other one"""
+        session = get_session()
+        stages = self.stages(session)
+        if IMPORTED not in read_swap_progress(self.progress_file):
+            try:
+                for collection, stage in zip(self.collections[::-1], stages):
+                    import_matches_in_batches(
+                        collection, stage.read(), batch_size=self.batch_size,
+                        owner=self.owner, render=self.render, session=session)
+            except Exception as e:
+                logger.error(
+                    "Cannot swap point matches of group {}, originals are "
+                    "in {} and {}: {}".format(
+                        self.groupid, stages[0], stages[1], e))
+                return False
+            write_swap_progress(self.progress_file, IMPORTED)
+
+        for stage in stages:
+            stage.clear()
+        if self.progress_file is not None and \
+                os.path.isfile(self.progress_file):
+            # a later swap of the same collections starts from scratch
+            os.remove(self.progress_file)
+        return True
+
+
+def run_swap_phase(phase, swap):
+    return getattr(swap, phase)()
+
+
+def swap_pt_matches(render, source_collection, target_collection, zs,
+                    pool_size=1, **kwargs):
+    """swap the point matches of groups between two collections
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    source_collection : str
+        first match collection
+    target_collection : str
+        second match collection
+    zs : list of int
+        z values of the groups to swap
+    pool_size : int
+        number of groups processed concurrently
+    kwargs
+        keyword arguments to GroupSwap
+
+    Returns
+    -------
+    list of bool
+        whether each group was swapped
+    """
+    swaps = [GroupSwap(render, source_collection, target_collection, z,
+                       **kwargs) for z in zs]
+    swapped = [True] * len(swaps)
+
+    def run_phases(mapper):
+        for phase in ['stage', 'delete', 'import_swapped']:
+            todo = [i for i, ok in enumerate(swapped) if ok]
+            results = mapper(partial(run_swap_phase, phase),
+                             [swaps[i] for i in todo])
+            for i, ok in zip(todo, results):
+                swapped[i] = ok
+
+    if pool_size <= 1 or len(swaps) <= 1:
+        run_phases(lambda f, args: [f(a) for a in args])
+    else:
+        with renderapi.client.WithPool(pool_size) as pool:
+            run_phases(pool.map)
+    return swapped
 
 
 class SwapPointMatchesModule(RenderModule):
@@ -100,7 +379,7 @@ class SwapPointMatchesModule(RenderModule):
     default_output_schema = SwapPointMatchesOutput
 
     def run(self):
-        # get match collections 
+        # get match collections
         collecs = renderapi.pointmatch.get_matchcollections(owner=self.args['match_owner'], render=self.render)
 
         collections = [c['collectionId']['name'] for c in collecs]
@@ -109,34 +388,37 @@ class SwapPointMatchesModule(RenderModule):
             raise RenderModuleException("One of source or target collections does not exist")
 
         # get all groupIds from source and target collections
-        source_ids = renderapi.pointmatch.get_match_groupIds(self.args['source_collection'], 
-                                                            owner=self.args['match_owner'], 
+        source_ids = renderapi.pointmatch.get_match_groupIds(self.args['source_collection'],
+                                                            owner=self.args['match_owner'],
                                                             render=self.render)
-        
+
         target_ids = renderapi.pointmatch.get_match_groupIds(self.args['target_collection'],
                                                             owner=self.args['match_owner'],
                                                             render=self.render)
 
         # check existence of zvalues
         ids = [s for s in self.args['zValues'] if "{}.0".format(str(s)) in source_ids and "{}.0".format(str(s)) in target_ids]
-        
-        # create a temp collection to copy the data
-        zvalues = []
-        mypartial = partial(swap_pt_matches,
-                            self.render,
-                            self.args['source_collection'],
-                            self.args['target_collection'],
-                            match_owner=self.args['match_owner'])
-
-        with renderapi.client.WithPool(self.args['pool_size']) as pool:
-            output_bool = pool.map(mypartial, ids)
-            
-        zvalues = [z for z, n in zip(ids, output_bool) if n]    
-        
-
-        self.output({"source_collection": self.args['source_collection'], 
+
+        output_bool = swap_pt_matches(
+            self.render,
+            self.args['source_collection'],
+            self.args['target_collection'],
+            ids,
+            pool_size=self.args['pool_size'],
+            match_owner=self.args['match_owner'],
+            batch_size=self.args['batch_size'],
+            use_temp_collections=self.args['use_temp_collections'],
+            progress_directory=self.args['progress_directory'])
+
+        zvalues = [z for z, n in zip(ids, output_bool) if n]
+        for z, n in zip(ids, output_bool):
+            if not n:
+                self.logger.warning("point matches of z {} were not "
+                                    "swapped".format(z))
+
+        self.output({"source_collection": self.args['source_collection'],
                      "target_collection": self.args['target_collection'],
-                     "swapped_zs": zvalues, 
+                     "swapped_zs": zvalues,
                      "nonswapped_zs": set(self.args['zValues']).difference(zvalues)})
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import json
 import renderapi
 import numpy as np
 from rendermodules.module.render_module import RenderModule
+from rendermodules.utilities import render_session
 from .schemas import FilterSchema, FilterOutputSchema
 import logging
 
@@ -75,7 +76,7 @@ def proc_job(fargs):
     [input_match_collection, output_match_collection,
         input_stack, z, resmax, transmax, rpar, inverse] = fargs
 
-    render = renderapi.connect(**rpar)
+    render = render_session.connect(**rpar)
     try:
         tspecs = renderapi.tilespec.get_tile_specs_from_z(
                 input_stack,
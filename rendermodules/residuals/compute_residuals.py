@@ -1,10 +1,10 @@
 import numpy as np
-import requests
 import renderapi
+from rendermodules.utilities.render_session import get_session
 
 
 def compute_residuals_within_group(render, stack, matchCollectionOwner, matchCollection, z, min_points=1, tilespecs=None):
-    session = requests.session()
+    session = get_session()
 
     # get the sectionID which is the group ID in point match collection
     groupId = render.run(renderapi.stack.get_sectionId_for_z, stack, z, session=session)
@@ -69,7 +69,6 @@ def compute_residuals_within_group(render, stack, matchCollectionOwner, matchCol
     statistics['tile_residuals'] = tile_residuals
     statistics['pt_match_positions'] = pt_match_positions
 
-    session.close()
 
     return statistics, allmatches
 
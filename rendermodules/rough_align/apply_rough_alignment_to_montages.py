@@ -12,7 +12,7 @@ from rendermodules.rough_align.downsample_mask_handler \
         import polygon_list_from_mask
 from functools import partial
 import logging
-import requests
+from rendermodules.utilities.render_session import get_session
 import pathlib2 as pathlib
 import cv2
 from six.moves import urllib
@@ -121,7 +121,79 @@ def add_masks_to_lowres(render, stack, z, mask_map):
     return
 
 
-def filter_highres_with_masks(resolved_highres, tspec_lowres, mask_map):
+def mask_summed_area_table(maskim):
+    """summed-area table counting the masked-out pixels of a mask
+
+    Parameters
+    ----------
+    maskim : numpy array, uint8
+        Render retains parts of image where mask==255
+
+    Returns
+    -------
+    sat : numpy array, int64
+        shape (maskim.shape[0] + 1, maskim.shape[1] + 1)
+        sat[r, c] is the number of pixels with mask < 255 in
+        maskim[:r, :c]
+    """
+    sat = np.zeros(
+            (maskim.shape[0] + 1, maskim.shape[1] + 1),
+            dtype='int64')
+    sat[1:, 1:] = (maskim < 255).cumsum(axis=0).cumsum(axis=1)
+    return sat
+
+
+def filter_highres_with_mask_raster(resolved_highres, tspec_lowres, maskim):
+    """raster equivalent of the polygon test in filter_highres_with_masks.
+       tile corners are mapped into mask pixel space with one batched
+       inverse transform and each tile is tested in O(1) against a
+       summed-area table of the mask.
+
+    Parameters
+    ----------
+    resolved_highres : renderapi.resolvedtiles.ResolvedTiles object
+        tilespecs and transforms from a single section
+    tspec_lowres: renderapi.tilespec.TileSpec object
+        tilespec from a downsampled stack, transforms map mask
+        pixels into highres coordinates
+    maskim : numpy array, uint8
+        mask for tspec_lowres
+
+    Returns
+    -------
+    new_highres: List of renderapi.tilespec.TileSpec objects
+        highres specs whose mask-space bounding box does not
+        touch any pixel where mask < 255
+    """
+    if len(resolved_highres.tilespecs) == 0:
+        return []
+
+    corners = np.array([
+        t.bbox_transformed(
+            reference_tforms=resolved_highres.transforms)[0:4]
+        for t in resolved_highres.tilespecs])
+    xy = corners.reshape(-1, 2)
+    for tf in tspec_lowres.tforms[::-1]:
+        xy = tf.inverse_tform(xy)
+    xy = xy.reshape(corners.shape)
+
+    # conservative (inclusive) pixel bounds of each tile in the mask
+    # clipped to the mask, tiles falling outside the mask are kept
+    h, w = maskim.shape
+    x0 = np.clip(np.floor(xy[:, :, 0].min(axis=1)), 0, w).astype('int')
+    x1 = np.clip(np.ceil(xy[:, :, 0].max(axis=1)) + 1, 0, w).astype('int')
+    y0 = np.clip(np.floor(xy[:, :, 1].min(axis=1)), 0, h).astype('int')
+    y1 = np.clip(np.ceil(xy[:, :, 1].max(axis=1)) + 1, 0, h).astype('int')
+
+    sat = mask_summed_area_table(maskim)
+    nmasked = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+    return [t for t, n in zip(resolved_highres.tilespecs, nmasked)
+            if n == 0]
+
+
+def filter_highres_with_masks(
+        resolved_highres, tspec_lowres, mask_map, method='polygon'):
     """function to return a filtered list of tilespecs from a
        ResolvedTiles object, based on a lowres mask
 
@@ -133,6 +205,10 @@ def filter_highres_with_masks(resolved_highres, tspec_lowres, mask_map):
         tilespec from a downsampled stack
     mask_map: dict
         keys should match lowres tileids, values are mask file URI
+    method: str
+        'polygon' tests each tile against shapely mask outlines
+        'raster' tests tile bounding boxes in mask pixel space
+        (falls back to 'polygon' if a lowres transform is not invertible)
 
     Returns
     -------
@@ -149,6 +225,15 @@ def filter_highres_with_masks(resolved_highres, tspec_lowres, mask_map):
                      mask_map[tspec_lowres.tileId]).path)
     maskim = cv2.imread(impath, 0)
 
+    if method == 'raster':
+        if all([hasattr(tf, 'inverse_tform')
+                for tf in tspec_lowres.tforms]):
+            return filter_highres_with_mask_raster(
+                    resolved_highres, tspec_lowres, maskim)
+        logger.warning(
+                "lowres transforms for %s are not all invertible, "
+                "using polygon mask filter" % tspec_lowres.tileId)
+
     # in this case, it is easiest to outline regions where
     # mask is zero, and then include tilespecs that do
     # not intersect the mask. I think this handles some
@@ -188,11 +273,12 @@ def apply_rough_alignment(render,
                           Z,
                           apply_scale=False,
                           consolidateTransforms=True,
-                          remap_section_ids=False):
+                          remap_section_ids=False,
+                          mask_filter_method='polygon'):
     z = Z[0] # z value from the montage stack - to be mapped to the newz values in lowres stack
     newz = Z[1] # z value in the lowres stack for this montage
 
-    session=requests.session()
+    session = get_session()
     try:
         # get lowres stack tile specs
         logger.debug('getting tilespecs from {} z={}'.format(lowres_stack, z))
@@ -302,12 +388,12 @@ def apply_rough_alignment(render,
             highres_ts1 = filter_highres_with_masks(
                     resolved_highrests1,
                     lowres_ts[0],
-                    mask_map)
+                    mask_map,
+                    method=mask_filter_method)
 
         renderapi.client.import_tilespecs(
             output_stack, highres_ts1,
             sharedTransforms=sharedTransforms_highrests1, render=render)
-        session.close()
         return None
 
     except Exception as e:
@@ -343,7 +429,8 @@ class ApplyRoughAlignmentTransform(RenderModule):
                         self.args['mask_exts'],
                         apply_scale=self.args['apply_scale'],
                         consolidateTransforms=self.args['consolidate_transforms'],
-                        remap_section_ids=self.args['remap_section_ids'])
+                        remap_section_ids=self.args['remap_section_ids'],
+                        mask_filter_method=self.args['mask_filter_method'])
 
         # Create the output stack if it doesn't exist
         if self.args['output_stack'] not in self.render.run(
@@ -4,12 +4,12 @@ from rendermodules.rough_align.schemas import (
         DownsampleMaskHandlerSchema)
 from rendermodules.module.render_module import (
         RenderModule, RenderModuleException)
-import glob
 import os
 import pathlib2 as pathlib
 import numpy as np
 import cv2
 from six.moves import urllib
+from functools import partial
 from shapely.geometry import Polygon, Point
 
 
@@ -60,13 +60,16 @@ def polygon_list_from_mask(mask, transforms=None):
     return mask_polygons
 
 
-def points_in_mask(mask, pts):
+def points_in_mask(mask, pts, method='pixel'):
     """Inlier list given a mask and pts
     Parameters
     ----------
     mask : numpy array, uint8
     pts : nested list
         as read from pointmatch json. i.e. match['matches']['p']
+    method : str
+        'pixel' rounds the points and looks up the mask values directly
+        'polygon' tests the points against the mask outline polygons
 
     Returns
     -------
@@ -76,22 +79,54 @@ def points_in_mask(mask, pts):
         0.0 = point is inside of zero-value mask region
         Render retains parts of image where mask==255
     """
-    mask_list = []
-    for maskpoly in polygon_list_from_mask(mask):
-        mask_list += [1.0 if maskpoly.contains(Point(pt)) else 0.0
-                      for pt in np.array(pts).transpose()]
-    return mask_list
+    xy = np.array(pts, dtype='float').reshape(2, -1)
+    if method == 'polygon':
+        mask_polygons = polygon_list_from_mask(mask)
+        return [1.0 if any([p.contains(Point(pt)) for p in mask_polygons])
+                else 0.0 for pt in xy.transpose()]
 
+    x, y = np.round(xy).astype('int')
+    inside = (
+        (x >= 0) & (x < mask.shape[1]) &
+        (y >= 0) & (y < mask.shape[0]))
+    w = np.zeros(xy.shape[1])
+    w[inside] = (mask[y[inside], x[inside]] != 0).astype('float')
+    return w.tolist()
 
-def filter_match(m, tspecs):
-    tgroups = np.array([t.layout.sectionId for t in tspecs])
+
+def read_mask(tspec):
+    mask_path = urllib.parse.unquote(urllib.parse.urlparse(
+        tspec.ip['0'].maskUrl).path)
+    return cv2.imread(mask_path, 0)
+
+
+def filter_match(m, tspecs, masks=None):
+    """set weights of a match based on the masks of its groups
+
+    Parameters
+    ----------
+    m : dict
+        pointmatch json
+    tspecs : list of renderapi.tilespec.TileSpec
+        masked tilespecs, one per sectionId
+    masks : dict or None
+        cache of decoded masks keyed by sectionId. Populated as needed,
+        pass the same dict for many matches to decode each mask once.
+
+    Returns
+    -------
+    m : dict
+        pointmatch json with modified weights
+    """
+    masks = {} if masks is None else masks
+    tspec_map = {t.layout.sectionId: t for t in tspecs}
     for pq in ['p', 'q']:
-        tspec_ind = np.argwhere(tgroups == m[pq + 'GroupId']).flatten()
-        if tspec_ind.size > 0:
-            mask_path = urllib.parse.unquote(urllib.parse.urlparse(
-                tspecs[tspec_ind[0]].ip['0'].maskUrl).path)
-            mask = cv2.imread(mask_path, 0)
-            m['matches']['w'] = points_in_mask(mask, m['matches'][pq])
+        group = m[pq + 'GroupId']
+        if group in tspec_map:
+            if group not in masks:
+                masks[group] = read_mask(tspec_map[group])
+            m['matches']['w'] = points_in_mask(
+                masks[group], m['matches'][pq])
     return m
 
 
@@ -100,26 +135,119 @@ def reset_match(m):
     return m
 
 
+def mask_file_index(mask_dir, exts):
+    """index mask files in a directory by z
+
+    Parameters
+    ----------
+    mask_dir : str
+        directory containing masks named <z>_*.<ext>
+    exts : list of str
+        mask file extensions to recognize
+
+    Returns
+    -------
+    dict :
+        keys are int z values, values are lists of matching mask paths
+    """
+    index = {}
+    for fname in sorted(os.listdir(mask_dir)):
+        base, ext = os.path.splitext(fname)
+        zstr, sep, _ = base.partition('_')
+        if (not sep) or (ext.lstrip(os.extsep) not in exts):
+            continue
+        try:
+            z = int(zstr)
+        except ValueError:
+            continue
+        index.setdefault(z, []).append(os.path.join(mask_dir, fname))
+    return index
+
+
+def get_z_tilespec(render, stack, z):
+    """the single tilespec of a downsampled section, None if z is absent"""
+    try:
+        tspecs = renderapi.tilespec.get_tile_specs_from_z(
+                stack,
+                z,
+                render=render)
+    except RenderError:
+        return None
+
+    if len(tspecs) != 1:
+        raise RenderModuleException(
+            "Expected 1 tilespec for z=%d, found %d" % (z, len(tspecs)))
+
+    return tspecs[0]
+
+
+def update_group_matches(render, collection, tspecs, group, reset=False):
+    """filter (or reset) the weights of all matches outside of a group
+    and write them back to the collection
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+    collection : str
+        point match collection
+    tspecs : list of renderapi.tilespec.TileSpec
+        all tilespecs being handled. a match between two of these
+        groups is only handled by the worker for the lesser group
+    group : str
+        sectionId of the group to handle
+    reset : bool
+        reset all weights to 1.0 rather than filtering by mask
+
+    Returns
+    -------
+    int :
+        number of matches written
+    """
+    groups = set([t.layout.sectionId for t in tspecs])
+    matches = []
+    for m in renderapi.pointmatch.get_matches_outside_group(
+            collection,
+            group,
+            render=render):
+        other = m['qGroupId'] if m['pGroupId'] == group else m['pGroupId']
+        if (other not in groups) or (group < other):
+            matches.append(m)
+
+    masks = {}
+    for m in matches:
+        if reset:
+            reset_match(m)
+        else:
+            filter_match(m, tspecs, masks=masks)
+
+    if len(matches) > 0:
+        renderapi.pointmatch.import_matches(
+                collection,
+                matches,
+                render=render)
+    return len(matches)
+
+
 class DownsampleMaskHandler(RenderModule):
     default_schema = DownsampleMaskHandlerSchema
 
-    def get_tilespec(self, z):
-        try:
-            tspecs = renderapi.tilespec.get_tile_specs_from_z(
-                    self.args['stack'],
-                    z,
-                    render=self.render)
-        except RenderError:
-            return None
-
-        if len(tspecs) != 1:
-            raise RenderModuleException(
-                "Expected 1 tilespec for z=%d, found %d" % (z, len(tspecs)))
+    def __init__(self, *args, **kwargs):
+        super(DownsampleMaskHandler, self).__init__(*args, **kwargs)
+        self.mask_indices = {}
 
-        return tspecs[0]
+    def get_mask_index(self, exts):
+        # scan mask_dir once rather than globbing per z
+        exts = tuple(exts)
+        if exts not in self.mask_indices:
+            self.mask_indices[exts] = mask_file_index(
+                self.args['mask_dir'], exts)
+        return self.mask_indices[exts]
+
+    def get_tilespec(self, z):
+        return get_z_tilespec(self.render, self.args['stack'], z)
 
-    def add_mask_to_tilespec(self, z, exts):
-        tspec = self.get_tilespec(z)
+    def add_mask_to_tilespec(self, z, exts, tspec=None):
+        tspec = self.get_tilespec(z) if tspec is None else tspec
         if not tspec:
             return tspec
 
@@ -127,12 +255,7 @@ class DownsampleMaskHandler(RenderModule):
             raise RenderModuleException(
                     "Tilespec already has a mask for z = %d" % (z))
 
-        fnames = []
-        for ext in exts:
-            fnames += glob.glob(
-                        os.path.join(
-                            self.args['mask_dir'],
-                            '%d_*' % z + os.extsep + ext))
+        fnames = self.get_mask_index(exts).get(int(z), [])
 
         if len(fnames) != 1:
             raise RenderModuleException(
@@ -143,8 +266,8 @@ class DownsampleMaskHandler(RenderModule):
 
         return tspec
 
-    def remove_mask_from_tilespec(self, z):
-        tspec = self.get_tilespec(z)
+    def remove_mask_from_tilespec(self, z, tspec=None):
+        tspec = self.get_tilespec(z) if tspec is None else tspec
         if not tspec:
             return tspec
 
@@ -157,73 +280,49 @@ class DownsampleMaskHandler(RenderModule):
         return tspec
 
     def run(self):
-        tspecs = []
-        # add a mask for any zMask not in zReset
+        zMask = []
         if self.args['zMask']:
-            for z in np.setdiff1d(self.args['zMask'], self.args['zReset']):
-                tspec = self.add_mask_to_tilespec(z, self.args['mask_exts'])
-                if tspec:
-                    tspecs.append(tspec)
-
-        # remove a mask for any zReset
-        for z in np.setdiff1d(self.args['zReset'], None):
-            tspec = self.remove_mask_from_tilespec(z)
-            if tspec:
-                tspecs.append(tspec)
-
-        if len(tspecs) > 0:
-            renderapi.client.import_tilespecs(
-                    self.args['stack'],
-                    tspecs,
-                    render=self.render)
-            if self.args['close_stack']:
-                renderapi.stack.set_stack_state(
+            zMask = np.setdiff1d(self.args['zMask'], self.args['zReset'])
+        zReset = np.setdiff1d(self.args['zReset'], None)
+
+        with renderapi.client.WithPool(self.args['pool_size']) as pool:
+            # fetch all the section tilespecs concurrently
+            zMask_tspecs = pool.map(partial(
+                get_z_tilespec, self.render, self.args['stack']), zMask)
+            zReset_tspecs = pool.map(partial(
+                get_z_tilespec, self.render, self.args['stack']), zReset)
+
+            # add a mask for any zMask not in zReset
+            # remove a mask for any zReset
+            tspecs = [
+                self.add_mask_to_tilespec(
+                    z, self.args['mask_exts'], tspec=t)
+                for z, t in zip(zMask, zMask_tspecs) if t]
+            reset_tspecs = [
+                self.remove_mask_from_tilespec(z, tspec=t)
+                for z, t in zip(zReset, zReset_tspecs) if t]
+
+            if len(tspecs + reset_tspecs) > 0:
+                renderapi.client.import_tilespecs(
                         self.args['stack'],
-                        state='COMPLETE',
+                        tspecs + reset_tspecs,
                         render=self.render)
-
-        # filter point matches based on zMask
-        tspecs = []
-        if self.args['zMask']:
-            for z in np.setdiff1d(self.args['zMask'], self.args['zReset']):
-                tspec = self.get_tilespec(z)
-                if tspec:
-                    tspecs.append(tspec)
-            groups = [t.layout.sectionId for t in tspecs]
-            matches = []
-            for g in groups:
-                matches += renderapi.pointmatch.get_matches_outside_group(
-                        self.args['collection'],
-                        g,
-                        render=self.render)
-            for m in matches:
-                m = filter_match(m, tspecs)
-
-            renderapi.pointmatch.import_matches(
-                    self.args['collection'],
-                    matches,
-                    render=self.render)
-
-        # remove any masking for each zReset
-        tspecs = []
-        for z in np.setdiff1d(self.args['zReset'], None):
-            tspec = self.get_tilespec(z)
-            if tspec:
-                tspecs.append(tspec)
-            groups = [t.layout.sectionId for t in tspecs]
-            matches = []
-            for g in groups:
-                matches += renderapi.pointmatch.get_matches_outside_group(
-                        self.args['collection'],
-                        g,
-                        render=self.render)
-                for m in matches:
-                    m = reset_match(m)
-
-            renderapi.pointmatch.import_matches(
-                    self.args['collection'],
-                    matches,
-                    render=self.render)
+                if self.args['close_stack']:
+                    renderapi.stack.set_stack_state(
+                            self.args['stack'],
+                            state='COMPLETE',
+                            render=self.render)
+
+            # filter point matches based on zMask
+            pool.map(partial(
+                update_group_matches, self.render, self.args['collection'],
+                tspecs), [t.layout.sectionId for t in tspecs])
+
+            # remove any masking for each zReset
+            pool.map(partial(
+                update_group_matches, self.render, self.args['collection'],
+                reset_tspecs, reset=True),
+                [t.layout.sectionId for t in reset_tspecs])
 
 
 if __name__ == "__main__":
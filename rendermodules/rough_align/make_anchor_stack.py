@@ -61,21 +61,18 @@ class MakeAnchorStack(StackTransitionModule):
         z_overlap = self.get_overlapping_inputstack_zvalues(
                 zValues=transform_zs)
 
-        new_specs = []
-        for z in z_overlap:
-            tilespec = renderapi.tilespec.get_tile_specs_from_z(
-                    self.args['input_stack'],
-                    z,
-                    render=self.render)
+        def anchor_section(z, resolvedtiles):
+            tilespec = resolvedtiles.tilespecs
             if len(tilespec) != 1:
                 raise RenderModuleException(
                         "expected 1 tilespec for z = %d in stack %s, "
                         "found %d" %
                         (z, self.args['input_stack'], len(tilespec)))
             tilespec[0].tforms = list(tfj.get_matching('%d_*' % z))
-            new_specs.append(tilespec[0])
+            # anchor transforms replace any shared transform references
+            return tilespec, None
 
-        self.output_tilespecs_to_stack(new_specs)
+        self.transform_sections(anchor_section, zValues=z_overlap)
 
 
 if __name__ == "__main__":
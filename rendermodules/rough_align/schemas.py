@@ -213,6 +213,16 @@ class ApplyRoughAlignmentTransformParameters(RenderParameters):
         required=False,
         default=False,
         description="should the tiles written be filtered by the masks?")
+    mask_filter_method = Str(
+        required=False,
+        default='polygon',
+        missing='polygon',
+        validate=mm.validate.OneOf(['polygon', 'raster']),
+        description=("how tiles are tested against masks. 'polygon' "
+                     "intersects tile and mask outlines with shapely, "
+                     "'raster' checks tile bounding boxes in mask pixel "
+                     "space with a summed-area table (faster, "
+                     "slightly more conservative)"))
     mask_exts = List(
         Str,
         required=False,
@@ -341,7 +351,7 @@ class ApplyRoughAlignmentOutputParameters(DefaultSchema):
             description="stack where applied transforms were set")
 
 
-class DownsampleMaskHandlerSchema(RenderParameters):
+class DownsampleMaskHandlerSchema(RenderParameters, ProcessPoolParameters):
     stack = argschema.fields.Str(
         required=True,
         description="stack that is read and modified with masks")
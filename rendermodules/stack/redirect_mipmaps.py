@@ -50,20 +50,16 @@ class RedirectMipMapsModule(StackTransitionModule):
                      for i in
                      self.args['new_mipmap_directories']}
         zs = self.get_overlapping_inputstack_zvalues()
-        for z in zs:
-            resolvedtiles = renderapi.resolvedtiles.get_resolved_tiles_from_z(
-                self.input_stack, z, render=self.render)
-            tspecs = resolvedtiles.tilespecs
-            tforms = resolvedtiles.transforms
 
+        def redirect_section(z, resolvedtiles):
             new_tspecs = []
-            for ts in tspecs:
+            for ts in resolvedtiles.tilespecs:
                 ts_new = copy.copy(ts)
                 ts_new.ip = self.get_replacement_ImagePyramid(ts.ip, mmL_d_map)
                 new_tspecs.append(ts_new)
+            return new_tspecs, resolvedtiles.transforms
 
-            self.output_tilespecs_to_stack(
-                new_tspecs, sharedTransforms=tforms, zValues=[z])
+        self.transform_sections(redirect_section, zValues=zs)
 
         self.output({
             "zValues": zs,
@@ -39,17 +39,17 @@ class RemapZsModule(StackTransitionModule):
                 "zValues with length {} cannot be mapped to "
                 "zValues with length {}".format(
                     len(self.zValues), len(self.args['new_zValues'])))
-        for z, newz in zip(self.zValues, self.args['new_zValues']):
-            resolvedtiles = renderapi.resolvedtiles.get_resolved_tiles_from_z(
-                self.input_stack, z, render=self.render)
+        newz_map = dict(zip(self.zValues, self.args['new_zValues']))
+
+        def remap_section(z, resolvedtiles):
+            newz = newz_map[z]
             for ts in resolvedtiles.tilespecs:
                 ts.z = newz
                 if self.args.get('remap_sectionId'):
                     ts.layout.sectionId = self.sectionId_from_z(newz)
-            self.output_tilespecs_to_stack(
-                resolvedtiles.tilespecs,
-                sharedTransforms=resolvedtiles.transforms,
-                zValues=[z])
+            return resolvedtiles.tilespecs, resolvedtiles.transforms
+
+        self.transform_sections(remap_section)
         self.output({
             "zValues": self.zValues,
             "output_stack": self.output_stack
@@ -93,6 +93,14 @@ class SwapZsParameters(RenderParameters):
         default=5,
         missing=5,
         description="Pool size")
+    journal_directory = Str(
+        required=False,
+        default=None,
+        missing=None,
+        description=("directory for rollback journals of in-progress swaps. "
+                     "Journals of interrupted swaps can be restored with "
+                     "swap_zs.rollback_swap. Default keeps journals "
+                     "in memory only"))
 
 class SwapZsOutput(DefaultSchema):
     source_stacks = List(
@@ -1,8 +1,10 @@
+import json
+import logging
+import os
 import renderapi
 from rendermodules.module.render_module import RenderModule, RenderModuleException
 from rendermodules.stack.schemas import SwapZsParameters, SwapZsOutput
-import time
-import requests
+from rendermodules.utilities.pool_utils import WithThreadPool
 from functools import partial
 
 example = {
@@ -19,6 +21,8 @@ example = {
     "delete_source_stack": "False"
 }
 
+logger = logging.getLogger(__name__)
+
 def delete_temp_stacks(render, temp_stack_list):
     for temps in temp_stack_list:
         try:
@@ -27,58 +31,110 @@ def delete_temp_stacks(render, temp_stack_list):
             print("Could not delete stack {}".format(temps))
 
 
-def swap_section(render, source_stack, target_stack, z, pool_size=5):
-    session = requests.Session()
-    session.mount('http://', requests.adapters.HTTPAdapter(max_retries=5))
-
-    source_ts = renderapi.resolvedtiles.get_resolved_tiles_from_z(source_stack, z, render=render)
-    target_ts = renderapi.resolvedtiles.get_resolved_tiles_from_z(target_stack, z, render=render)
-
-    source_tileids = [ts.tileId for ts in source_ts.tilespecs]
-    target_tileids = [ts.tileId for ts in target_ts.tilespecs]
-
-    if set(source_tileids) & set(target_tileids):
-        print("{} and {} stack have same tileIds for Z = {}".format(source_stack, target_stack, z))
-        return False
-
-    # write these tilespecs to the appropriate stacks
-    try:
-        renderapi.stack.set_stack_state(source_stack, "LOADING", render=render)
-        render.run(renderapi.client.import_tilespecs_parallel,
-                   source_stack,
-                   target_ts.tilespecs,
-                   sharedTransforms=target_ts.transforms,
-                   poolsize=pool_size,
-                   close_stack=False)
-    except Exception as e:
-        print("Cannot import tilespecs to {} from {}".format(source_stack, target_stack))
-        return False
+def swap_journal_path(journal_directory, source_stack, target_stack, z):
+    return os.path.join(journal_directory, "swap_{}_{}_{}.json".format(
+        source_stack, target_stack, float(z)))
+
+
+def write_swap_journal(journal_file, source_stack, target_stack, z,
+                       source_rts, target_rts):
+    with open(journal_file, 'w') as f:
+        renderapi.utils.renderdump({
+            "source_stack": source_stack,
+            "target_stack": target_stack,
+            "z": z,
+            "source": source_rts.to_dict(),
+            "target": target_rts.to_dict()}, f)
+
+
+def restore_section(render, stack, z, rts):
+    renderapi.stack.delete_section(stack, z, render=render)
+    if rts.tilespecs:
+        renderapi.client.import_tilespecs(
+            stack, rts.tilespecs, sharedTransforms=rts.transforms,
+            render=render)
+
+
+def rollback_swap(render, journal_file):
+    """restore both sections of an interrupted swap from its journal
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    journal_file : str
+        journal written by swap_section_bulk
+    """
+    with open(journal_file, 'r') as f:
+        j = json.load(f)
+    for stack, key in [(j['source_stack'], 'source'),
+                       (j['target_stack'], 'target')]:
+        restore_section(
+            render, stack, j['z'],
+            renderapi.resolvedtiles.ResolvedTiles(json=j[key]))
+    os.remove(journal_file)
+
+
+def swap_section_bulk(render, source_stack, target_stack, z,
+                      journal_directory=None):
+    """swap a section between two stacks with section deletes and one
+    import per stack.  The original sections are journaled so that a
+    failed swap is rolled back, and a crashed swap can be restored
+    with rollback_swap.
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object
+    source_stack : str
+        first stack
+    target_stack : str
+        second stack
+    z : float
+        section to swap
+    journal_directory : str or None
+        directory for the on-disk journal.  If None the journal
+        is only held in memory
+
+    Returns
+    -------
+    bool
+        whether the section was swapped
+    """
+    source_ts = renderapi.resolvedtiles.get_resolved_tiles_from_z(
+        source_stack, z, render=render)
+    target_ts = renderapi.resolvedtiles.get_resolved_tiles_from_z(
+        target_stack, z, render=render)
+
+    journal_file = None
+    if journal_directory is not None:
+        journal_file = swap_journal_path(
+            journal_directory, source_stack, target_stack, z)
+        write_swap_journal(journal_file, source_stack, target_stack, z,
+                           source_ts, target_ts)
 
     try:
-        renderapi.stack.set_stack_state(target_stack, "LOADING", render=render)
-        render.run(renderapi.client.import_tilespecs_parallel,
-                   target_stack,
-                   source_ts.tilespecs,
-                   sharedTransforms=source_ts.transforms,
-                   poolsize=pool_size,
-                   close_stack=False)
+        restore_section(render, source_stack, z, target_ts)
+        restore_section(render, target_stack, z, source_ts)
     except Exception as e:
-        print("Cannot import tilespecs to {} from {}".format(target_stack, source_stack))
-        return False
-    
-    try:
-        for ts in source_ts.tilespecs:
-            renderapi.stack.delete_tile(source_stack, ts.tileId, session=session, render=render)
-    except Exception as e:
-        print("Cannot delete old tile ids from {}, error: e".format(source_stack, e))
-    
-    try:
-        for ts in target_ts.tilespecs:
-            renderapi.stack.delete_tile(target_stack, ts.tileId, session=session, render=render)
-    except Exception as e:
-        print("Cannot delete old tile ids from {}, error: e".format(target_stack, e))
-    
-    return True
+        logger.error("swap of z {} between {} and {} failed, "
+                     "rolling back: {}".format(
+                         z, source_stack, target_stack, e))
+        try:
+            restore_section(render, source_stack, z, source_ts)
+            restore_section(render, target_stack, z, target_ts)
+        except Exception as e:  # pragma: no cover
+            logger.error("rollback of z {} failed, restore from "
+                         "journal {}: {}".format(z, journal_file, e))
+            return False
+    else:
+        if journal_file is not None:
+            os.remove(journal_file)
+        return True
+
+    if journal_file is not None:
+        os.remove(journal_file)
+    return False
 
 
 class SwapZsModule(RenderModule):
@@ -116,15 +172,15 @@ class SwapZsModule(RenderModule):
             #target_stacks.append(target_stack)
             #zvalues.append(final_zs)
             print(final_zs)
-            #mypartial = partial(swap_section, self.render, source_stack, target_stack)
 
-            #with renderapi.client.WithPool(self.args['pool_size']) as pool:
-            #    output_bool = pool.map(mypartial, final_zs)
-        
-            output_bool = []
-            for z in final_zs:
-                outbool = swap_section(self.render, source_stack, target_stack, z)
-                output_bool.append(outbool)
+            renderapi.stack.set_stack_state(source_stack, "LOADING", render=self.render)
+            renderapi.stack.set_stack_state(target_stack, "LOADING", render=self.render)
+
+            mypartial = partial(
+                swap_section_bulk, self.render, source_stack, target_stack,
+                journal_directory=self.args['journal_directory'])
+            with WithThreadPool(self.args['pool_size']) as pool:
+                output_bool = pool.map(mypartial, final_zs)
 
             for z, n in zip(final_zs, output_bool):
                 if n:
@@ -0,0 +1,17 @@
+"""
+pool utilities shared across modules
+"""
+from multiprocessing.pool import ThreadPool
+
+
+# FIXME this should be provided in render-python external
+class WithThreadPool(ThreadPool):
+    def __init__(self, *args, **kwargs):
+        super(WithThreadPool, self).__init__(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+        self.join()
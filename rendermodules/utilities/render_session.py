@@ -0,0 +1,122 @@
+"""
+pooled, retrying http sessions shared by render-ws calls
+"""
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
+import renderapi
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(pool_maxsize=16, max_retries=5, backoff_factor=0.5,
+                 status_forcelist=(502, 503, 504)):
+    """create a keep-alive session with retry and backoff
+
+    Parameters
+    ----------
+    pool_maxsize : int
+        maximum number of connections kept alive per host,
+        which also bounds the concurrency of threads sharing the session
+    max_retries : int
+        number of times a failed request is retried
+    backoff_factor : float
+        retries sleep backoff_factor * 2 ** (retry - 1) seconds
+    status_forcelist : tuple of int
+        http status codes which trigger a retry.  Connection errors are
+        always retried.  render-ws answers 500 to many deterministic
+        errors (e.g. a missing stack), so 500 is not retried by default
+
+    Returns
+    -------
+    requests.Session
+    """
+    # let the last response through so that renderapi raises RenderError
+    retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                  status_forcelist=status_forcelist, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                          pool_maxsize=pool_maxsize, pool_block=True,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(**kwargs):
+    """get the pooled session of this process, creating it if needed.
+    Sessions are keyed by process id so that forked pool workers
+    open their own connections rather than sharing the parent's sockets.
+
+    Parameters
+    ----------
+    kwargs
+        keyword arguments to make_session used if a session is created
+
+    Returns
+    -------
+    requests.Session
+    """
+    key = (os.getpid(), tuple(sorted(kwargs.items())))
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = make_session(**kwargs)
+        return _sessions[key]
+
+
+def connect(session=None, **kwargs):
+    """renderapi.connect using the pooled session of this process
+
+    Parameters
+    ----------
+    session : requests.Session or None
+        session to use.  Defaults to get_session()
+    kwargs
+        keyword arguments to renderapi.connect
+
+    Returns
+    -------
+    renderapi.render.RenderClient
+    """
+    session = get_session() if session is None else session
+    return renderapi.connect(session=session, **kwargs)
+
+
+def _get_resolved_tiles(render, stack_z):
+    stack, z = stack_z
+    return renderapi.resolvedtiles.get_resolved_tiles_from_z(
+        stack, z, render=render, session=render.session)
+
+
+def get_resolved_tiles_from_zs(render, stack_zs, pool_size=8):
+    """concurrently fetch resolved tiles for a list of sections
+
+    Parameters
+    ----------
+    render : renderapi.render.Render
+        render connect object.  Its session is shared by all threads
+    stack_zs : list of tuple
+        (stack, z) pairs to fetch
+    pool_size : int
+        number of concurrent requests
+
+    Returns
+    -------
+    list of renderapi.resolvedtiles.ResolvedTiles
+        resolved tiles ordered as stack_zs
+    """
+    stack_zs = list(stack_zs)
+    if pool_size <= 1 or len(stack_zs) <= 1:
+        return [_get_resolved_tiles(render, sz) for sz in stack_zs]
+    pool = ThreadPool(min(pool_size, len(stack_zs)))
+    try:
+        return pool.map(
+            lambda sz: _get_resolved_tiles(render, sz), stack_zs)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,124 @@
+"""
+local on-disk cache of ResolvedTiles for repeated section reads
+"""
+import gzip
+import json
+import os
+import tempfile
+
+import renderapi
+from six.moves import urllib
+
+
+def resolvedtiles_cache_path(cache_dir, render, stack, z):
+    """path of the cached ResolvedTiles for a section.  The cache is
+    keyed by (host, port, owner, project, stack, z)
+
+    Parameters
+    ----------
+    cache_dir : str
+        root directory of the cache
+    render : renderapi.render.Render
+        render connect object defining host, port, owner and project
+    stack : str
+        render stack
+    z : float
+        section z value
+
+    Returns
+    -------
+    str
+        path to gzipped json of the section's ResolvedTiles
+    """
+    def quote(v):
+        return urllib.parse.quote(str(v), safe='')
+    return os.path.join(
+        cache_dir,
+        quote('{}:{}'.format(render.DEFAULT_HOST, render.DEFAULT_PORT)),
+        quote(render.DEFAULT_OWNER), quote(render.DEFAULT_PROJECT),
+        quote(stack), '{}.json.gz'.format(float(z)))
+
+
+def read_cached_resolvedtiles(path, lastModifiedTimestamp):
+    """read ResolvedTiles from the cache if they are still current
+
+    Returns
+    -------
+    renderapi.resolvedtiles.ResolvedTiles or None
+        cached ResolvedTiles, None if missing, unreadable or stale
+    """
+    try:
+        with gzip.open(path, 'rb') as f:
+            d = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+    if d.get('lastModifiedTimestamp') != lastModifiedTimestamp:
+        return None
+    return renderapi.resolvedtiles.ResolvedTiles(json=d['resolvedTiles'])
+
+
+def write_cached_resolvedtiles(path, resolvedtiles, lastModifiedTimestamp):
+    """atomically write ResolvedTiles to the cache"""
+    cache_subdir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_subdir)
+    except OSError:
+        if not os.path.isdir(cache_subdir):
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=cache_subdir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(renderapi.utils.renderdumps({
+                'lastModifiedTimestamp': lastModifiedTimestamp,
+                'resolvedTiles': resolvedtiles.to_dict()}).encode('utf-8'))
+        # mkstemp creates 0600 files, a shared cache must be readable
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def get_resolved_tiles_from_z(stack, z, render, cache_dir, session=None):
+    """get_resolved_tiles_from_z through a local cache invalidated
+    by the stack's lastModifiedTimestamp
+
+    Parameters
+    ----------
+    stack : str
+        render stack
+    z : float
+        section z value
+    render : renderapi.render.Render
+        render connect object
+    cache_dir : str
+        root directory of the cache
+    session : requests.Session or None
+        session to use for render-ws requests
+
+    Returns
+    -------
+    renderapi.resolvedtiles.ResolvedTiles
+    """
+    lastModifiedTimestamp = render.run(
+        renderapi.stack.get_full_stack_metadata, stack,
+        session=session).get('lastModifiedTimestamp')
+    path = resolvedtiles_cache_path(cache_dir, render, stack, z)
+
+    # stacks without a modification time cannot be invalidated
+    if lastModifiedTimestamp is not None:
+        resolvedtiles = read_cached_resolvedtiles(
+            path, lastModifiedTimestamp)
+        if resolvedtiles is not None:
+            return resolvedtiles
+
+    resolvedtiles = render.run(
+        renderapi.resolvedtiles.get_resolved_tiles_from_z, stack, z,
+        session=session)
+    if lastModifiedTimestamp is not None:
+        write_cached_resolvedtiles(
+            path, resolvedtiles, lastModifiedTimestamp)
+    return resolvedtiles
@@ -84,8 +84,11 @@ def truncatefile(fn, l):
 @pytest.mark.parametrize("excluded_keys", [
     [], ["minRow", "maxRow",
          "minCol", "maxCol"]])
+@pytest.mark.parametrize("header_only,scan_directories", [
+    (False, False), (True, False), (True, True)])
 def test_validate_materialization(
-        basedir_mvparams_mvfiles, tmpdir, excluded_keys):
+        basedir_mvparams_mvfiles, tmpdir, excluded_keys,
+        header_only, scan_directories):
     basedir, mvparams, mvfiles = basedir_mvparams_mvfiles
     materialized_basedir = os.path.join(
         basedir, mvparams.project, mvparams.stack,
@@ -112,7 +115,10 @@ def test_validate_materialization(
         "minZ": mvparams.minZ,
         "maxZ": mvparams.maxZ,
         "basedir": materialized_basedir,
-        "pool_size": pool_size
+        "pool_size": pool_size,
+        "header_only": header_only,
+        "scan_directories": scan_directories,
+        "failures_file": os.path.join(str(tmpdir), 'failures.txt')
     }
     # exclude keys
     d = {k: v for k, v in d.items() if k not in excluded_keys}
@@ -122,13 +128,18 @@ def test_validate_materialization(
     with open(output_json, 'r') as f:
         output_d = json.load(f)
     assert not set(output_d['failures']) ^ {truncfn, badfn}
+    with open(d['failures_file'], 'r') as f:
+        assert not set(f.read().splitlines()) ^ {truncfn, badfn}
 
 
-def test_delete_materialization(basedir_mvparams_mvfiles):
+def test_delete_materialization(basedir_mvparams_mvfiles, tmpdir_factory):
     basedir, mvparams, mvfiles = basedir_mvparams_mvfiles
     materialized_basedir = os.path.join(
         basedir, mvparams.project, mvparams.stack,
         "{}x{}".format(mvparams.width, mvparams.height))
+    # z directories without rows are removed too
+    os.makedirs(os.path.join(
+        materialized_basedir, '1', str(mvparams.minZ)))
     # run deletion
     d = {
         "minZ": mvparams.minZ,
@@ -136,7 +147,10 @@ def test_delete_materialization(basedir_mvparams_mvfiles):
         "basedir": materialized_basedir,
         "pool_size": pool_size
     }
-    mod = DeleteMaterializedSectionsModule(input_data=d, args=[])
+    output_json = os.path.join(
+        str(tmpdir_factory.mktemp('output')), 'delete_output.json')
+    mod = DeleteMaterializedSectionsModule(
+        input_data=d, args=['--output_json', output_json])
     mod.run()
     # verify tiles deleted (removedirs should remove basedir)
     try:
@@ -145,3 +159,28 @@ def test_delete_materialization(basedir_mvparams_mvfiles):
     except OSError as e:
         if e.errno != errno.ENOENT:
             raise
+
+
+def test_delete_materialization_dry_run(basedir_mvparams_mvfiles, tmpdir):
+    basedir, mvparams, mvfiles = basedir_mvparams_mvfiles
+    materialized_basedir = os.path.join(
+        basedir, mvparams.project, mvparams.stack,
+        "{}x{}".format(mvparams.width, mvparams.height))
+    output_json = os.path.join(str(tmpdir), 'delete_output.json')
+    d = {
+        "minZ": mvparams.minZ,
+        "maxZ": mvparams.maxZ,
+        "basedir": materialized_basedir,
+        "pool_size": pool_size,
+        "dry_run": True
+    }
+    mod = DeleteMaterializedSectionsModule(
+        input_data=d, args=['--output_json', output_json])
+    mod.run()
+    with open(output_json, 'r') as f:
+        output_d = json.load(f)
+    # nothing deleted, everything counted
+    assert all([os.path.isfile(fn) for fn in mvfiles])
+    assert output_d['num_files'] == len(mvfiles)
+    assert output_d['num_bytes'] == sum(
+        [os.path.getsize(fn) for fn in mvfiles])
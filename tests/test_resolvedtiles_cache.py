@@ -0,0 +1,85 @@
+import os
+import stat
+from unittest import mock
+
+import pytest
+import renderapi
+
+from rendermodules.utilities import resolvedtiles_cache
+
+
+class FakeRender(object):
+    DEFAULT_HOST = "http://render"
+    DEFAULT_PORT = 8080
+    DEFAULT_OWNER = "owner"
+    DEFAULT_PROJECT = "project"
+
+    def run(self, f, *args, **kwargs):
+        return f(*args, render=self, **kwargs)
+
+
+def make_resolvedtiles(tileId):
+    return renderapi.resolvedtiles.ResolvedTiles(
+        [renderapi.tilespec.TileSpec(tileId=tileId, z=1, width=10, height=10,
+                                     tforms=[renderapi.transform.AffineModel()])],
+        [])
+
+
+@pytest.fixture
+def render_calls():
+    metadata = {'lastModifiedTimestamp': 1}
+    tileIds = iter(['tile{}'.format(i) for i in range(10)])
+    with mock.patch('renderapi.stack.get_full_stack_metadata',
+                    side_effect=lambda *a, **k: dict(metadata)), \
+            mock.patch('renderapi.resolvedtiles.get_resolved_tiles_from_z',
+                       side_effect=lambda *a, **k: make_resolvedtiles(
+                           next(tileIds))) as get_rts:
+        yield metadata, get_rts
+
+
+def get_tileIds(render, tmpdir):
+    rts = resolvedtiles_cache.get_resolved_tiles_from_z(
+        "stack", 1, render, str(tmpdir))
+    return [ts.tileId for ts in rts.tilespecs]
+
+
+def test_resolvedtiles_cache_hit(render_calls, tmpdir):
+    metadata, get_rts = render_calls
+    render = FakeRender()
+    umask = os.umask(0o022)
+    try:
+        assert get_tileIds(render, tmpdir) == ['tile0']
+    finally:
+        os.umask(umask)
+    # served from the cache without another request
+    assert get_tileIds(render, tmpdir) == ['tile0']
+    assert get_rts.call_count == 1
+
+    path = resolvedtiles_cache.resolvedtiles_cache_path(
+        str(tmpdir), render, "stack", 1)
+    assert os.path.isfile(path)
+    # readable by other users of a shared cache
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+
+def test_resolvedtiles_cache_stale(render_calls, tmpdir):
+    metadata, get_rts = render_calls
+    render = FakeRender()
+    assert get_tileIds(render, tmpdir) == ['tile0']
+    # a modified stack invalidates the cached section
+    metadata['lastModifiedTimestamp'] = 2
+    assert get_tileIds(render, tmpdir) == ['tile1']
+    assert get_tileIds(render, tmpdir) == ['tile1']
+    assert get_rts.call_count == 2
+
+
+def test_resolvedtiles_cache_no_timestamp(render_calls, tmpdir):
+    metadata, get_rts = render_calls
+    render = FakeRender()
+    metadata['lastModifiedTimestamp'] = None
+    # stacks without a modification time are never cached
+    assert get_tileIds(render, tmpdir) == ['tile0']
+    assert get_tileIds(render, tmpdir) == ['tile1']
+    assert get_rts.call_count == 2
+    assert not os.path.isfile(resolvedtiles_cache.resolvedtiles_cache_path(
+        str(tmpdir), render, "stack", 1))